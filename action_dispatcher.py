@@ -1,8 +1,10 @@
 import json
+import time
 import asyncio
-from telethon import TelegramClient
+from datetime import datetime
+from telethon import TelegramClient, errors
 from telethon.sessions import StringSession
-from proxies import get_random_proxy
+from proxy_pool import get_random_proxy
 
 from rank_actions import ActionType
 
@@ -11,37 +13,157 @@ API_HASH = "c723c6a76df29fa005b8ad1080a95a1d"
 
 ACTIONS_FILE = "rank_actions.json"
 SESSIONS_FILE = "session_status.json"
-
-
-async def send_notification(client, user_id, message):
-    try:
-        await client.send_message(user_id, message)
-        return True
-    except Exception as e:
-        print(f"[!] Failed to send message to {user_id}: {e}")
-        return False
-
-
-async def handle_action(action, sessions):
-    session_data = sessions.get(action["asset_name"])
-    if not session_data:
-        print(f"[!] No session found for {action['asset_name']}")
-        return
-
-    session_string = session_data.get("string")
-    if not session_string:
-        print(f"[!] Session string missing for {action['asset_name']}")
-        return
-
-    proxy = session_data.get("proxy") or get_random_proxy()
-    async with TelegramClient(StringSession(session_string), API_ID, API_HASH, proxy=proxy) as client:
-        message = f"נכס {action['asset_name']} ירד למקום {action['rank']} בחיפוש עבור '{action['keyword']}'."
-        if action["action"] == ActionType.SUGGEST_REPLACEMENT:
-            message += "\nנשקל לספק נכס חלופי."
-        elif action["action"] == ActionType.REFUND_PARTIAL:
-            message += "\nיוחזר חלק מהתשלום בהתאם."
-
-        await send_notification(client, user_id=action["target_id"], message=message)
+RESULTS_FILE = "action_results.json"
+
+MAX_CONNECTED_CLIENTS = 10   # sessions connected at the same time
+MAX_CONCURRENT_SENDS = 20    # sends in flight across all sessions
+PER_SESSION_SENDS = 3        # sends in flight per session
+MAX_FLOOD_WAIT = 300         # longer FloodWaits fail the action instead of waiting
+MAX_ATTEMPTS = 3
+
+
+def to_telethon_proxy(proxy):
+    """proxy_pool returns (ip, port, user, pass); Telethon expects (type, addr, port, rdns, user, pass)."""
+    if not proxy or isinstance(proxy, dict) or len(proxy) != 4:
+        return proxy
+    ip, port, user, password = proxy
+    return ("socks5", ip, int(port), True, user, password)
+
+
+def build_message(action):
+    message = f"נכס {action['asset_name']} ירד למקום {action['rank']} בחיפוש עבור '{action['keyword']}'."
+    if action["action"] == ActionType.SUGGEST_REPLACEMENT:
+        message += "\nנשקל לספק נכס חלופי."
+    elif action["action"] == ActionType.REFUND_PARTIAL:
+        message += "\nיוחזר חלק מהתשלום בהתאם."
+    return message
+
+
+def make_result(action, status, error=None, attempts=0):
+    return {
+        "asset_name": action.get("asset_name"),
+        "keyword": action.get("keyword"),
+        "target_id": action.get("target_id"),
+        "action": action.get("action"),
+        "status": status,
+        "error": error,
+        "attempts": attempts,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+class SessionGroup:
+    """All actions that are sent through one session, over one connected client."""
+
+    def __init__(self, session_data, actions):
+        self.session_data = session_data
+        self.actions = actions
+        self.semaphore = asyncio.Semaphore(PER_SESSION_SENDS)
+        # monotonic time until which this session is rate limited by Telegram
+        self.flood_until = 0.0
+
+    async def wait_flood(self):
+        """Sleep until this session's FloodWait (if any) has passed."""
+        delay = self.flood_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            # another send may have extended the pause meanwhile
+            delay = self.flood_until - time.monotonic()
+
+    async def send(self, client, action, global_semaphore):
+        message = build_message(action)
+        last_error = None
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            backoff = 0
+            while True:
+                await self.wait_flood()
+                async with self.semaphore, global_semaphore:
+                    # a FloodWait may have been hit while this send was queued
+                    if self.flood_until > time.monotonic():
+                        continue
+                    try:
+                        await client.send_message(action["target_id"], message)
+                        return make_result(action, "sent", attempts=attempt)
+                    except errors.FloodWaitError as e:
+                        last_error = f"FloodWait {e.seconds}s"
+                        if e.seconds > MAX_FLOOD_WAIT:
+                            backoff = None
+                        else:
+                            # pause the whole session, not only this action
+                            self.flood_until = max(self.flood_until, time.monotonic() + e.seconds)
+                    except Exception as e:
+                        last_error = str(e)
+                        backoff = 2 ** attempt
+                break
+
+            if backoff is None:
+                break
+            # back off without holding the semaphores, and not after the last attempt
+            if backoff and attempt < MAX_ATTEMPTS:
+                await asyncio.sleep(backoff)
+
+        print(f"[!] Failed to send message to {action['target_id']}: {last_error}")
+        return make_result(action, "failed", error=last_error, attempts=attempt)
+
+    async def dispatch(self, client_semaphore, global_semaphore):
+        session_string = self.session_data.get("string")
+        proxy = to_telethon_proxy(self.session_data.get("proxy") or get_random_proxy())
+
+        async with client_semaphore:
+            try:
+                async with TelegramClient(StringSession(session_string), API_ID, API_HASH, proxy=proxy) as client:
+                    return await asyncio.gather(*(
+                        self.send(client, action, global_semaphore) for action in self.actions
+                    ))
+            except Exception as e:
+                print(f"[!] Session connection failed: {e}")
+                return [make_result(action, "failed", error=f"connect: {e}") for action in self.actions]
+
+
+def group_actions(actions, sessions):
+    """Group actions by session string; actions without a usable session or target are skipped."""
+    groups = {}
+    skipped = []
+
+    for action in actions:
+        session_data = sessions.get(action["asset_name"])
+        if not session_data:
+            print(f"[!] No session found for {action['asset_name']}")
+            skipped.append(make_result(action, "skipped", error="no session"))
+            continue
+
+        session_string = session_data.get("string")
+        if not session_string:
+            print(f"[!] Session string missing for {action['asset_name']}")
+            skipped.append(make_result(action, "skipped", error="no session string"))
+            continue
+
+        if not action.get("target_id"):
+            print(f"[!] Target missing for {action['asset_name']}")
+            skipped.append(make_result(action, "skipped", error="no target_id"))
+            continue
+
+        group = groups.get(session_string)
+        if group is None:
+            group = groups[session_string] = SessionGroup(session_data, [])
+        group.actions.append(action)
+
+    return list(groups.values()), skipped
+
+
+async def dispatch_actions(actions, sessions):
+    groups, results = group_actions(actions, sessions)
+
+    client_semaphore = asyncio.Semaphore(MAX_CONNECTED_CLIENTS)
+    global_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+    for group_results in await asyncio.gather(*(
+        group.dispatch(client_semaphore, global_semaphore) for group in groups
+    )):
+        results.extend(group_results)
+
+    return results
 
 
 async def main():
@@ -51,7 +173,16 @@ async def main():
     with open(SESSIONS_FILE, "r", encoding="utf-8") as f:
         sessions = json.load(f)
 
-    await asyncio.gather(*(handle_action(a, sessions) for a in actions))
+    started = time.monotonic()
+    results = await dispatch_actions(actions, sessions)
+
+    with open(RESULTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    print(f"[✔] Dispatched {len(results)} actions in {time.monotonic() - started:.1f}s: {counts}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+-- טבלאות סיכום (rollup) לסטטיסטיקות הכנסות והוצאות, מתעדכנות בטריגרים
+-- כך ששאילתות הסטטיסטיקה קוראות שורה אחת במקום לסרוק את כל ההיסטוריה
+
+-- הכנסות לפי יום (תשלומים בלבד)
+CREATE TABLE IF NOT EXISTS daily_revenue (
+    day DATE PRIMARY KEY,
+    revenue NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    payments INTEGER NOT NULL DEFAULT 0
+);
+
+-- הוצאות לפי משתמש
+CREATE TABLE IF NOT EXISTS user_spending (
+    user_telegram_id BIGINT PRIMARY KEY,
+    total_spent NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    total_rentals INTEGER NOT NULL DEFAULT 0,
+    unique_keywords INTEGER NOT NULL DEFAULT 0
+);
+
+-- השכרות ומילות מפתח שכבר נספרו למשתמש (לספירת ערכים ייחודיים בהדרגה)
+CREATE TABLE IF NOT EXISTS user_spending_rentals (
+    user_telegram_id BIGINT NOT NULL,
+    rental_id INTEGER NOT NULL,
+    PRIMARY KEY (user_telegram_id, rental_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_spending_keywords (
+    user_telegram_id BIGINT NOT NULL,
+    keyword VARCHAR(255) NOT NULL,
+    PRIMARY KEY (user_telegram_id, keyword)
+);
+
+-- מוני השכרות לפי נכס
+CREATE TABLE IF NOT EXISTS asset_rental_stats (
+    asset_id INTEGER PRIMARY KEY,
+    total_rentals INTEGER NOT NULL DEFAULT 0,
+    active_rentals INTEGER NOT NULL DEFAULT 0,
+    expired_rentals INTEGER NOT NULL DEFAULT 0,
+    canceled_rentals INTEGER NOT NULL DEFAULT 0,
+    total_hours BIGINT NOT NULL DEFAULT 0,
+    total_revenue NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    last_rental_id INTEGER,
+    last_rental_at TIMESTAMP
+);
+
+-- עסקה חדשה: הכנסה יומית והוצאות המשתמש (טבלת transactions היא יומן שרק מוסיפים אליו)
+CREATE OR REPLACE FUNCTION rollup_transaction() RETURNS trigger AS $$
+DECLARE
+    is_payment BOOLEAN := NEW.transaction_type = 'payment';
+    new_rentals INTEGER := 0;
+    new_keywords INTEGER := 0;
+    rental_keyword VARCHAR(255);
+BEGIN
+    IF is_payment THEN
+        INSERT INTO daily_revenue (day, revenue, payments)
+        VALUES (DATE(COALESCE(NEW.created_at, NOW())), NEW.amount, 1)
+        ON CONFLICT (day) DO UPDATE SET
+            revenue = daily_revenue.revenue + EXCLUDED.revenue,
+            payments = daily_revenue.payments + 1;
+    END IF;
+
+    IF NEW.user_telegram_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    IF NEW.rental_id IS NOT NULL THEN
+        INSERT INTO user_spending_rentals (user_telegram_id, rental_id)
+        VALUES (NEW.user_telegram_id, NEW.rental_id)
+        ON CONFLICT DO NOTHING;
+        GET DIAGNOSTICS new_rentals = ROW_COUNT;
+
+        SELECT keyword INTO rental_keyword FROM rentals WHERE id = NEW.rental_id;
+        IF rental_keyword IS NOT NULL THEN
+            INSERT INTO user_spending_keywords (user_telegram_id, keyword)
+            VALUES (NEW.user_telegram_id, rental_keyword)
+            ON CONFLICT DO NOTHING;
+            GET DIAGNOSTICS new_keywords = ROW_COUNT;
+        END IF;
+    END IF;
+
+    INSERT INTO user_spending (user_telegram_id, total_spent, total_rentals, unique_keywords)
+    VALUES (
+        NEW.user_telegram_id,
+        CASE WHEN is_payment THEN NEW.amount ELSE 0 END,
+        new_rentals,
+        new_keywords
+    )
+    ON CONFLICT (user_telegram_id) DO UPDATE SET
+        total_spent = user_spending.total_spent + EXCLUDED.total_spent,
+        total_rentals = user_spending.total_rentals + EXCLUDED.total_rentals,
+        unique_keywords = user_spending.unique_keywords + EXCLUDED.unique_keywords;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_rollup ON transactions;
+CREATE TRIGGER transactions_rollup
+    AFTER INSERT ON transactions
+    FOR EACH ROW EXECUTE FUNCTION rollup_transaction();
+
+-- השכרה שנוספה/השתנתה/נמחקה: מחסירים את תרומת השורה הישנה ומוסיפים את החדשה
+CREATE OR REPLACE FUNCTION apply_asset_rental_delta(r rentals, direction INTEGER) RETURNS void AS $$
+BEGIN
+    IF r.asset_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO asset_rental_stats AS s (
+        asset_id, total_rentals, active_rentals, expired_rentals, canceled_rentals,
+        total_hours, total_revenue
+    )
+    VALUES (
+        r.asset_id,
+        direction,
+        CASE WHEN r.status IN ('active', 'monitoring', 'expiring') THEN direction ELSE 0 END,
+        CASE WHEN r.status = 'expired' THEN direction ELSE 0 END,
+        CASE WHEN r.status = 'canceled' THEN direction ELSE 0 END,
+        CASE WHEN r.status IN ('expired', 'archived') THEN direction * COALESCE(r.duration_hours, 0) ELSE 0 END,
+        CASE WHEN r.status IN ('expired', 'archived') THEN direction * COALESCE(r.price, 0) ELSE 0 END
+    )
+    ON CONFLICT (asset_id) DO UPDATE SET
+        total_rentals = s.total_rentals + EXCLUDED.total_rentals,
+        active_rentals = s.active_rentals + EXCLUDED.active_rentals,
+        expired_rentals = s.expired_rentals + EXCLUDED.expired_rentals,
+        canceled_rentals = s.canceled_rentals + EXCLUDED.canceled_rentals,
+        total_hours = s.total_hours + EXCLUDED.total_hours,
+        total_revenue = s.total_revenue + EXCLUDED.total_revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_rental() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_asset_rental_delta(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_asset_rental_delta(NEW, 1);
+        -- ההשכרה האחרונה של הנכס
+        UPDATE asset_rental_stats
+        SET last_rental_id = NEW.id, last_rental_at = NEW.created_at
+        WHERE asset_id = NEW.asset_id
+          AND (last_rental_at IS NULL OR NEW.created_at >= last_rental_at);
+    END IF;
+
+    -- ההשכרה האחרונה עברה לנכס אחר או נמחקה - מחשבים מחדש לנכס הקודם בלבד
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.asset_id IS NOT NULL
+       AND (TG_OP = 'DELETE' OR OLD.asset_id IS DISTINCT FROM NEW.asset_id) THEN
+        UPDATE asset_rental_stats
+        SET (last_rental_id, last_rental_at) = (
+            SELECT id, created_at FROM rentals
+            WHERE asset_id = OLD.asset_id
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        WHERE asset_id = OLD.asset_id AND last_rental_id = OLD.id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS rentals_rollup ON rentals;
+CREATE TRIGGER rentals_rollup
+    AFTER INSERT OR DELETE ON rentals
+    FOR EACH ROW EXECUTE FUNCTION rollup_rental();
+
+-- עדכונים שלא משנים את המונים (למשל updated_at) לא מפעילים את הטריגר
+DROP TRIGGER IF EXISTS rentals_rollup_update ON rentals;
+CREATE TRIGGER rentals_rollup_update
+    AFTER UPDATE ON rentals
+    FOR EACH ROW
+    WHEN (OLD.asset_id IS DISTINCT FROM NEW.asset_id
+          OR OLD.status IS DISTINCT FROM NEW.status
+          OR OLD.duration_hours IS DISTINCT FROM NEW.duration_hours
+          OR OLD.price IS DISTINCT FROM NEW.price
+          OR OLD.created_at IS DISTINCT FROM NEW.created_at)
+    EXECUTE FUNCTION rollup_rental();
+
+CREATE INDEX IF NOT EXISTS idx_rentals_asset_created ON rentals(asset_id, created_at DESC);
+
+-- מילוי ראשוני מההיסטוריה הקיימת (בטוח להרצה חוזרת - מחשב הכל מחדש)
+BEGIN;
+LOCK TABLE transactions, rentals IN SHARE ROW EXCLUSIVE MODE;
+
+TRUNCATE daily_revenue, user_spending, user_spending_rentals, user_spending_keywords, asset_rental_stats;
+
+INSERT INTO daily_revenue (day, revenue, payments)
+SELECT DATE(created_at), SUM(amount), COUNT(*)
+FROM transactions
+WHERE transaction_type = 'payment'
+GROUP BY DATE(created_at);
+
+INSERT INTO user_spending_rentals (user_telegram_id, rental_id)
+SELECT DISTINCT user_telegram_id, rental_id
+FROM transactions
+WHERE user_telegram_id IS NOT NULL AND rental_id IS NOT NULL;
+
+INSERT INTO user_spending_keywords (user_telegram_id, keyword)
+SELECT DISTINCT usr.user_telegram_id, r.keyword
+FROM user_spending_rentals usr
+JOIN rentals r ON r.id = usr.rental_id
+WHERE r.keyword IS NOT NULL;
+
+INSERT INTO user_spending (user_telegram_id, total_spent, total_rentals, unique_keywords)
+SELECT t.user_telegram_id,
+       SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END),
+       (SELECT COUNT(*) FROM user_spending_rentals usr WHERE usr.user_telegram_id = t.user_telegram_id),
+       (SELECT COUNT(*) FROM user_spending_keywords usk WHERE usk.user_telegram_id = t.user_telegram_id)
+FROM transactions t
+WHERE t.user_telegram_id IS NOT NULL
+GROUP BY t.user_telegram_id;
+
+INSERT INTO asset_rental_stats (
+    asset_id, total_rentals, active_rentals, expired_rentals, canceled_rentals,
+    total_hours, total_revenue, last_rental_id, last_rental_at
+)
+SELECT r.asset_id,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE r.status IN ('active', 'monitoring', 'expiring')),
+       COUNT(*) FILTER (WHERE r.status = 'expired'),
+       COUNT(*) FILTER (WHERE r.status = 'canceled'),
+       COALESCE(SUM(r.duration_hours) FILTER (WHERE r.status IN ('expired', 'archived')), 0),
+       COALESCE(SUM(r.price) FILTER (WHERE r.status IN ('expired', 'archived')), 0),
+       (ARRAY_AGG(r.id ORDER BY r.created_at DESC))[1],
+       MAX(r.created_at)
+FROM rentals r
+WHERE r.asset_id IS NOT NULL
+GROUP BY r.asset_id;
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- אינדקסי חיפוש לנכסים (assets_manager.search_assets)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- אינדקס טריגרמות על השם: תומך גם ב-ILIKE '%q%' וגם באופרטור הדמיון %
+CREATE INDEX IF NOT EXISTS idx_assets_name_trgm ON assets USING GIN (name gin_trgm_ops);
+
+-- אינדקס GIN על מערך התגיות: תומך ב-@> וב-&&
+CREATE INDEX IF NOT EXISTS idx_assets_tags_gin ON assets USING GIN (tags);
+
+-- מיון יציב לדפדוף keyset
+CREATE INDEX IF NOT EXISTS idx_assets_type_id ON assets(type, id);
@@ -0,0 +1,35 @@
+-- התראות שינוי על טבלת assets עבור מטמון הקטלוג (asset_catalog)
+-- payload: "<id>:<updated_at>" לעדכון/הוספה, "<id>:deleted" למחיקה
+
+-- כל עדכון מקדם את updated_at (גם כותבים שלא מעדכנים אותו, למשל last_rank),
+-- כך שהגרסה בהתראה משתנה תמיד והמטמון במופעים אחרים מתבטל
+CREATE OR REPLACE FUNCTION touch_assets_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS assets_touch_updated_at ON assets;
+CREATE TRIGGER assets_touch_updated_at
+    BEFORE UPDATE ON assets
+    FOR EACH ROW EXECUTE FUNCTION touch_assets_updated_at();
+
+CREATE OR REPLACE FUNCTION notify_assets_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('assets_changed', OLD.id || ':deleted');
+    ELSE
+        PERFORM pg_notify(
+            'assets_changed',
+            NEW.id || ':' || COALESCE(to_char(NEW.updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.US'), '')
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS assets_changed_notify ON assets;
+CREATE TRIGGER assets_changed_notify
+    AFTER INSERT OR UPDATE OR DELETE ON assets
+    FOR EACH ROW EXECUTE FUNCTION notify_assets_changed();
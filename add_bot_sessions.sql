@@ -0,0 +1,6 @@
+-- סשנים שמורים של בוטים (bot_client_cache) - המפתח הוא hash של הטוקן
+CREATE TABLE IF NOT EXISTS bot_sessions (
+    token_hash TEXT PRIMARY KEY,
+    session_string TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,11 @@
+-- מצבי שיחה של משתמשים בבוט (conversation_state.py, CONVERSATION_STATE_BACKEND=postgres)
+CREATE TABLE IF NOT EXISTS conversation_states (
+    user_id BIGINT PRIMARY KEY,
+    state VARCHAR(64),
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    expires_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- מחיקת מצבים שפגו
+CREATE INDEX IF NOT EXISTS idx_conversation_states_expires_at ON conversation_states(expires_at);
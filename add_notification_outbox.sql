@@ -0,0 +1,30 @@
+-- תיבת יוצאים להתראות (notifications.py)
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    rental_id INTEGER,
+    type VARCHAR(50) NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    dedupe_key TEXT,
+    coalesced INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    is_read BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- איחוד התראות ממתינות מאותו סוג לאותה השכרה
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_outbox_dedupe_pending
+    ON notification_outbox(dedupe_key) WHERE status = 'pending';
+
+-- שליפת התראות ממתינות לשליחה
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+    ON notification_outbox(next_attempt_at) WHERE status = 'pending';
+
+-- קריאת התראות של משתמש
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_user_created
+    ON notification_outbox(user_id, created_at DESC);
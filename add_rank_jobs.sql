@@ -0,0 +1,20 @@
+-- עבודות דירוג ברקע (rank_jobs.py)
+CREATE TABLE IF NOT EXISTS rank_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}'::jsonb,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- עבודות שלא הסתיימו חוזרות לתור בהפעלה מחדש
+CREATE INDEX IF NOT EXISTS idx_rank_jobs_unfinished
+    ON rank_jobs(priority, created_at) WHERE status IN ('queued', 'running');
+
+-- טעינת תוצאות אחרונות למטמון
+CREATE INDEX IF NOT EXISTS idx_rank_jobs_finished_at
+    ON rank_jobs(finished_at) WHERE status = 'done';
@@ -0,0 +1,12 @@
+-- יומן שמות זמניים של נכסים (rename_journal)
+-- רשומה קיימת = הנכס עשוי להיות בשם זמני וצריך לשחזר לו את original_name
+CREATE TABLE IF NOT EXISTS asset_rename_journal (
+    asset_id INTEGER PRIMARY KEY REFERENCES assets(id) ON DELETE CASCADE,
+    original_name TEXT NOT NULL,
+    temp_name TEXT NOT NULL,
+    deadline TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- סריקת רשומות תקועות בזמן ההתאוששות
+CREATE INDEX IF NOT EXISTS idx_asset_rename_journal_deadline ON asset_rename_journal(deadline);
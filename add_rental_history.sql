@@ -0,0 +1,17 @@
+-- היסטוריית מעברי סטטוס של השכרות (נכתבת ע"י rental_state_machine)
+CREATE TABLE IF NOT EXISTS rental_history (
+    id SERIAL PRIMARY KEY,
+    rental_id INTEGER REFERENCES rentals(id) ON DELETE CASCADE,
+    action VARCHAR(50) NOT NULL,
+    old_status VARCHAR(50),
+    new_status VARCHAR(50),
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE rental_history ADD COLUMN IF NOT EXISTS action VARCHAR(50);
+ALTER TABLE rental_history ADD COLUMN IF NOT EXISTS old_status VARCHAR(50);
+ALTER TABLE rental_history ADD COLUMN IF NOT EXISTS new_status VARCHAR(50);
+ALTER TABLE rental_history ADD COLUMN IF NOT EXISTS notes TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_rental_history_rental_created ON rental_history(rental_id, created_at);
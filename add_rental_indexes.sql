@@ -0,0 +1,12 @@
+-- עמודות שמאגר ההשכרות (rental_store) כותב לטבלת rentals
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS user_telegram_id BIGINT;
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS asset_id INTEGER REFERENCES assets(id);
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS keyword VARCHAR(255);
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS rank INTEGER;
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS tier VARCHAR(50);
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS payment_id VARCHAR(255);
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS duration_hours INTEGER;
+
+-- אינדקסים מורכבים: שאילתות סטטוס/תפוגה ושאילתות לפי משתמש הופכות לסריקות טווח
+CREATE INDEX IF NOT EXISTS idx_rentals_status_end_time ON rentals(status, end_time);
+CREATE INDEX IF NOT EXISTS idx_rentals_user_status ON rentals(user_telegram_id, status);
@@ -0,0 +1,11 @@
+-- סיווג סשנים (session_classifier) - תוצאה, ראיות ותוקף
+CREATE TABLE IF NOT EXISTS session_classifications (
+    session_id TEXT PRIMARY KEY,
+    session_type VARCHAR(20) NOT NULL,
+    evidence JSONB NOT NULL DEFAULT '{}'::jsonb,
+    classified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- סיווג מחדש סורק רק סיווגים שפג תוקפם
+CREATE INDEX IF NOT EXISTS idx_session_classifications_expires_at ON session_classifications(expires_at);
@@ -0,0 +1,3 @@
+-- מזהה טלגרם ייחודי למשתמש: נדרש ל-INSERT ... ON CONFLICT ב-create_user
+-- (ומשמש גם לחיפוש משתמש לפי telegram_id)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
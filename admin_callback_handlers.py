@@ -19,12 +19,23 @@ def register_admin_callbacks(dp: Dispatcher):
     @dp.callback_query(F.data == "run_cycle")
     async def cb_run_cycle(callback_query: CallbackQuery):
         await callback_query.message.edit_text("\u23f3 מריץ סייקל דירוג...")
-        from subprocess import run, CalledProcessError
+        from rank_engine import rank_engine
+
+        async def show_progress(progress):
+            await callback_query.message.edit_text(
+                f"\u23f3 סייקל דירוג: {progress['done']}/{progress['total']} "
+                f"(עודכנו {progress['updated']}, שגיאות {progress['errors']})"
+            )
+
         try:
-            result = run(["python", "rank_engine.py"], capture_output=True, text=True, check=True)
-            await callback_query.message.answer("\u2705 סייקל הסתיים בהצלחה:\n" + result.stdout)
-        except CalledProcessError as e:
-            await callback_query.message.answer(f"\u274c שגיאה:\n{e.stderr or e.stdout}")
+            result = await rank_engine.run_cycle(progress_callback=show_progress)
+            await callback_query.message.answer(
+                "\u2705 סייקל הסתיים בהצלחה:\n"
+                f"נבדקו {result['checked']}, עודכנו {result['updated']}, "
+                f"שגיאות {result['errors']}, {result['duration']} שניות"
+            )
+        except Exception as e:
+            await callback_query.message.answer(f"\u274c שגיאה:\n{e}")
 
     @dp.callback_query(F.data == "upload_asset")
     async def cb_upload_asset(callback_query: CallbackQuery):
@@ -0,0 +1,181 @@
+"""
+מודול admin_stats - תמונת מצב מרוכזת של סטטיסטיקות המערכת ללוח המנהל
+
+כל טבלה נספרת בשאילתה אחת עם COUNT(*) FILTER בצד המסד, והשאילתות רצות
+במקביל במאגר ה-db. התוצאה נשמרת בזיכרון לזמן קצר: לחיצות "רענן" חוזרות
+מקבלות את תמונת המצב השמורה, ותמונה שהתיישנה מוחזרת מיד בזמן שהרענון
+רץ ברקע.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from constants import Constants
+from db import get_connection
+from rental_store import LIVE_STATUSES
+from utils import AsyncHelper
+
+logger = logging.getLogger(__name__)
+
+
+def _count_users() -> Dict[str, int]:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '1 day') AS new_today
+                FROM users
+            """)
+            return dict(cur.fetchone())
+
+
+def _count_rentals() -> Dict[str, int]:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE status = ANY(%s)) AS live,
+                       COUNT(*) FILTER (WHERE status = %s) AS active
+                FROM rentals
+            """, (list(LIVE_STATUSES), Constants.RENTAL_STATUS_ACTIVE))
+            return dict(cur.fetchone())
+
+
+def _count_assets() -> Dict[str, int]:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE available) AS available
+                FROM assets
+            """)
+            return dict(cur.fetchone())
+
+
+def _count_sessions() -> Dict[str, int]:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE status = 'active') AS active
+                FROM sessions
+            """)
+            return dict(cur.fetchone())
+
+
+def _count_proxies() -> Dict[str, int]:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE status = 'active') AS active
+                FROM proxies
+            """)
+            return dict(cur.fetchone())
+
+
+# חלקי תמונת המצב והפונקציה שסופרת כל אחד מהם
+SECTIONS: Dict[str, Callable[[], Dict[str, int]]] = {
+    "users": _count_users,
+    "rentals": _count_rentals,
+    "assets": _count_assets,
+    "sessions": _count_sessions,
+    "proxies": _count_proxies,
+}
+
+
+class AdminStats:
+    """
+    אוסף סטטיסטיקות מערכת עם מטמון קצר ורענון ברקע
+    """
+
+    def __init__(self, ttl: float = Constants.ADMIN_STATS_TTL,
+                 max_stale: float = Constants.ADMIN_STATS_MAX_STALE):
+        """
+        Args:
+            ttl: שניות שבהן תמונת המצב נחשבת עדכנית
+            max_stale: שניות שבהן מותר להחזיר תמונה ישנה בזמן רענון ברקע
+        """
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._refresh: Optional[asyncio.Future] = None
+
+    @staticmethod
+    async def _fetch_section(name: str) -> Optional[Dict[str, int]]:
+        try:
+            return await AsyncHelper.run_sync_in_async(SECTIONS[name])
+        except Exception as e:
+            logger.error(f"שגיאה בספירת {name} לסטטיסטיקות: {str(e)}")
+            return None
+
+    async def _collect(self) -> Dict[str, Any]:
+        """
+        מריץ את כל הספירות במקביל ושומר את תמונת המצב
+        """
+        names = list(SECTIONS)
+        results = await asyncio.gather(*(self._fetch_section(name) for name in names))
+        snapshot: Dict[str, Any] = dict(zip(names, results))
+        snapshot['updated_at'] = time.time()
+        # חלק שנכשל - נשאיר את הערך הקודם (אם יש) במקום להציג "לא זמין"
+        if self._snapshot:
+            for name in names:
+                if snapshot[name] is None:
+                    snapshot[name] = self._snapshot.get(name)
+        self._snapshot = snapshot
+        return snapshot
+
+    def _start_refresh(self) -> asyncio.Future:
+        """
+        מתחיל רענון אם אין כבר רענון פעיל (בקשות במקביל ממתינות לאותו רענון)
+        """
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._collect())
+        return self._refresh
+
+    async def get_snapshot(self, force: bool = False) -> Dict[str, Any]:
+        """
+        מחזיר את תמונת המצב של הסטטיסטיקות
+
+        Args:
+            force: האם לחכות לספירה חדשה גם אם יש תמונה עדכנית
+
+        Returns:
+            מילון {חלק: {מונה: ערך} או None, 'updated_at': זמן הספירה}
+        """
+        snapshot = self._snapshot
+        age = time.time() - snapshot['updated_at'] if snapshot else None
+
+        if not force and age is not None:
+            if age < self.ttl:
+                return snapshot
+            if age < self.max_stale:
+                # תמונה ישנה אך שמישה - מחזירים מיד ומרעננים ברקע
+                self._start_refresh()
+                return snapshot
+
+        return await asyncio.shield(self._start_refresh())
+
+    def invalidate(self):
+        """
+        מסמן את תמונת המצב כלא עדכנית (הבקשה הבאה תספור מחדש)
+        """
+        self._snapshot = None
+
+    async def stop(self):
+        """
+        מבטל רענון פעיל (בסגירת הבוט)
+        """
+        if self._refresh and not self._refresh.done():
+            self._refresh.cancel()
+            try:
+                await self._refresh
+            except asyncio.CancelledError:
+                pass
+        self._refresh = None
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+admin_stats = AdminStats()
@@ -0,0 +1,349 @@
+"""
+מודול asset_candidate_index - אינדקס מועמדים מחושב מראש: מילת מפתח -> נכסים מבטיחים
+
+האינדקס ממפה מילות מפתח מנורמלות וטוקנים של תגיות/שמות לרשימת נכסים
+מתועדפת, על סמך תוצאות עבר מ-rank_cache וחפיפת תגיות, ומתעדכן
+אינקרמנטלית כשנכסים ודירוגים משתנים.
+"""
+
+import heapq
+import logging
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from db import get_connection
+from constants import Constants
+
+logger = logging.getLogger(__name__)
+
+# משקלות ניקוד
+EXACT_RANK_WEIGHT = 100.0   # דירוג עבר לאותה מילת מפתח בדיוק
+TOKEN_RANK_WEIGHT = 20.0    # דירוג עבר למילת מפתח שחולקת טוקן
+TAG_OVERLAP_WEIGHT = 10.0   # חפיפה בין טוקני השאילתה לתגיות/שם הנכס
+EXACT_MISS_PENALTY = 50.0   # הנכס נבדק בעבר למילה הזו ולא נמצא
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    מנרמל מילת מפתח (אותיות קטנות, בלי הסיומת המיוחדת, רווחים מצומצמים)
+
+    Args:
+        keyword: מילת המפתח
+
+    Returns:
+        מילת המפתח המנורמלת
+    """
+    keyword = (keyword or "").replace(Constants.SPECIAL_SUFFIX, "")
+    return " ".join(keyword.lower().split())
+
+
+def tokenize(text: str) -> Set[str]:
+    """
+    מפרק טקסט לטוקנים מנורמלים
+
+    Args:
+        text: הטקסט לפירוק
+
+    Returns:
+        קבוצת טוקנים (באורך 2 תווים לפחות)
+    """
+    return {t for t in _TOKEN_RE.findall(normalize_keyword(text)) if len(t) >= 2}
+
+
+def _parse_tags(tags: Any) -> List[str]:
+    """
+    ממיר תגיות מהמסד (רשימה או מחרוזת מערך PostgreSQL) לרשימה
+
+    Args:
+        tags: ערך עמודת tags
+
+    Returns:
+        רשימת תגיות
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        return [t.strip().strip('"') for t in tags.strip("{}").split(",") if t.strip()]
+    return [str(t) for t in tags]
+
+
+class AssetCandidateIndex:
+    """
+    אינדקס מועמדים לבדיקת דירוג - מחזיר רק את הנכסים המבטיחים ביותר למילה
+    """
+
+    def __init__(self):
+        """
+        יוצר אינדקס ריק (נטען בעצלות בשימוש הראשון)
+        """
+        self._lock = threading.RLock()
+        self._loaded = False
+        # {asset_id: {'id', 'name', 'type', 'tags', 'available'}}
+        self._assets: Dict[int, Dict[str, Any]] = {}
+        # {asset_id: {token, ...}} - טוקנים מתגיות ושם מקורי
+        self._asset_tokens: Dict[int, Set[str]] = {}
+        # {token: {asset_id, ...}} - אינדקס הפוך לתגיות/שמות
+        self._token_assets: Dict[str, Set[int]] = {}
+        # {keyword: {asset_id: rank}} - דירוגי עבר למילה מנורמלת
+        self._keyword_ranks: Dict[str, Dict[int, int]] = {}
+        # {token: {asset_id: best_rank}} - הדירוג הטוב ביותר למילים שמכילות את הטוקן
+        self._token_ranks: Dict[str, Dict[int, int]] = {}
+        # {asset_id: score} - ציון כללי מ-rank_cache (סכום 1/rank על כל המילים)
+        self._asset_prior: Dict[int, float] = {}
+
+    def _ensure_loaded(self):
+        """
+        בונה את האינדקס מטבלאות assets ו-rank_cache (פעם אחת)
+        """
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with get_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("""
+                            SELECT id, name, original_name, type, tags, available
+                            FROM assets
+                        """)
+                        assets = cur.fetchall()
+
+                        # rank_cache שומר היסטוריה - רק השורה האחרונה לכל נכס ומילה
+                        cur.execute("""
+                            SELECT DISTINCT ON (asset_id, keyword) asset_id, keyword, rank
+                            FROM rank_cache
+                            ORDER BY asset_id, keyword, created_at DESC, id DESC
+                        """)
+                        ranks = cur.fetchall()
+
+                for asset in assets:
+                    self._set_asset(dict(asset))
+                for row in ranks:
+                    self._set_rank(row['asset_id'], row['keyword'], row['rank'])
+
+                self._loaded = True
+                logger.info(
+                    f"אינדקס מועמדים נבנה: {len(self._assets)} נכסים, "
+                    f"{len(self._keyword_ranks)} מילות מפתח"
+                )
+            except Exception as e:
+                logger.error(f"שגיאה בבניית אינדקס מועמדים: {str(e)}")
+
+    def _set_asset(self, asset: Dict[str, Any]):
+        """
+        מוסיף או מעדכן נכס באינדקס
+
+        Args:
+            asset: פרטי הנכס
+        """
+        asset_id = asset['id']
+        self._drop_asset_tokens(asset_id)
+
+        tags = _parse_tags(asset.get('tags'))
+        # השם הנוכחי עשוי להיות שם זמני של בדיקה - עדיף השם המקורי
+        name = asset.get('original_name') or asset.get('name') or ""
+        if Constants.SPECIAL_SUFFIX in name:
+            name = ""
+
+        tokens: Set[str] = set()
+        for text in tags + [name]:
+            tokens |= tokenize(text)
+
+        self._assets[asset_id] = {
+            'id': asset_id,
+            'name': asset.get('original_name') or asset.get('name'),
+            'type': asset.get('type'),
+            'tags': tags,
+            'available': asset.get('available', True) is not False,
+        }
+        self._asset_tokens[asset_id] = tokens
+        for token in tokens:
+            self._token_assets.setdefault(token, set()).add(asset_id)
+
+    def _drop_asset_tokens(self, asset_id: int):
+        """
+        מסיר את טוקני התגיות/שם של נכס מהאינדקס ההפוך
+
+        Args:
+            asset_id: מזהה הנכס
+        """
+        for token in self._asset_tokens.pop(asset_id, set()):
+            ids = self._token_assets.get(token)
+            if ids is not None:
+                ids.discard(asset_id)
+                if not ids:
+                    del self._token_assets[token]
+
+    def _set_rank(self, asset_id: int, keyword: str, rank: int):
+        """
+        רושם תוצאת דירוג באינדקס
+
+        Args:
+            asset_id: מזהה הנכס
+            keyword: מילת המפתח
+            rank: הדירוג (-1 אם לא נמצא)
+        """
+        normalized = normalize_keyword(keyword)
+        if not normalized:
+            return
+        ranks = self._keyword_ranks.setdefault(normalized, {})
+        previous = ranks.get(asset_id)
+        ranks[asset_id] = rank
+
+        prior = self._asset_prior.get(asset_id, 0.0)
+        if previous is not None and previous > 0:
+            prior -= 1.0 / previous
+        if rank is not None and rank > 0:
+            prior += 1.0 / rank
+        self._asset_prior[asset_id] = prior
+
+        if rank is None or rank <= 0:
+            return
+        for token in tokenize(normalized):
+            by_asset = self._token_ranks.setdefault(token, {})
+            best = by_asset.get(asset_id)
+            if best is None or rank < best:
+                by_asset[asset_id] = rank
+
+    def on_asset_changed(self, asset: Optional[Dict[str, Any]]):
+        """
+        מעדכן את האינדקס אחרי הוספה או עדכון של נכס
+
+        Args:
+            asset: פרטי הנכס העדכניים
+        """
+        if not asset or 'id' not in asset:
+            return
+        with self._lock:
+            if self._loaded:
+                self._set_asset(asset)
+
+    def on_assets_removed(self, asset_ids: Iterable[int]):
+        """
+        מסיר נכסים מהאינדקס אחרי מחיקה
+
+        Args:
+            asset_ids: מזהי הנכסים שנמחקו
+        """
+        with self._lock:
+            for asset_id in asset_ids:
+                self._drop_asset_tokens(asset_id)
+                self._assets.pop(asset_id, None)
+                self._asset_prior.pop(asset_id, None)
+                for ranks in self._keyword_ranks.values():
+                    ranks.pop(asset_id, None)
+                for ranks in self._token_ranks.values():
+                    ranks.pop(asset_id, None)
+
+    def on_rank_recorded(self, asset_id: int, keyword: str, rank: int):
+        """
+        מעדכן את האינדקס אחרי בדיקת דירוג
+
+        Args:
+            asset_id: מזהה הנכס
+            keyword: מילת המפתח
+            rank: הדירוג שנמצא
+        """
+        with self._lock:
+            if self._loaded:
+                self._set_rank(asset_id, keyword, rank)
+
+    def score(self, asset_id: int, keyword: str) -> float:
+        """
+        מחשב ציון התאמה של נכס למילת מפתח
+
+        Args:
+            asset_id: מזהה הנכס
+            keyword: מילת המפתח
+
+        Returns:
+            ציון (גבוה יותר = מבטיח יותר)
+        """
+        self._ensure_loaded()
+        normalized = normalize_keyword(keyword)
+        tokens = tokenize(normalized)
+
+        with self._lock:
+            return self._score(asset_id, normalized, tokens)
+
+    def _score(self, asset_id: int, normalized: str, tokens: Set[str]) -> float:
+        score = 0.0
+
+        exact = self._keyword_ranks.get(normalized, {}).get(asset_id)
+        if exact is not None:
+            score += EXACT_RANK_WEIGHT / exact if exact > 0 else -EXACT_MISS_PENALTY
+
+        for token in tokens:
+            best = self._token_ranks.get(token, {}).get(asset_id)
+            if best:
+                score += TOKEN_RANK_WEIGHT / best
+
+        if tokens:
+            overlap = len(tokens & self._asset_tokens.get(asset_id, set()))
+            score += TAG_OVERLAP_WEIGHT * overlap / len(tokens)
+
+        return score
+
+    def candidates(self, keyword: str, asset_type: Optional[str] = None,
+                   limit: int = Constants.CANDIDATE_CHECK_LIMIT) -> List[Dict[str, Any]]:
+        """
+        מחזיר את הנכסים הזמינים המבטיחים ביותר למילת מפתח
+
+        נכסים עם ראיות (דירוג עבר או חפיפת תגיות) קודמים; אם אין מספיק,
+        הרשימה מושלמת בנכסים זמינים אחרים לפי הציון הכללי שלהם ב-rank_cache
+        (נכסים שמדורגים היטב במילים אחרות קודם, נכסים ללא היסטוריה אחרונים).
+
+        Args:
+            keyword: מילת המפתח
+            asset_type: סוג נכס לסינון (אופציונלי)
+            limit: מספר מועמדים מקסימלי
+
+        Returns:
+            רשימת נכסים ממוינת מהמבטיח ביותר
+        """
+        self._ensure_loaded()
+        normalized = normalize_keyword(keyword)
+        tokens = tokenize(normalized)
+
+        with self._lock:
+            # נכסים עם ראיות כלשהן - מהאינדקסים ההפוכים בלבד
+            related: Set[int] = set(self._keyword_ranks.get(normalized, {}))
+            for token in tokens:
+                related |= set(self._token_ranks.get(token, {}))
+                related |= self._token_assets.get(token, set())
+
+            def eligible(asset_id: int) -> bool:
+                asset = self._assets.get(asset_id)
+                return bool(asset) and asset['available'] and (
+                    not asset_type or asset['type'] == asset_type
+                )
+
+            scored = [
+                (self._score(asset_id, normalized, tokens), asset_id)
+                for asset_id in related if eligible(asset_id)
+            ]
+            scored = [item for item in scored if item[0] > 0]
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            chosen = [asset_id for _, asset_id in scored[:limit]]
+
+            if len(chosen) < limit:
+                fill = heapq.nsmallest(
+                    limit - len(chosen),
+                    (
+                        (-self._asset_prior.get(asset_id, 0.0), asset_id)
+                        for asset_id in self._assets
+                        if asset_id not in related and eligible(asset_id)
+                    ),
+                )
+                chosen.extend(asset_id for _, asset_id in fill)
+
+            return [dict(self._assets[asset_id]) for asset_id in chosen]
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+candidate_index = AssetCandidateIndex()
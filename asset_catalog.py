@@ -0,0 +1,275 @@
+"""
+מודול asset_catalog - מטמון קטלוג נכסים בזיכרון עם ביטול דרך LISTEN/NOTIFY
+"""
+
+import logging
+import select
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from db import DATABASE_URL, get_connection
+
+logger = logging.getLogger(__name__)
+
+# ערוץ ההתראות שהטריגר על טבלת assets שולח אליו (add_assets_notify_trigger.sql)
+ASSETS_CHANNEL = "assets_changed"
+
+# זמן המתנה לפני ניסיון התחברות חוזר של המאזין (בשניות)
+LISTENER_RETRY_SECONDS = 5
+
+
+def _version(asset: Dict[str, Any]) -> str:
+    """
+    מחזיר את גרסת הנכס בפורמט שהטריגר שולח (updated_at עד מיקרו-שניות)
+
+    Args:
+        asset: פרטי הנכס
+
+    Returns:
+        מחרוזת גרסה או מחרוזת ריקה אם אין updated_at
+    """
+    updated_at = asset.get('updated_at')
+    return updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f') if updated_at else ""
+
+
+class AssetCatalog:
+    """
+    מטמון read-through לנכסים לפי id ולפי telegram_id
+
+    המטמון פעיל רק כשהמאזין מחובר ל-LISTEN assets_changed, כך שכל שינוי
+    בטבלה (מכל תהליך) מבטל את הרשומה. בלי מאזין - כל קריאה הולכת למסד.
+    """
+
+    def __init__(self):
+        """
+        יוצר קטלוג ריק (המאזין מופעל בעצלות בקריאה הראשונה)
+        """
+        self._lock = threading.RLock()
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        # {telegram_id: asset_id}
+        self._by_telegram_id: Dict[int, int] = {}
+        # מונה ביטולים: כל ביטול מקבל מספר עולה, ולכל נכס נשמר מספר הביטול האחרון שלו
+        self._sequence = 0
+        self._invalidated_at: Dict[int, int] = {}
+        self._cleared_at = 0
+        self._listening = False
+        self._listener: Optional[threading.Thread] = None
+
+    def _ensure_listener(self):
+        """
+        מפעיל את חוט המאזין אם עוד לא רץ
+        """
+        if self._listener and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(
+                target=self._listen_loop, name="asset-catalog-listener", daemon=True
+            )
+            self._listener.start()
+
+    def _listen_loop(self):
+        """
+        לולאת המאזין - מבטלת רשומות לפי התראות מהמסד ומתחברת מחדש בנפילה
+        """
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(DATABASE_URL)
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cur:
+                    cur.execute(f"LISTEN {ASSETS_CHANNEL}")
+
+                # התראות שהוחמצו לפני ההאזנה - מתחילים ממטמון ריק
+                self.clear()
+                self._listening = True
+                logger.info("מאזין קטלוג הנכסים מחובר")
+
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self._on_notify(notify.payload)
+
+            except Exception as e:
+                logger.error(f"שגיאה במאזין קטלוג הנכסים: {str(e)}")
+            finally:
+                self._listening = False
+                self.clear()
+                if connection:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+            time.sleep(LISTENER_RETRY_SECONDS)
+
+    def _on_notify(self, payload: str):
+        """
+        מטפל בהתראת שינוי: "<id>:<updated_at>" או "<id>:deleted"
+
+        Args:
+            payload: תוכן ההתראה
+        """
+        asset_id_str, _, version = payload.partition(":")
+        try:
+            asset_id = int(asset_id_str)
+        except ValueError:
+            logger.warning(f"התראת קטלוג לא תקינה: {payload}")
+            return
+
+        with self._lock:
+            cached = self._by_id.get(asset_id)
+            # כתיבה מקומית שכבר נשמרה במטמון עם אותה גרסה - אין צורך לבטל
+            if cached and version and _version(cached) == version:
+                return
+        self.invalidate(asset_id)
+
+    def sequence(self) -> int:
+        """
+        מחזיר את מספר הביטול האחרון - לקריאה לפני קריאה/כתיבה למסד
+
+        Returns:
+            מונה הביטולים הנוכחי
+        """
+        with self._lock:
+            return self._sequence
+
+    def _store(self, asset: Dict[str, Any], since: Optional[int] = None):
+        """
+        שומר נכס במטמון (רק כשהמאזין מחובר)
+
+        Args:
+            asset: פרטי הנכס
+            since: מונה הביטולים לפני שהשורה נקראה - אם הנכס בוטל מאז,
+                   השורה עלולה להיות ישנה ולא נשמרת
+        """
+        if not self._listening:
+            return
+        with self._lock:
+            if since is not None and (
+                self._cleared_at > since or self._invalidated_at.get(asset['id'], 0) > since
+            ):
+                return
+            self._by_id[asset['id']] = dict(asset)
+            if asset.get('telegram_id') is not None:
+                self._by_telegram_id[asset['telegram_id']] = asset['id']
+
+    def get(self, asset_id: int) -> Optional[Dict[str, Any]]:
+        """
+        מקבל נכס לפי מזהה (מהמטמון ואם אין - מהמסד)
+
+        Args:
+            asset_id: מזהה הנכס
+
+        Returns:
+            פרטי הנכס או None אם לא נמצא
+        """
+        self._ensure_listener()
+        with self._lock:
+            cached = self._by_id.get(asset_id)
+            if cached:
+                return dict(cached)
+            since = self._sequence
+
+        asset = self._fetch("id", asset_id)
+        if asset:
+            self._store(asset, since)
+        return asset
+
+    def get_by_telegram_id(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        """
+        מקבל נכס לפי מזהה טלגרם
+
+        Args:
+            telegram_id: מזהה הנכס בטלגרם
+
+        Returns:
+            פרטי הנכס או None אם לא נמצא
+        """
+        self._ensure_listener()
+        with self._lock:
+            asset_id = self._by_telegram_id.get(telegram_id)
+            cached = self._by_id.get(asset_id) if asset_id is not None else None
+            if cached:
+                return dict(cached)
+            since = self._sequence
+
+        asset = self._fetch("telegram_id", telegram_id)
+        if asset:
+            self._store(asset, since)
+        return asset
+
+    @staticmethod
+    def _fetch(column: str, value: Any) -> Optional[Dict[str, Any]]:
+        """
+        קורא נכס מהמסד
+
+        Args:
+            column: עמודת החיפוש (id / telegram_id)
+            value: הערך לחיפוש
+
+        Returns:
+            פרטי הנכס או None
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"SELECT * FROM assets WHERE {column} = %s", (value,))
+                    asset = cur.fetchone()
+                    return dict(asset) if asset else None
+        except Exception as e:
+            logger.error(f"שגיאה בקבלת מידע על נכס ({column}={value}): {str(e)}")
+            return None
+
+    def put(self, asset: Optional[Dict[str, Any]], since: Optional[int] = None):
+        """
+        מעדכן את המטמון אחרי כתיבה מקומית (למשל UPDATE ... RETURNING *)
+
+        יש לקרוא רק אחרי שהטרנזקציה בוצעה (commit), כדי ששורה שלא נשמרה
+        לא תישאר במטמון.
+
+        Args:
+            asset: שורת הנכס העדכנית
+            since: sequence() מלפני הכתיבה - אם הנכס בוטל מאז (שינוי מתהליך אחר)
+                   השורה לא נשמרת
+        """
+        if asset and 'id' in asset:
+            self._store(asset, since)
+
+    def invalidate(self, asset_id: int):
+        """
+        מסיר נכס מהמטמון
+
+        Args:
+            asset_id: מזהה הנכס
+        """
+        with self._lock:
+            self._sequence += 1
+            self._invalidated_at[asset_id] = self._sequence
+            asset = self._by_id.pop(asset_id, None)
+            if asset and self._by_telegram_id.get(asset.get('telegram_id')) == asset_id:
+                del self._by_telegram_id[asset['telegram_id']]
+
+    def clear(self):
+        """
+        מרוקן את המטמון
+        """
+        with self._lock:
+            self._sequence += 1
+            self._cleared_at = self._sequence
+            # כל נכס מכוסה עכשיו ע"י _cleared_at
+            self._invalidated_at.clear()
+            self._by_id.clear()
+            self._by_telegram_id.clear()
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+asset_catalog = AssetCatalog()
@@ -1,9 +1,15 @@
 import logging
 import datetime
+from decimal import Decimal
 from typing import List, Dict, Any, Optional, Tuple
 
+from psycopg2.extras import execute_values
+
 from db import get_connection
 from constants import Constants
+from asset_candidate_index import candidate_index
+from asset_catalog import asset_catalog
+from rename_journal import rename_journal
 
 logger = logging.getLogger(__name__)
 
@@ -17,13 +23,6 @@ class AssetsManager:
     ASSET_TYPE_CHANNEL = 'channel'  # ערוץ טלגרם
     ASSET_TYPE_GROUP = 'group'      # קבוצה בטלגרם
     
-    def __init__(self):
-        """
-        יוצר מנהל נכסים חדש
-        """
-        # שמות מקוריים של נכסים (לפני שינוי שם)
-        self.original_names = {}  # {asset_id: original_name}
-    
     def get_asset(self, asset_id: int) -> Dict[str, Any]:
         """
         מקבל מידע על נכס ספציפי
@@ -34,23 +33,7 @@ class AssetsManager:
         Returns:
             פרטי הנכס או None אם לא נמצא
         """
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT *
-                        FROM assets
-                        WHERE id = %s
-                    """, (asset_id,))
-                    
-                    asset = cur.fetchone()
-                    if asset:
-                        return dict(asset)
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"שגיאה בקבלת מידע על נכס {asset_id}: {str(e)}")
-            return None
+        return asset_catalog.get(asset_id)
     
     def get_available_assets(self, asset_type: str = None, limit: int = 100) -> List[Dict[str, Any]]:
         """
@@ -108,42 +91,70 @@ class AssetsManager:
         Returns:
             מזהה הנכס החדש במערכת או 0 אם נכשל
         """
-        try:
-            # וידוא סוג נכס תקין
-            valid_types = [self.ASSET_TYPE_BOT, self.ASSET_TYPE_CHANNEL, self.ASSET_TYPE_GROUP]
-            if type not in valid_types:
-                logger.error(f"סוג נכס לא חוקי: {type}")
-                return 0
-            
-            # המרת רשימת תגיות לפורמט PostgreSQL array
-            if tags:
-                # PostgreSQL array format with proper escaping
-                tags_array = '{' + ','.join(f'"{tag}"' for tag in tags) + '}'
-            else:
-                # Empty PostgreSQL array
-                tags_array = '{}'
+        asset_ids = self.add_assets([{
+            'telegram_id': telegram_id,
+            'name': name,
+            'type': type,
+            'description': description,
+            'tags': tags,
+            'available': available,
+            'bot_token': bot_token,
+        }])
+        return asset_ids[0] if asset_ids else 0
+    
+    def add_assets(self, assets: List[Dict[str, Any]]) -> List[int]:
+        """
+        מוסיף מספר נכסים בבת אחת (INSERT אחד עם execute_values)
+        
+        Args:
+            assets: רשימת נכסים - מילונים עם telegram_id, name, type ואופציונלית
+                    tags, available, bot_token
             
+        Returns:
+            רשימת מזהי הנכסים החדשים (לפי סדר הקלט) או רשימה ריקה אם נכשל
+        """
+        valid_types = [self.ASSET_TYPE_BOT, self.ASSET_TYPE_CHANNEL, self.ASSET_TYPE_GROUP]
+        
+        rows = []
+        for asset in assets:
+            # וידוא סוג נכס תקין
+            if asset.get('type') not in valid_types:
+                logger.error(f"סוג נכס לא חוקי: {asset.get('type')}")
+                return []
+            
+            rows.append((
+                asset['telegram_id'], str(asset['telegram_id']), asset['name'], asset['name'],
+                asset['type'], list(asset.get('tags') or []), asset.get('available', True),
+                asset.get('bot_token'),
+            ))
+        
+        if not rows:
+            return []
+        
+        try:
+            since = asset_catalog.sequence()
             with get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
+                    inserted = execute_values(cur, """
                         INSERT INTO assets
                         (telegram_id, asset_id, name, original_name, type, tags, available, bot_token, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                        RETURNING id
-                    """, (
-                        telegram_id, str(telegram_id), name, name, type, tags_array, available, bot_token
-                    ))
-                    
-                    asset_id = cur.fetchone()['id']
-                    
-                    # שמור את השם המקורי
-                    self.original_names[asset_id] = name
-                    
-                    return asset_id
+                        VALUES %s
+                        RETURNING *
+                    """, rows, template="(%s, %s, %s, %s, %s, %s::text[], %s, %s, NOW())",
+                        page_size=len(rows), fetch=True)
+            
+            # רק אחרי ה-commit (יציאה מבלוק החיבור) - כדי לא לשמור שורות שלא נכתבו
+            for asset in inserted:
+                asset = dict(asset)
+                # עדכן את אינדקס המועמדים והקטלוג
+                candidate_index.on_asset_changed(asset)
+                asset_catalog.put(asset, since)
+            
+            return [asset['id'] for asset in inserted]
                     
         except Exception as e:
-            logger.error(f"שגיאה בהוספת נכס חדש: {str(e)}")
-            return 0
+            logger.error(f"שגיאה בהוספת נכסים: {str(e)}")
+            return []
     
     def update_asset(self, asset_id: int, **kwargs) -> bool:
         """
@@ -171,6 +182,10 @@ class AssetsManager:
                 if key in ['name', 'description', 'type', 'priority', 'is_available', 'telegram_id']:
                     fields.append(f"{key} = %s")
                     params.append(value)
+                    # שם שנקבע ידנית הוא גם השם המקורי לשחזור אחרי בדיקות דירוג
+                    if key == 'name':
+                        fields.append("original_name = %s")
+                        params.append(value)
                 elif key == 'tags' and isinstance(value, list):
                     fields.append("tags = %s")
                     # Convert to PostgreSQL array format
@@ -192,17 +207,21 @@ class AssetsManager:
                 UPDATE assets
                 SET {', '.join(fields)}, updated_at = NOW()
                 WHERE id = %s
+                RETURNING *
             """
             
+            since = asset_catalog.sequence()
             with get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(update_query, tuple(params))
-                    
-                    # אם עדכנו את השם, עדכן גם את השם המקורי
-                    if 'name' in kwargs:
-                        self.original_names[asset_id] = kwargs['name']
-                    
-                    return True
+                    updated = cur.fetchone()
+            
+            # עדכן את אינדקס המועמדים והקטלוג - רק אחרי שהעדכון בוצע (commit)
+            if updated:
+                candidate_index.on_asset_changed(dict(updated))
+                asset_catalog.put(dict(updated), since)
+            
+            return True
                     
         except Exception as e:
             logger.error(f"שגיאה בעדכון נכס {asset_id}: {str(e)}")
@@ -259,9 +278,17 @@ class AssetsManager:
         return self.update_asset(asset_id, tags=tags)
     
     def delete_asset(self, asset_id: int) -> bool:
-        """מוחק נכס מהמערכת"""
-        # Implementation exists elsewhere in file
-        pass
+        """
+        מוחק נכס מהמערכת (רק אם אין לו השכרות פעילות)
+        
+        Args:
+            asset_id: מזהה הנכס
+            
+        Returns:
+            האם המחיקה הצליחה
+        """
+        deleted_count, _ = self.remove_assets([asset_id])
+        return deleted_count == 1
     
     def get_all_assets(self) -> List[Dict[str, Any]]:
         """
@@ -308,9 +335,14 @@ class AssetsManager:
                         DELETE FROM assets
                         WHERE available = false
                         AND created_at < NOW() - INTERVAL '30 days'
+                        RETURNING id
                     """)
                     
-                    deleted_count = cur.rowcount
+                    deleted_ids = [row['id'] for row in cur.fetchall()]
+                    deleted_count = len(deleted_ids)
+                    candidate_index.on_assets_removed(deleted_ids)
+                    for asset_id in deleted_ids:
+                        asset_catalog.invalidate(asset_id)
                     # Commit handled by context manager
                     
                     logger.info(f'Cleaned up {deleted_count} inactive assets')
@@ -319,81 +351,72 @@ class AssetsManager:
         except Exception as e:
             logger.error(f'Error cleaning inactive assets: {e}')
             return 0
-
-        """
-        מוחק נכס מהמערכת
-        
-        Args:
-            asset_id: מזהה הנכס
-            
-        Returns:
-            האם המחיקה הצליחה
-        """
-        try:
-            # בדוק אם הנכס קיים
-            asset = self.get_asset(asset_id)
-            if not asset:
-                logger.error(f"נכס עם מזהה {asset_id} לא נמצא")
-                return False
-            
-            # בדוק אם הנכס בשימוש בהשכרות פעילות
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT COUNT(*) as count
-                        FROM rentals
-                        WHERE asset_id = %s
-                        AND status IN ('pending', 'active', 'monitoring', 'expiring')
-                    """, (asset_id,))
-                    
-                    result = cur.fetchone()
-                    active_rentals = result['count'] if result else 0
-                    
-                    if active_rentals > 0:
-                        logger.error(f"לא ניתן למחוק נכס {asset_id} כי הוא בשימוש ב-{active_rentals} השכרות פעילות")
-                        return False
-                    
-                    # מחק את הנכס
-                    cur.execute("DELETE FROM assets WHERE id = %s", (asset_id,))
-                    
-                    # הסר מרשימת השמות המקוריים
-                    if asset_id in self.original_names:
-                        del self.original_names[asset_id]
-                    
-                    return True
-                    
-        except Exception as e:
-            logger.error(f"שגיאה במחיקת נכס {asset_id}: {str(e)}")
-            return False
     
-    def search_assets(self, query: str, asset_type: str = None) -> List[Dict[str, Any]]:
+    def search_assets(self, query: str, asset_type: str = None, limit: int = 50,
+                      after: Optional[Tuple[Decimal, int]] = None) -> List[Dict[str, Any]]:
         """
-        מחפש נכסים לפי מילות מפתח בשם, תיאור או תגיות
+        מחפש נכסים לפי דמיון לשם (pg_trgm) או התאמת תגיות, עם דירוג ודפדוף keyset
         
         Args:
             query: מחרוזת חיפוש
             asset_type: סוג נכס (אופציונלי)
+            limit: מספר תוצאות מקסימלי בעמוד
+            after: (score, id) של התוצאה האחרונה בעמוד הקודם (אופציונלי)
+                   - ה-score מוחזר כ-numeric מעוגל כדי שההשוואה בדפדוף תהיה מדויקת
             
         Returns:
-            רשימת נכסים תואמים
+            רשימת נכסים תואמים, ממוינת לפי ציון (score) ואז מזהה
         """
+        query = (query or "").strip()
+        if not query:
+            return []
+        
         try:
-            type_condition = ""
-            params = [f"%{query}%", f"%{query}%"]  # עבור שם ותיאור
+            # תגיות מושוות כמילים שלמות: המחרוזת כולה וכל מילה בה בנפרד
+            tag_terms = list({query, *query.split()})
+            params = {
+                'q': query,
+                'like': f"%{query}%",
+                'tags': tag_terms,
+                'type': asset_type,
+                'limit': limit,
+            }
             
+            type_condition = ""
             if asset_type:
-                type_condition = "AND type = %s"
-                params.append(asset_type)
+                type_condition = "AND type = %(type)s"
+            
+            after_condition = ""
+            if after:
+                after_condition = """
+                    WHERE s.score < %(after_score)s::numeric
+                    OR (s.score = %(after_score)s::numeric AND s.id > %(after_id)s)
+                """
+                params['after_score'], params['after_id'] = after
             
             with get_connection() as conn:
                 with conn.cursor() as cur:
+                    # כל תנאי ה-WHERE הפנימיים נתמכים ע"י אינדקסי GIN
+                    # (טריגרמות על name, מערך על tags) - בלי סריקה מלאה
                     cur.execute(f"""
-                        SELECT *
-                        FROM assets
-                        WHERE (name ILIKE %s OR tags::text ILIKE %s)
-                        {type_condition}
-                        ORDER BY name ASC
-                    """, params + [f"%{query}%"])  # הוספת פרמטר עבור tags
+                        SELECT * FROM (
+                            SELECT a.*,
+                                   ROUND(GREATEST(
+                                       similarity(a.name, %(q)s),
+                                       CASE WHEN a.tags && %(tags)s::text[] THEN 1.0 ELSE 0.0 END
+                                   )::numeric, 6) AS score
+                            FROM assets a
+                            WHERE (
+                                a.name ILIKE %(like)s
+                                OR a.name %% %(q)s
+                                OR a.tags && %(tags)s::text[]
+                            )
+                            {type_condition}
+                        ) s
+                        {after_condition}
+                        ORDER BY s.score DESC, s.id ASC
+                        LIMIT %(limit)s
+                    """, params)
                     
                     assets = cur.fetchall()
                     return [dict(asset) for asset in assets] if assets else []
@@ -412,15 +435,14 @@ class AssetsManager:
         Returns:
             השם המקורי של הנכס או None אם לא נמצא
         """
-        # בדוק אם השם נמצא במטמון
-        if asset_id in self.original_names:
-            return self.original_names[asset_id]
+        # נכס בשם זמני - השם המקורי נמצא ביומן השמות
+        original_name = rename_journal.get_original_name(asset_id)
+        if original_name:
+            return original_name
         
-        # אחרת, קבל מהמסד
         asset = self.get_asset(asset_id)
         if asset:
-            self.original_names[asset_id] = asset['name']
-            return asset['name']
+            return asset.get('original_name') or asset['name']
         
         return None
     
@@ -437,32 +459,35 @@ class AssetsManager:
         try:
             with get_connection() as conn:
                 with conn.cursor() as cur:
-                    # מספר השכרות היסטוריות
+                    # מונים שמתעדכנים בטריגר על rentals (add_analytics_rollups.sql)
                     cur.execute("""
-                        SELECT COUNT(*) as total_rentals,
-                               COUNT(CASE WHEN status IN ('active', 'monitoring', 'expiring') THEN 1 END) as active_rentals,
-                               COUNT(CASE WHEN status = 'expired' THEN 1 END) as expired_rentals,
-                               COUNT(CASE WHEN status = 'canceled' THEN 1 END) as canceled_rentals,
-                               SUM(CASE WHEN status IN ('expired', 'archived') THEN duration_hours ELSE 0 END) as total_hours,
-                               SUM(CASE WHEN status IN ('expired', 'archived') THEN price ELSE 0 END) as total_revenue
-                        FROM rentals
-                        WHERE asset_id = %s
+                        SELECT s.total_rentals, s.active_rentals, s.expired_rentals,
+                               s.canceled_rentals, s.total_hours, s.total_revenue,
+                               r.keyword, r.tier, r.rank, r.price, r.created_at
+                        FROM asset_rental_stats s
+                        LEFT JOIN rentals r ON r.id = s.last_rental_id
+                        WHERE s.asset_id = %s
                     """, (asset_id,))
                     
-                    stats = dict(cur.fetchone() or {})
+                    row = cur.fetchone()
+                    if not row:
+                        # נכס שמעולם לא הושכר
+                        return {
+                            'total_rentals': 0,
+                            'active_rentals': 0,
+                            'expired_rentals': 0,
+                            'canceled_rentals': 0,
+                            'total_hours': 0,
+                            'total_revenue': 0
+                        }
+                    
+                    row = dict(row)
+                    last_rental = {key: row.pop(key) for key in ('keyword', 'tier', 'rank', 'price', 'created_at')}
+                    stats = row
                     
                     # השכרה אחרונה
-                    cur.execute("""
-                        SELECT keyword, tier, rank, price, created_at
-                        FROM rentals
-                        WHERE asset_id = %s
-                        ORDER BY created_at DESC
-                        LIMIT 1
-                    """, (asset_id,))
-                    
-                    last_rental = cur.fetchone()
-                    if last_rental:
-                        stats['last_rental'] = dict(last_rental)
+                    if last_rental['created_at'] is not None:
+                        stats['last_rental'] = last_rental
                     
                     return stats
                     
@@ -532,28 +557,50 @@ class AssetsManager:
         Returns:
             True אם הנכס נמחק בהצלחה, False אחרת
         """
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    # בדיקה שהנכס קיים
-                    cur.execute("SELECT id FROM assets WHERE id = %s", (asset_id,))
-                    if not cur.fetchone():
-                        logger.warning(f"Asset {asset_id} not found for removal")
-                        return False
-                    
-                    # מחיקת הנכס
-                    cur.execute("DELETE FROM assets WHERE id = %s", (asset_id,))
-                    
-                    if cur.rowcount > 0:
-                        logger.info(f"Asset {asset_id} removed successfully")
-                        return True
-                    else:
-                        logger.warning(f"No rows affected when removing asset {asset_id}")
-                        return False
-                        
-        except Exception as e:
-            logger.error(f'Error removing asset {asset_id}: {e}')
-            return False
+        deleted_count, _ = self.remove_assets([asset_id])
+        if not deleted_count:
+            logger.warning(f"Asset {asset_id} was not removed (not found or has rentals)")
+        return deleted_count == 1
+    
+    def _delete_assets(self, asset_ids: Optional[List[int]] = None) -> Tuple[int, int]:
+        """
+        מוחק נכסים בשאילתה אחת, למעט נכסים שיש להם השכרות
+        
+        rentals.asset_id מפנה ל-assets ללא ON DELETE, ולכן נכס עם השכרה כלשהי
+        (גם שהסתיימה או אורכבה) נשאר ונספר ככישלון במקום להכשיל את כל המחיקה.
+        
+        Args:
+            asset_ids: מזהי הנכסים למחיקה (None - כל הנכסים)
+            
+        Returns:
+            (deleted_count, failed_count) - מספר נכסים שנמחקו ונכשלו
+        """
+        id_filter = "a.id = ANY(%(ids)s) AND" if asset_ids is not None else ""
+        params = {'ids': asset_ids}
+        
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM assets a
+                    WHERE {id_filter} NOT EXISTS (
+                        SELECT 1 FROM rentals r
+                        WHERE r.asset_id = a.id
+                    )
+                    RETURNING a.id
+                """, params)
+                deleted_ids = [row['id'] for row in cur.fetchall()]
+                
+                if asset_ids is not None:
+                    failed_count = len(asset_ids) - len(deleted_ids)
+                else:
+                    cur.execute("SELECT COUNT(*) AS count FROM assets")
+                    failed_count = cur.fetchone()['count']
+        
+        candidate_index.on_assets_removed(deleted_ids)
+        for asset_id in deleted_ids:
+            asset_catalog.invalidate(asset_id)
+        
+        return len(deleted_ids), failed_count
     
     def remove_assets(self, asset_ids: List[int]) -> Tuple[int, int]:
         """
@@ -565,31 +612,30 @@ class AssetsManager:
         Returns:
             (deleted_count, failed_count) - מספר נכסים שנמחקו ונכשלו
         """
-        deleted_count = 0
-        failed_count = 0
+        asset_ids = list(dict.fromkeys(asset_ids))
+        if not asset_ids:
+            return 0, 0
         
-        for asset_id in asset_ids:
-            if self.remove_asset(asset_id):
-                deleted_count += 1
-            else:
-                failed_count += 1
-                
-        return deleted_count, failed_count
+        try:
+            deleted_count, failed_count = self._delete_assets(asset_ids)
+            logger.info(f"Removed {deleted_count} assets ({failed_count} not found or with rentals)")
+            return deleted_count, failed_count
+            
+        except Exception as e:
+            logger.error(f'Error removing assets: {e}')
+            return 0, len(asset_ids)
 
     def remove_all_assets(self) -> Tuple[int, int]:
         """
-        מוחק את כל הנכסים במערכת
+        מוחק את כל הנכסים במערכת (למעט נכסים שיש להם השכרות)
         
         Returns:
             (deleted_count, failed_count) - מספר נכסים שנמחקו ונכשלו
         """
         try:
-            # קבלת כל הנכסים
-            assets = self.get_all_assets()
-            asset_ids = [asset['id'] for asset in assets]
-            
-            # מחיקת כל הנכסים
-            return self.remove_assets(asset_ids)
+            deleted_count, failed_count = self._delete_assets()
+            logger.info(f"Removed {deleted_count} assets, {failed_count} kept due to rentals")
+            return deleted_count, failed_count
             
         except Exception as e:
             logger.error(f'Error removing all assets: {e}')
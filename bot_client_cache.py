@@ -0,0 +1,228 @@
+"""
+מודול bot_client_cache - מטמון קליינטים מחוברים של בוטים (לפי טוקן)
+
+הסשן של כל בוט נשמר במסד (bot_sessions) כ-StringSession, כך שההזדהות
+נשמרת גם אחרי הפעלה מחדש. קליינטים מוגבלים במספר (LRU) ומנותקים אחרי
+זמן חוסר פעילות.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from db import get_connection
+from constants import Constants
+
+logger = logging.getLogger(__name__)
+
+# פרטי API להתחברות כבוט
+BOT_API_ID = 6
+BOT_API_HASH = "eb06d4abfb49dc3eeb1aeb98ae0f581e"
+
+
+def _token_hash(bot_token: str) -> str:
+    """
+    מחזיר hash של טוקן הבוט (הטוקן עצמו לא נשמר במפתחות או במסד)
+
+    Args:
+        bot_token: טוקן הבוט
+
+    Returns:
+        hash בפורמט hex
+    """
+    return hashlib.sha256(bot_token.encode("utf-8")).hexdigest()
+
+
+class _CachedClient:
+    """
+    קליינט שמור במטמון וזמן השימוש האחרון בו
+    """
+
+    def __init__(self, client: TelegramClient):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class BotClientCache:
+    """
+    מטמון LRU של קליינטים מזוהים של בוטים עם ניתוק אחרי חוסר פעילות
+    """
+
+    def __init__(self, max_clients: int = Constants.BOT_CLIENT_CACHE_SIZE,
+                 idle_timeout: int = Constants.BOT_CLIENT_IDLE_TIMEOUT):
+        """
+        יוצר מטמון קליינטים
+
+        Args:
+            max_clients: מספר קליינטים מחוברים מקסימלי
+            idle_timeout: שניות חוסר פעילות עד לניתוק קליינט
+        """
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        # {token_hash: _CachedClient} - מהישן לחדש
+        self._clients: "OrderedDict[str, _CachedClient]" = OrderedDict()
+        self._lock: Optional[asyncio.Lock] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def get(self, bot_token: str) -> TelegramClient:
+        """
+        מחזיר קליינט מחובר ומזוהה לבוט (מהמטמון, מסשן שמור או בהזדהות חדשה)
+
+        Args:
+            bot_token: טוקן הבוט
+
+        Returns:
+            קליינט מחובר
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        key = _token_hash(bot_token)
+        async with self._lock:
+            cached = self._clients.get(key)
+            if cached and cached.client.is_connected():
+                cached.last_used = time.monotonic()
+                self._clients.move_to_end(key)
+                return cached.client
+            if cached:
+                del self._clients[key]
+
+            client = await self._connect(key, bot_token)
+            self._clients[key] = _CachedClient(client)
+
+            while len(self._clients) > self.max_clients:
+                _, evicted = self._clients.popitem(last=False)
+                await self._disconnect(evicted.client)
+
+            self._ensure_reaper()
+            return client
+
+    async def _connect(self, key: str, bot_token: str) -> TelegramClient:
+        """
+        מתחבר לבוט - עם הסשן השמור אם קיים, אחרת בהזדהות מלאה
+
+        Args:
+            key: hash הטוקן
+            bot_token: טוקן הבוט
+
+        Returns:
+            קליינט מחובר ומזוהה
+        """
+        saved = self._load_session(key)
+        client = TelegramClient(StringSession(saved), BOT_API_ID, BOT_API_HASH)
+        try:
+            await client.connect()
+
+            if not await client.is_user_authorized():
+                await client.start(bot_token=bot_token)
+                self._save_session(key, client.session.save())
+                logger.info("בוצעה הזדהות חדשה לבוט ונשמר סשן")
+        except Exception:
+            await self._disconnect(client)
+            raise
+
+        return client
+
+    def discard(self, bot_token: str):
+        """
+        מסיר קליינט מהמטמון (למשל אחרי שגיאת RPC) - החיבור הבא ייווצר מחדש
+
+        Args:
+            bot_token: טוקן הבוט
+        """
+        cached = self._clients.pop(_token_hash(bot_token), None)
+        if cached:
+            asyncio.ensure_future(self._disconnect(cached.client))
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.ensure_future(self._reap_idle())
+
+    async def _reap_idle(self):
+        """
+        מנתק קליינטים שלא היו בשימוש יותר מ-idle_timeout
+        """
+        while self._clients:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            now = time.monotonic()
+            async with self._lock:
+                idle = [key for key, cached in self._clients.items()
+                        if now - cached.last_used > self.idle_timeout]
+                for key in idle:
+                    await self._disconnect(self._clients.pop(key).client)
+            if idle:
+                logger.debug(f"נותקו {len(idle)} קליינטים של בוטים שלא היו פעילים")
+
+    @staticmethod
+    async def _disconnect(client: TelegramClient):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning(f"שגיאה בניתוק קליינט בוט: {str(e)}")
+
+    async def close_all(self):
+        """
+        מנתק את כל הקליינטים (בסגירת הבוט)
+        """
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for cached in clients:
+            await self._disconnect(cached.client)
+
+    @staticmethod
+    def _load_session(key: str) -> str:
+        """
+        טוען סשן שמור של בוט מהמסד
+
+        Args:
+            key: hash הטוקן
+
+        Returns:
+            מחרוזת הסשן או מחרוזת ריקה אם אין
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT session_string FROM bot_sessions WHERE token_hash = %s",
+                        (key,),
+                    )
+                    row = cur.fetchone()
+                    return row['session_string'] if row else ""
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת סשן בוט: {str(e)}")
+            return ""
+
+    @staticmethod
+    def _save_session(key: str, session_string: str):
+        """
+        שומר סשן של בוט במסד
+
+        Args:
+            key: hash הטוקן
+            session_string: מחרוזת הסשן
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO bot_sessions (token_hash, session_string, updated_at)
+                        VALUES (%s, %s, NOW())
+                        ON CONFLICT (token_hash) DO UPDATE
+                        SET session_string = EXCLUDED.session_string,
+                            updated_at = NOW()
+                    """, (key, session_string))
+        except Exception as e:
+            logger.error(f"שגיאה בשמירת סשן בוט: {str(e)}")
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+bot_client_cache = BotClientCache()
@@ -9,6 +9,7 @@ import os
 import sys
 import logging
 import asyncio
+import time
 from typing import Dict, List, Optional, Any, Union  # type: ignore
 from dotenv import load_dotenv
 from telethon import TelegramClient, events, Button  # type: ignore
@@ -21,6 +22,15 @@ from rental_manager import rental_manager
 from session_manager import session_manager
 from user_manager import user_manager
 from assets_manager import assets_manager
+from profile_editor import profile_editor
+from rename_planner import rename_planner
+from bot_client_cache import bot_client_cache
+from utils import AsyncHelper, executors
+from notifications import notification_dispatcher
+from rank_jobs import rank_jobs
+from conversation_state import conversation_states
+from bot_metrics import bot_metrics
+from admin_stats import admin_stats
 
 # הגדרת לוגינג
 logging.basicConfig(
@@ -49,8 +59,11 @@ if not BOT_TOKEN or not API_ID or not API_HASH:
 # יצירת הקליינט
 bot = TelegramClient("bot", API_ID, API_HASH)  # type: ignore
 
-# מצבי משתמש - פשוט נשתמש במילון
-user_states = {}  # {user_id: {'state': 'state_name', 'data': {...}}}
+# מדידת זמני ריצה לכל handler שנרשם דרך bot.on וזמני קריאות Telegram
+bot_metrics.install(bot)
+
+# מצבי משתמש - {user_id: {'state': 'state_name', 'data': {...}}} עם תוקף ושמירה אופציונלית במסד
+user_states = conversation_states
 
 # Constants for user states
 STATE_WAITING_FOR_KEYWORD = "waiting_for_keyword"
@@ -79,6 +92,9 @@ async def on_startup():
     """
     logger.info("התחלת הבוט...")
 
+    # קורוטינות שמורצות מ-threads אחרים (למשל watchdog) ירוצו על ה-loop של הבוט
+    AsyncHelper.set_main_loop(asyncio.get_running_loop())
+
     # בדיקת מסד נתונים
     try:
         logger.info("בדיקת חיבור למסד נתונים...")
@@ -87,6 +103,40 @@ async def on_startup():
     except Exception as e:
         logger.error(f"שגיאה בבדיקת מסד נתונים: {str(e)}")
 
+    # הפעלת משלוח ההתראות מתיבת היוצאים
+    notification_dispatcher.start(
+        lambda user_id, text: bot.send_message(user_id, text, parse_mode="html")
+    )
+
+    # שחזור נכסים שנשארו בשם זמני מבדיקת דירוג שקרסה
+    try:
+        restored = await profile_editor.recover_stale_renames()
+        if restored:
+            logger.info(f"שוחזרו {restored} נכסים משמות זמניים")
+    except Exception as e:
+        logger.error(f"שגיאה בשחזור שמות זמניים: {str(e)}")
+
+    # טעינת רשימת המנהלים לזיכרון (בדיקות הרשאה בלי גישה למסד)
+    try:
+        await AsyncHelper.run_sync_in_async(user_manager.load_admin_ids, True)
+    except Exception as e:
+        logger.error(f"שגיאה בטעינת רשימת המנהלים: {str(e)}")
+
+    # ניקוי מצבי שיחה שפגו ושמירתם ברקע
+    conversation_states.start()
+
+    # ייצוא מדדי handlers לקובץ (ול-HTTP אם הוגדר METRICS_PORT)
+    try:
+        await bot_metrics.start(int(os.getenv("METRICS_PORT", "0")) or None)
+    except Exception as e:
+        logger.error(f"שגיאה בהפעלת ייצוא המדדים: {str(e)}")
+
+    # הפעלת תור עבודות הדירוג (עבודות שלא הסתיימו חוזרות לתור)
+    try:
+        await rank_jobs.start()
+    except Exception as e:
+        logger.error(f"שגיאה בהפעלת תור עבודות הדירוג: {str(e)}")
+
     logger.info("הבוט מוכן לשימוש!")
 
 
@@ -99,9 +149,39 @@ async def on_shutdown():
     # סגירת מחסן המצבים
     # הערה: במהדורה 3.x של aiogram אין צורך לסגור מחסן מצבים באופן מפורש
 
+    # עצירת משלוח ההתראות
+    await notification_dispatcher.stop()
+
+    # עצירת תור עבודות הדירוג
+    await rank_jobs.stop()
+
+    # שמירת מצבי השיחה האחרונים
+    await conversation_states.stop()
+
+    # כתיבת המדדים האחרונים
+    await bot_metrics.stop()
+
+    # ביטול רענון סטטיסטיקות שעדיין רץ
+    await admin_stats.stop()
+
+    # שחזור מיידי של שמות נכסים שממתינים לשחזור נדחה
+    try:
+        await rename_planner.flush()
+    except Exception as e:
+        logger.error(f"שגיאה בשחזור שמות נכסים: {str(e)}")
+
+    # ניתוק קליינטים שמורים של בוטים
+    try:
+        await bot_client_cache.close_all()
+    except Exception as e:
+        logger.error(f"שגיאה בניתוק קליינטים של בוטים: {str(e)}")
+
     # סגירת כל הסשנים הפעילים
     session_manager.close_all_sessions()
 
+    # סגירת מאגרי ה-threads המשותפים
+    executors.shutdown(wait=False)
+
     logger.info("הבוט נסגר בהצלחה.")
 
 
@@ -146,6 +226,17 @@ async def cmd_help(event: events.NewMessage.Event):
     await event.respond(help_text, parse_mode="html")
 
 
+@bot.on(events.NewMessage(pattern="/metrics"))
+async def cmd_metrics(event: events.NewMessage.Event):
+    """
+    הצגת מדדי זמני תגובה של ה-handlers (למנהלים בלבד)
+    """
+    if not is_admin(event.sender_id):
+        return
+
+    await event.respond(bot_metrics.format_report(), parse_mode="html")
+
+
 @bot.on(events.NewMessage(pattern="/rent"))
 async def cmd_rent(event: events.NewMessage.Event):
     """
@@ -244,8 +335,7 @@ async def callback_back_to_main(event: CallbackQuery.Event) -> None:
         sender = await event.get_sender()
 
         # איפוס מצב המשתמש
-        if sender.id in user_states:
-            del user_states[sender.id]
+        user_states.discard(sender.id)
 
         # בדיקה אם המשתמש הוא מנהל
         is_admin_user = is_admin(sender.id)
@@ -294,6 +384,7 @@ async def callback_duration(event: CallbackQuery.Event) -> None:
         price = int(event.pattern_match.group(2))
 
         # בדיקת מצב המשתמש
+        await user_states.prefetch(sender.id)
         if sender.id not in user_states:
             await event.edit(
                 "❌ שגיאה במצב המשתמש. אנא התחל מחדש.",
@@ -485,14 +576,28 @@ async def admin_run_rank_cycle(event: CallbackQuery.Event) -> None:
         await event.edit("⛔️ אין לך הרשאות לפעולה זו.")
         return
 
+    async def show_progress(progress: Dict[str, Any]) -> None:
+        await event.edit(
+            "🔄 <b>מחזור דירוג פעיל</b>\n\n"
+            f"📊 התקדמות: {progress['done']}/{progress['total']}\n"
+            f"📈 נבדקו: {progress['checked']}\n"
+            f"🔄 עודכנו: {progress['updated']}\n"
+            f"⚠️ שגיאות: {progress['errors']}",
+            parse_mode="html",
+        )
+
     try:
         await event.edit("🔄 מפעיל מנוע דירוג...")
 
-        # הפעלת מנוע הדירוג
-        await rank_engine.run_rank_cycle()
+        # הפעלת מנוע הדירוג (אם מחזור כבר רץ - ממתין לו ומציג את התקדמותו)
+        result = await rank_engine.run_rank_cycle(progress_callback=show_progress)
 
         await event.edit(
-            "✅ מחזור הדירוג הושלם בהצלחה!",
+            "✅ <b>מחזור הדירוג הושלם בהצלחה!</b>\n\n"
+            f"📈 נבדקו: {result.get('checked', 0)} דירוגים\n"
+            f"🔄 עודכנו: {result.get('updated', 0)} דירוגים\n"
+            f"⚠️ שגיאות: {result.get('errors', 0)}\n\n"
+            f"🕐 זמן ריצה: {result.get('duration', 'N/A')} שניות",
             buttons=[[Button.inline("🔙 חזרה", b"admin_menu")]],
             parse_mode="html",
         )
@@ -520,77 +625,29 @@ async def admin_stats_handler(event: CallbackQuery.Event) -> None:
         return
 
     try:
-        await event.edit(
-            "📊 <b>טוען סטטיסטיקות מערכת...</b>\n\n⏳ אנא המתן...", parse_mode="html"
-        )
-
-        stats_data = {}
-
-        try:
-            if hasattr(user_manager, "get_active_users_count"):
-                active_users = user_manager.get_active_users_count()
-                stats_data["users"] = active_users
-            elif hasattr(user_manager, "get_all_users"):
-                all_users = user_manager.get_all_users()
-                stats_data["users"] = len(all_users) if all_users else 0
-            else:
-                stats_data["users"] = "לא זמין"
-        except Exception as e:
-            logger.error(f"Error getting user stats: {e}")
-            stats_data["users"] = "שגיאה"
+        # תמונת מצב מהמטמון (ספירות SQL מקבילות, רענון ברקע כשהתיישנה)
+        stats = await admin_stats.get_snapshot()
 
-        try:
-            active_rentals = rental_manager.get_rentals_by_status("active")
-            stats_data["rentals"] = len(active_rentals) if active_rentals else 0
-        except Exception:
-            stats_data["rentals"] = "לא זמין"
-
-        try:
-            all_assets = assets_manager.get_all_assets()
-            total_assets = len(all_assets) if all_assets else 0
-            available_assets = (
-                len([a for a in all_assets if a.get("available", True)])
-                if all_assets
-                else 0
-            )
-            stats_data["total_assets"] = total_assets
-            stats_data["available_assets"] = available_assets
-        except Exception:
-            stats_data["total_assets"] = "לא זמין"
-            stats_data["available_assets"] = "לא זמין"
-
-        try:
-            all_sessions = session_manager.get_all_sessions()
-            total_sessions = len(all_sessions) if all_sessions else 0
-            active_sessions = (
-                len([s for s in all_sessions if s.get("status") == "active"])
-                if all_sessions
-                else 0
-            )
-            stats_data["total_sessions"] = total_sessions
-            stats_data["active_sessions"] = active_sessions
-        except Exception:
-            stats_data["total_sessions"] = "לא זמין"
-            stats_data["active_sessions"] = "לא זמין"
-
-        try:
-            from proxy_manager import proxy_manager
+        def section(name: str, title: str, fields: List[tuple]) -> str:
+            counts = stats.get(name)
+            if counts is None:
+                return f"{title}\n   • לא זמין\n"
+            lines = [title]
+            for key, label in fields:
+                lines.append(f"   • {label}: {counts.get(key, 0)}")
+            return "\n".join(lines) + "\n"
 
-            all_proxies = proxy_manager.get_all_proxies()
-            total_proxies = len(all_proxies) if all_proxies else 0
-            active_proxies = proxy_manager.get_active_proxies_count()
-            stats_data["total_proxies"] = total_proxies
-            stats_data["active_proxies"] = active_proxies
-        except Exception:
-            stats_data["total_proxies"] = "לא זמין"
-            stats_data["active_proxies"] = "לא זמין"
-
-        from datetime import datetime
+        age = int(time.time() - stats['updated_at'])
+        updated = "עכשיו" if age < 5 else f"לפני {age} שניות" if age < 120 else f"לפני {age // 60} דקות"
 
         stats_text = (
             "📊 <b>סטטיסטיקות מערכת</b>\n\n"
-            f"👥 <b>משתמשים פעילים:</b> {stats_data.get('users', 'שגיאה')}\n"
-            f"🕒 <b>עודכן:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+            + section("users", "👥 <b>משתמשים:</b>", [("total", "סך הכל"), ("new_today", "חדשים ב-24 שעות")]) + "\n"
+            + section("rentals", "📋 <b>השכרות:</b>", [("total", "סך הכל"), ("live", "פתוחות"), ("active", "פעילות")]) + "\n"
+            + section("assets", "🤖 <b>נכסים:</b>", [("total", "סך הכל"), ("available", "זמינים")]) + "\n"
+            + section("sessions", "🔗 <b>סשנים:</b>", [("total", "סך הכל"), ("active", "פעילים")]) + "\n"
+            + section("proxies", "🌐 <b>פרוקסים:</b>", [("total", "סך הכל"), ("active", "פעילים")]) + "\n"
+            + f"🕒 <b>עודכן:</b> {updated}"
         )
 
         buttons = [
@@ -895,7 +952,8 @@ async def handle_text_message(event: NewMessage.Event) -> None:
         if sender is None:
             return
 
-        # בדיקת מצב המשתמש
+        # בדיקת מצב המשתמש (טעינה מהמסד מחוץ ל-loop)
+        await user_states.prefetch(sender.id)
         if sender.id not in user_states:
             return
 
@@ -960,8 +1018,7 @@ async def handle_text_message(event: NewMessage.Event) -> None:
             )
 
             # איפוס מצב המשתמש
-            if sender.id in user_states:
-                del user_states[sender.id]
+            user_states.discard(sender.id)
 
     except Exception as e:
         logger.error(f"שגיאה בטיפול בהודעת טקסט: {str(e)}")
@@ -1013,6 +1070,7 @@ async def select_asset_handler(event: CallbackQuery.Event) -> None:
     asset_type = event.pattern_match.group(1).decode('utf-8')
     
     # בדיקת מצב המשתמש
+    await user_states.prefetch(sender.id)
     if sender.id not in user_states or user_states[sender.id].get('state') != STATE_WAITING_FOR_KEYWORD:
         await event.edit("❌ שגיאה במצב המשתמש. אנא התחל מחדש עם /rent")
         return
@@ -1069,6 +1127,7 @@ async def select_duration_handler(event: CallbackQuery.Event) -> None:
     price = int(event.pattern_match.group(2).decode('utf-8'))
     
     # בדיקת מצב המשתמש
+    await user_states.prefetch(sender.id)  # type: ignore
     if sender.id not in user_states or user_states[sender.id].get('state') != STATE_WAITING_FOR_DURATION:  # type: ignore
         await event.edit("❌ שגיאה במצב המשתמש. אנא התחל מחדש עם /rent")  # type: ignore
         return
@@ -1130,6 +1189,7 @@ async def payment_handler(event: CallbackQuery.Event) -> None:
     payment_method = event.pattern_match.group(1).decode('utf-8')
     
     # בדיקת מצב המשתמש
+    await user_states.prefetch(sender.id)  # type: ignore
     if sender.id not in user_states or user_states[sender.id].get('state') != STATE_WAITING_FOR_PAYMENT:  # type: ignore
         await event.edit("❌ שגיאה במצב המשתמש. אנא התחל מחדש עם /rent")  # type: ignore
         return
@@ -1181,6 +1241,7 @@ async def confirm_payment_handler(event: CallbackQuery.Event) -> None:
         return
     
     # בדיקת מצב המשתמש
+    await user_states.prefetch(sender.id)  # type: ignore
     if sender.id not in user_states:  # type: ignore
         await event.edit("❌ שגיאה במצב המשתמש. אנא התחל מחדש עם /rent")  # type: ignore
         return
@@ -1219,8 +1280,7 @@ async def confirm_payment_handler(event: CallbackQuery.Event) -> None:
         await event.edit(success_text, buttons=buttons, parse_mode='html')
         
         # איפוס מצב המשתמש
-        if sender.id in user_states:
-            del user_states[sender.id]
+        user_states.discard(sender.id)
             
     except Exception as e:
         logger.error(f"שגיאה ביצירת השכרה: {str(e)}")
@@ -1293,8 +1353,7 @@ async def handle_admin_text_messages(event: NewMessage.Event, sender: Any, curre
             )
             
             # איפוס מצב המשתמש
-            if sender.id in user_states:  # type: ignore
-                del user_states[sender.id]  # type: ignore
+            user_states.discard(sender.id)  # type: ignore
                 
         except Exception as e:
             logger.error(f"שגיאה בהוספת בוט: {str(e)}")
@@ -1316,8 +1375,7 @@ async def back_to_main_handler(event: CallbackQuery.Event) -> None:
         return
     
     # איפוס מצב המשתמש
-    if sender.id in user_states:  # type: ignore
-        del user_states[sender.id]  # type: ignore
+    user_states.discard(sender.id)  # type: ignore
     
     await event.edit(  # type: ignore
         "🏠 <b>תפריט ראשי</b>\n\n"
@@ -1720,109 +1778,6 @@ async def admin_remove_assets_handler(event: CallbackQuery.Event) -> None:
     )
 
 
-@bot.on(events.CallbackQuery(pattern=b"admin_stats"))
-async def admin_stats_handler(event: CallbackQuery.Event) -> None:
-    """הצגת סטטיסטיקות מערכת"""
-    await event.answer()  # type: ignore
-    sender = await event.get_sender()  # type: ignore
-    
-    if sender is None:
-        await event.edit("❌ שגיאה באימות משתמש.")  # type: ignore
-        return
-    
-    if not is_admin(sender.id):  # type: ignore
-        await event.edit("⛔️ אין לך הרשאות לפעולה זו.")  # type: ignore
-        return
-    
-    try:
-        # איסוף סטטיסטיקות
-        total_sessions = len(session_manager.get_all_sessions())  # type: ignore
-        total_assets = len(assets_manager.get_all_assets())  # type: ignore
-        total_rentals = len(rental_manager.get_all_rentals())  # type: ignore
-        
-        # סטטיסטיקות פעילות
-        active_sessions = len([s for s in session_manager.get_all_sessions() if s.get('is_active', False)])  # type: ignore
-        active_assets = len([a for a in assets_manager.get_all_assets() if a.get('is_available', False)])  # type: ignore
-        
-        stats_text = (
-            "📊 <b>סטטיסטיקות מערכת</b>\n\n"
-            f"🔗 <b>סשנים:</b>\n"
-            f"   • סך הכל: {total_sessions}\n"
-            f"   • פעילים: {active_sessions}\n"
-            f"   • לא פעילים: {total_sessions - active_sessions}\n\n"
-            f"🤖 <b>נכסים:</b>\n"
-            f"   • סך הכל: {total_assets}\n"
-            f"   • זמינים: {active_assets}\n"
-            f"   • לא זמינים: {total_assets - active_assets}\n\n"
-            f"📋 <b>השכרות:</b>\n"
-            f"   • סך הכל: {total_rentals}\n\n"
-            f"🕐 <b>עדכון אחרון:</b> עכשיו"
-        )
-        
-        await event.edit(  # type: ignore
-            stats_text,
-            buttons=[
-                [Button.inline("🔄 רענן", b"admin_stats")],  # type: ignore
-                [Button.inline("🔙 חזרה", b"admin_menu")]  # type: ignore
-            ],
-            parse_mode='html'
-        )
-        
-    except Exception as e:
-        logger.error(f"שגיאה בהצגת סטטיסטיקות: {str(e)}")
-        await event.edit(  # type: ignore
-            "❌ שגיאה בטעינת הסטטיסטיקות",
-            buttons=[[Button.inline("🔙 חזרה", b"admin_menu")]],  # type: ignore
-        )
-
-
-@bot.on(events.CallbackQuery(pattern=b"admin_run_rank_cycle"))
-async def admin_run_rank_cycle_handler(event: CallbackQuery.Event) -> None:
-    """הפעלת מנוע דירוג"""
-    await event.answer()  # type: ignore
-    sender = await event.get_sender()  # type: ignore
-    
-    if sender is None:
-        await event.edit("❌ שגיאה באימות משתמש.")  # type: ignore
-        return
-    
-    if not is_admin(sender.id):  # type: ignore
-        await event.edit("⛔️ אין לך הרשאות לפעולה זו.")  # type: ignore
-        return
-    
-    await event.edit(  # type: ignore
-        "🔄 <b>הפעלת מנוע דירוג</b>\n\n"
-        "⏳ מפעיל מנוע דירוג...\n"
-        "אנא המתן, זה עלול לקחת מספר דקות.",
-        parse_mode='html'
-    )
-    
-    try:
-        # הפעלת מנוע הדירוג
-        result = await rank_engine.run_cycle()  # type: ignore
-        
-        success_text = (
-            "✅ <b>מנוע הדירוג הופעל בהצלחה!</b>\n\n"
-            f"📈 נבדקו: {result.get('checked', 0)} דירוגים\n"
-            f"🔄 עודכנו: {result.get('updated', 0)} דירוגים\n"
-            f"⚠️ שגיאות: {result.get('errors', 0)}\n\n"
-            f"🕐 זמן ריצה: {result.get('duration', 'N/A')} שניות"
-        )
-        
-        await event.edit(  # type: ignore
-            success_text,
-            buttons=[[Button.inline("🔙 חזרה", b"admin_menu")]],  # type: ignore
-            parse_mode='html'
-        )
-        
-    except Exception as e:
-        logger.error(f"שגיאה בהפעלת מנוע דירוג: {str(e)}")
-        await event.edit(  # type: ignore
-            f"❌ שגיאה בהפעלת מנוע הדירוג:\n{str(e)}",
-            buttons=[[Button.inline("🔙 חזרה", b"admin_menu")]],  # type: ignore
-        )
-
-
 # =============================================================================
 # Additional Admin Handlers - handlers נוספים לפעולות ספציפיות
 # =============================================================================
@@ -0,0 +1,369 @@
+"""
+מודול bot_metrics - מדידת זמני תגובה ותפוקה של handlers בבוט
+
+כל handler שנרשם דרך bot.on נעטף: נמדדים היסטוגרמת זמן ריצה, מספר שגיאות
+ומספר קריאות פעילות לכל handler. בתוך handler ניתן למדוד תתי-שלבים
+(מסד נתונים, קריאות Telegram, מנוע הדירוג) בעזרת span - הזמן משויך
+ל-handler הפעיל דרך contextvar. המדדים זמינים כטקסט למנהל, כקובץ בפורמט
+Prometheus ובאופן אופציונלי כ-endpoint של HTTP.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from constants import Constants
+
+logger = logging.getLogger(__name__)
+
+# גבולות דליי ההיסטוגרמה בשניות
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+SPAN_DB = "db"
+SPAN_TELEGRAM = "telegram"
+SPAN_RANK = "rank"
+
+# handler שמטופל כרגע (לשיוך תתי-שלבים)
+_current_handler: ContextVar[Optional[str]] = ContextVar("current_handler", default=None)
+
+
+class Histogram:
+    """
+    היסטוגרמה מצטברת של משכי זמן
+    """
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        הערכת אחוזון לפי גבול הדלי העליון
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound if bound != float("inf") else BUCKETS[-2]
+        return BUCKETS[-2]
+
+
+class HandlerStats:
+    """
+    מדדים של handler בודד
+    """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.in_flight = 0
+        self.spans: Dict[str, Histogram] = {}
+
+
+class _Span:
+    """
+    מדידת תת-שלב - עובד גם כ-context manager רגיל וגם אסינכרוני
+    """
+
+    def __init__(self, metrics: "BotMetrics", kind: str):
+        self.metrics = metrics
+        self.kind = kind
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record_span(self.kind, time.perf_counter() - self.started)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+class BotMetrics:
+    """
+    אוסף מדדים לכל ה-handlers
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, HandlerStats] = {}
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._task: Optional[asyncio.Task] = None
+        self._http_runner = None
+
+    def _stats(self, name: str) -> HandlerStats:
+        stats = self._handlers.get(name)
+        if stats is None:
+            stats = self._handlers[name] = HandlerStats()
+        return stats
+
+    # -------------------------------------------------------------------------
+    # מדידה
+    # -------------------------------------------------------------------------
+
+    def instrument(self, func: Callable, name: Optional[str] = None) -> Callable:
+        """
+        עוטף handler אסינכרוני במדידה
+
+        Args:
+            func: ה-handler
+            name: שם המדד (ברירת מחדל - שם הפונקציה)
+
+        Returns:
+            ה-handler העטוף
+        """
+        name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _current_handler.set(name)
+            with self._lock:
+                self._stats(name).in_flight += 1
+            started = time.perf_counter()
+            failed = False
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                # StopPropagation ודומיו הם בקרת זרימה של Telethon, לא שגיאה
+                failed = not type(e).__name__.endswith("Propagation")
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    stats = self._stats(name)
+                    stats.in_flight -= 1
+                    stats.latency.observe(elapsed)
+                    stats.errors += failed
+                _current_handler.reset(token)
+
+        return wrapper
+
+    def span(self, kind: str) -> _Span:
+        """
+        מודד תת-שלב של ה-handler הפעיל
+
+        Args:
+            kind: סוג תת-השלב (SPAN_*)
+        """
+        return _Span(self, kind)
+
+    def record_span(self, kind: str, seconds: float):
+        """
+        רושם משך של תת-שלב ל-handler הפעיל (מחוץ ל-handler - לא נרשם)
+        """
+        name = _current_handler.get()
+        if name is None:
+            return
+        with self._lock:
+            spans = self._stats(name).spans
+            histogram = spans.get(kind)
+            if histogram is None:
+                histogram = spans[kind] = Histogram()
+            histogram.observe(seconds)
+
+    def install(self, client: Any):
+        """
+        מתקין את המדידה על קליינט Telethon: עוטף כל handler שנרשם דרך client.on
+        ומודד כל קריאת RPC כתת-שלב telegram
+        """
+        original_on = client.on
+
+        def on(event):
+            register = original_on(event)
+
+            def decorator(func):
+                register(self.instrument(func))
+                # מחזירים את הפונקציה המקורית כמו Telethon
+                return func
+
+            return decorator
+
+        client.on = on
+
+        original_call = getattr(client, "_call", None)
+        if original_call is not None:
+            async def call(*args, **kwargs):
+                with self.span(SPAN_TELEGRAM):
+                    return await original_call(*args, **kwargs)
+
+            client._call = call
+
+    # -------------------------------------------------------------------------
+    # תצוגה
+    # -------------------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        מחזיר את המדדים הנוכחיים לכל handler
+        """
+        with self._lock:
+            result = {}
+            for name, stats in self._handlers.items():
+                result[name] = {
+                    'calls': stats.latency.count,
+                    'errors': stats.errors,
+                    'in_flight': stats.in_flight,
+                    'avg': stats.latency.total / stats.latency.count if stats.latency.count else 0.0,
+                    'p50': stats.latency.quantile(0.5),
+                    'p95': stats.latency.quantile(0.95),
+                    'spans': {
+                        kind: {
+                            'count': h.count,
+                            'total': h.total,
+                            'avg': h.total / h.count if h.count else 0.0,
+                        }
+                        for kind, h in stats.spans.items()
+                    },
+                }
+            return result
+
+    def format_report(self, limit: int = 15) -> str:
+        """
+        דוח טקסט למנהל - ה-handlers האיטיים ביותר לפי p95
+        """
+        snapshot = self.snapshot()
+        if not snapshot:
+            return "אין עדיין מדדים."
+        uptime = int(time.time() - self._started_at)
+        lines = [f"📊 <b>מדדי handlers</b> (זמן פעילות {uptime // 3600}h{uptime % 3600 // 60:02d}m)\n"]
+        ordered = sorted(snapshot.items(), key=lambda item: item[1]['p95'], reverse=True)
+        for name, stats in ordered[:limit]:
+            line = (
+                f"<code>{name}</code>: {stats['calls']} קריאות, "
+                f"avg {stats['avg'] * 1000:.0f}ms, p95≤{stats['p95'] * 1000:.0f}ms"
+            )
+            if stats['errors']:
+                line += f", ⚠️ {stats['errors']} שגיאות"
+            if stats['in_flight']:
+                line += f", {stats['in_flight']} פעילות"
+            spans = ", ".join(
+                f"{kind} {span['avg'] * 1000:.0f}ms×{span['count'] / max(stats['calls'], 1):.1f}"
+                for kind, span in sorted(stats['spans'].items())
+            )
+            if spans:
+                line += f"\n    └ {spans}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """
+        המדדים בפורמט הטקסט של Prometheus
+        """
+        with self._lock:
+            items: List[Tuple[str, HandlerStats]] = list(self._handlers.items())
+            lines = [
+                "# TYPE bot_handler_duration_seconds histogram",
+            ]
+            for name, stats in items:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.latency.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'bot_handler_duration_seconds_bucket{{handler="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'bot_handler_duration_seconds_sum{{handler="{name}"}} {stats.latency.total}')
+                lines.append(f'bot_handler_duration_seconds_count{{handler="{name}"}} {stats.latency.count}')
+            lines.append("# TYPE bot_handler_errors_total counter")
+            for name, stats in items:
+                lines.append(f'bot_handler_errors_total{{handler="{name}"}} {stats.errors}')
+            lines.append("# TYPE bot_handler_in_flight gauge")
+            for name, stats in items:
+                lines.append(f'bot_handler_in_flight{{handler="{name}"}} {stats.in_flight}')
+            lines.append("# TYPE bot_handler_span_seconds summary")
+            for name, stats in items:
+                for kind, h in stats.spans.items():
+                    lines.append(f'bot_handler_span_seconds_sum{{handler="{name}",span="{kind}"}} {h.total}')
+                    lines.append(f'bot_handler_span_seconds_count{{handler="{name}",span="{kind}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    # -------------------------------------------------------------------------
+    # ייצוא
+    # -------------------------------------------------------------------------
+
+    def write_file(self, path: str = Constants.METRICS_FILE):
+        """
+        כותב את המדדים לקובץ (לאיסוף על ידי node_exporter textfile collector או דומה)
+        """
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"שגיאה בכתיבת קובץ מדדים: {str(e)}")
+
+    async def start(self, port: Optional[int] = None):
+        """
+        מתחיל כתיבה תקופתית של קובץ המדדים, ואם הוגדר פורט - endpoint של HTTP
+
+        Args:
+            port: פורט ל-/metrics (None - ללא HTTP)
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+        if port and self._http_runner is None:
+            try:
+                from aiohttp import web
+            except ImportError:
+                logger.warning("aiohttp לא מותקן - endpoint המדדים לא יופעל")
+                return
+
+            async def handle(request):
+                return web.Response(text=self.render_prometheus(), content_type="text/plain")
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle)
+            self._http_runner = web.AppRunner(app)
+            await self._http_runner.setup()
+            await web.TCPSite(self._http_runner, "0.0.0.0", port).start()
+            logger.info(f"endpoint מדדים פעיל על פורט {port}")
+
+    async def stop(self):
+        """
+        עוצר את הכתיבה התקופתית ואת ה-endpoint
+        """
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._http_runner is not None:
+            await self._http_runner.cleanup()
+            self._http_runner = None
+        self.write_file()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(Constants.METRICS_WRITE_INTERVAL)
+            self.write_file()
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+bot_metrics = BotMetrics()
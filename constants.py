@@ -36,6 +36,7 @@ class Constants:
     DATA_DIR = os.path.join(BASE_DIR, "data")
     SESSION_DIR = os.path.join(DATA_DIR, "session")
     LOGS_DIR = os.path.join(BASE_DIR, "logs")
+    METRICS_FILE = os.path.join(DATA_DIR, "metrics.prom")  # מדדי handlers בפורמט Prometheus
     
     # סוגי סשנים
     SESSION_TYPE_CLEAN = "clean"
@@ -48,12 +49,46 @@ class Constants:
     EXPIRY_REMINDER_HOURS = 3  # שעות לפני פקיעת תוקף לשלוח תזכורת
     LAST_MINUTE_REMINDER = 900  # 15 דקות לפני פקיעת תוקף
     PAYMENT_EXPIRY_HOURS = 4  # שעות עד לביטול הזמנה ללא תשלום
+    RENAME_JOURNAL_TIMEOUT = 300  # שניות עד ששם זמני שלא שוחזר נחשב תקוע
+    RENAME_RESTORE_DELAY = 120  # שניות להמתנה לפני שחזור שם מקורי (איחוד בדיקות רצופות)
+    BOT_CLIENT_IDLE_TIMEOUT = 600  # שניות חוסר פעילות עד לניתוק קליינט בוט שמור
+    BOT_CLIENT_CACHE_SIZE = 50  # מספר קליינטים מחוברים של בוטים במטמון
     ARCHIVE_DAYS = 30  # ימים עד לארכוב השכרות שהסתיימו
     WATCHDOG_INTERVAL = 7200  # בדיקת watchdog כל שעתיים (7200 שניות)
+    SESSION_RECLASSIFY_INTERVAL = 21600  # סיווג מחדש של סשנים כל 6 שעות
+    SESSION_CLASSIFICATION_TTL = 86400  # תוקף סיווג סשן - רק סיווגים שפגו נבדקים מחדש
+    SESSION_MAX_BUSY = 900  # שניות עבודה רצופה של סשן לפני הפסקת SESSION_COOLDOWN
+    RANK_KEYWORD_CHECK_COST = 35  # הערכת זמן (שניות) לבדיקת מילת מפתח אחת כולל שינוי שם
+    RANK_CYCLE_CONCURRENCY = 3  # נכסים שנבדקים במקביל במחזור דירוג
+    RANK_CYCLE_PROGRESS_INTERVAL = 5  # שניות מינימום בין עדכוני התקדמות של מחזור דירוג
+    RANK_JOB_WORKERS = 2  # עבודות דירוג שרצות במקביל בתור העבודות
+    RANK_JOB_RESULT_TTL = 600  # שניות לשמירת תוצאת עבודת דירוג לשימוש חוזר
+    CONVERSATION_STATE_TTL = 3600  # שניות עד שמצב שיחה נטוש נמחק
+    CONVERSATION_STATE_MAX_ENTRIES = 10000  # מספר מצבי שיחה מקסימלי בזיכרון
+    CONVERSATION_STATE_FLUSH_INTERVAL = 5  # שניות בין כתיבות מצבי שיחה למסד
+    CONVERSATION_STATE_MISS_TTL = 30  # שניות לזכירת משתמש ללא מצב במסד (בלי שאילתה חוזרת)
+    METRICS_WRITE_INTERVAL = 15  # שניות בין כתיבות קובץ המדדים
+    ADMIN_STATS_TTL = 30  # שניות שבהן סטטיסטיקות המנהל מוצגות מהמטמון
+    ADMIN_STATS_MAX_STALE = 600  # שניות שבהן מוצגת תמונה ישנה בזמן רענון ברקע
+    USER_CACHE_TTL = 60  # שניות לשמירת פרופיל משתמש במטמון
+    USER_CACHE_MAX_ENTRIES = 5000  # מספר פרופילי משתמשים מקסימלי במטמון
+    ADMIN_CACHE_TTL = 300  # שניות עד לטעינה מחדש של רשימת המנהלים מהמסד
     FINAL_REMINDER_MINUTES = 15  # דקות לפני סיום להודעה אחרונה
     
     # טיימאאוט
     API_TIMEOUT = 30  # שניות לפני timeout בקריאת API
+    SESSION_WAIT_TIMEOUT = 30  # שניות להמתנה לסשן פנוי לפני ויתור
+    
+    # נתיבי עדיפות לסשנים (session_manager)
+    SESSION_LANE_WEIGHTS = {
+        "customer": 6,  # בקשות לקוחות (/check, /buy)
+        "watchdog": 3,  # רענוני watchdog ומחזורי דירוג
+        "warming": 1    # חימום סשנים ועבודות רקע
+    }
+    SESSION_LANE_RESERVED = {
+        "customer": 0.25,  # חלק מהסשנים ששמור רק ללקוחות
+        "watchdog": 0.1    # חלק נוסף שאינו זמין לחימום
+    }
     
     # מחירים
     PRICE_TIER_PREMIUM = {
@@ -68,6 +103,7 @@ class Constants:
     MIN_SESSIONS_REQUIRED = 5  # מינימום סשנים נדרשים לפעילות תקינה
     DEFAULT_REFUND_PERCENT = 70  # החזר כספי ברירת מחדל באחוזים (70%)
     RANK_REGULAR_MAX = 7  # דירוג מקסימלי לרמה רגילה
+    CANDIDATE_CHECK_LIMIT = 8  # מספר נכסים מועמדים לבדיקת דירוג לכל מילת מפתח
     
     # API טלגרם
     TELEGRAM_API_ID = os.getenv("TELEGRAM_API_ID")
@@ -82,6 +118,15 @@ class Constants:
     NOTIFICATION_TYPE_RANK_DROP = "rank_drop"
     NOTIFICATION_TYPE_SYSTEM = "system"
     
+    # משלוח התראות (notification_outbox)
+    NOTIFICATION_BATCH_SIZE = 50  # התראות לכל אצוות משלוח
+    NOTIFICATION_GLOBAL_RATE = 25  # הודעות לשנייה לכל הבוט (מגבלת טלגרם ~30)
+    NOTIFICATION_PER_CHAT_RATE = 1  # הודעות לשנייה לכל צ'אט
+    NOTIFICATION_MAX_ATTEMPTS = 5  # ניסיונות משלוח לפני סימון ככישלון
+    NOTIFICATION_RETRY_BASE = 30  # שניות המתנה בסיסיות לניסיון חוזר (מוכפל בכל ניסיון)
+    NOTIFICATION_RETRY_MAX = 3600  # המתנה מקסימלית לניסיון חוזר
+    NOTIFICATION_POLL_INTERVAL = 5  # שניות בין בדיקות לתיבת היוצאים כשהיא ריקה
+    
     # הגדרות בוט
     BOT_USERNAME = "RentSpotBot"
     BOT_COMMAND_PREFIX = "/"
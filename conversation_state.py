@@ -0,0 +1,373 @@
+"""
+מודול conversation_state - מחסן מצבי שיחה של משתמשים בבוט
+
+מחליף מילון גלובלי: לכל רשומה יש תוקף (TTL), מספר הרשומות בזיכרון חסום
+(LRU), ובמצב PostgreSQL הרשומות נכתבות ברקע לטבלה משותפת כך שמשתמשים
+ממשיכים את השיחה אחרי הפעלה מחדש ובין מופעים שונים של הבוט.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from psycopg2.extras import execute_values
+
+from constants import Constants
+from db import get_connection
+from utils import AsyncHelper
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """
+    רשומת מצב בזיכרון - ערך ותוקף
+    """
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value: Dict[str, Any], expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class ConversationStateStore(MutableMapping):
+    """
+    מחסן מצבי שיחה {user_id: {'state': ..., 'data': {...}}} עם TTL, LRU ושמירה אופציונלית ב-PostgreSQL
+
+    הרשומות המוחזרות ניתנות לשינוי במקום (למשל store[uid]['data']['x'] = 1);
+    כל גישה לרשומה מסמנת אותה לכתיבה ברקע.
+    """
+
+    def __init__(self, ttl: int = Constants.CONVERSATION_STATE_TTL,
+                 max_entries: int = Constants.CONVERSATION_STATE_MAX_ENTRIES,
+                 persistent: bool = False,
+                 flush_interval: float = Constants.CONVERSATION_STATE_FLUSH_INTERVAL,
+                 miss_ttl: float = Constants.CONVERSATION_STATE_MISS_TTL):
+        """
+        יוצר מחסן מצבים
+
+        Args:
+            ttl: שניות עד שמצב שלא נגעו בו פג
+            max_entries: מספר רשומות מקסימלי בזיכרון
+            persistent: האם לשמור את המצבים ב-PostgreSQL
+            flush_interval: שניות בין כתיבות לרקע
+            miss_ttl: שניות לזכירת משתמש שאין לו מצב במסד
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.flush_interval = flush_interval
+        self.miss_ttl = miss_ttl
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._deleted: Set[int] = set()
+        # רשומות ששונו ופונו מהזיכרון לפני שנכתבו - נכתבות בסבב הכתיבה הבא
+        self._evicted: Dict[int, _Entry] = {}
+        # {user_id: זמן תפוגה} - משתמשים שנבדקו במסד ואין להם מצב
+        self._misses: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._task: Optional[asyncio.Task] = None
+
+    # -------------------------------------------------------------------------
+    # ממשק מילון
+    # -------------------------------------------------------------------------
+
+    def _cached_entry(self, user_id: int) -> Tuple[Optional[_Entry], bool]:
+        """
+        מחפש רשומה בזיכרון בלבד (נקרא תחת הנעילה)
+
+        Returns:
+            (רשומה או None, האם צריך לטעון מהמסד)
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.expires_at < time.time():
+            self._drop(user_id)
+            entry = None
+        if entry is None and user_id in self._evicted:
+            # רשומה שפונתה לפני שנכתבה - מחזירים אותה לזיכרון במקום לקרוא גרסה ישנה מהמסד
+            evicted = self._evicted.pop(user_id)
+            if evicted.expires_at >= time.time():
+                entry = self._insert(user_id, evicted.value)
+                entry.expires_at = evicted.expires_at
+        if entry is not None:
+            self._entries.move_to_end(user_id)
+            return entry, False
+        if not self.persistent or user_id in self._deleted:
+            return None, False
+        miss_expires = self._misses.get(user_id)
+        if miss_expires is not None:
+            if miss_expires >= time.monotonic():
+                return None, False
+            del self._misses[user_id]
+        return None, True
+
+    def _store_loaded(self, user_id: int, value: Optional[Dict[str, Any]]) -> Optional[_Entry]:
+        """
+        שומר תוצאת טעינה מהמסד, אלא אם הרשומה נקבעה או נמחקה בזמן הטעינה
+        """
+        with self._lock:
+            entry, needs_load = self._cached_entry(user_id)
+            if not needs_load:
+                return entry
+            if value is None:
+                self._misses[user_id] = time.monotonic() + self.miss_ttl
+                self._misses.move_to_end(user_id)
+                while len(self._misses) > self.max_entries:
+                    self._misses.popitem(last=False)
+                return None
+            return self._insert(user_id, value, mark_dirty=False)
+
+    def _get_entry(self, user_id: int) -> Optional[_Entry]:
+        """
+        מחזיר רשומה בתוקף (מהזיכרון או מהמסד) ומרענן את מיקומה ב-LRU
+
+        הקריאה מהמסד מתבצעת מחוץ לנעילה; בקוד אסינכרוני יש לקרוא קודם
+        ל-prefetch כדי שהקריאה לא תחסום את ה-loop.
+        """
+        with self._lock:
+            entry, needs_load = self._cached_entry(user_id)
+        if not needs_load:
+            return entry
+        return self._store_loaded(user_id, self._load(user_id))
+
+    async def prefetch(self, user_id: int) -> None:
+        """
+        טוען את מצב המשתמש מהמסד ב-thread pool (אם אינו בזיכרון), כך שהגישות
+        הבאות למחסן לא יריצו שאילתה על ה-loop
+        """
+        with self._lock:
+            _, needs_load = self._cached_entry(user_id)
+        if needs_load:
+            value = await AsyncHelper.run_sync_in_async(self._load, user_id)
+            self._store_loaded(user_id, value)
+
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        entry = self._get_entry(user_id)
+        if entry is None:
+            raise KeyError(user_id)
+        with self._lock:
+            # הרשומה עשויה להשתנות במקום - גישה מאריכה את התוקף ומסמנת לכתיבה
+            entry.expires_at = time.time() + self.ttl
+            if self.persistent:
+                self._dirty.add(user_id)
+            return entry.value
+
+    def __setitem__(self, user_id: int, value: Dict[str, Any]):
+        with self._lock:
+            self._deleted.discard(user_id)
+            self._misses.pop(user_id, None)
+            self._evicted.pop(user_id, None)
+            self._insert(user_id, value)
+
+    def __delitem__(self, user_id: int):
+        if self._get_entry(user_id) is None:
+            raise KeyError(user_id)
+        with self._lock:
+            self._drop(user_id)
+
+    def discard(self, user_id: int):
+        """
+        מוחק את מצב המשתמש אם קיים - בלי לקרוא מהמסד (בטוח לקריאה מה-loop)
+        """
+        with self._lock:
+            self._misses.pop(user_id, None)
+            self._drop(user_id)
+
+    def __contains__(self, user_id: object) -> bool:
+        return self._get_entry(user_id) is not None  # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator[int]:
+        with self._lock:
+            now = time.time()
+            return iter([uid for uid, entry in self._entries.items() if entry.expires_at >= now])
+
+    def __len__(self) -> int:
+        with self._lock:
+            now = time.time()
+            return sum(1 for entry in self._entries.values() if entry.expires_at >= now)
+
+    def _insert(self, user_id: int, value: Dict[str, Any], mark_dirty: bool = True) -> _Entry:
+        entry = _Entry(value, time.time() + self.ttl)
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        if mark_dirty and self.persistent:
+            self._dirty.add(user_id)
+        # פינוי הרשומות הישנות ביותר - במצב persistent הן נשארות במסד
+        while len(self._entries) > self.max_entries:
+            evicted, evicted_entry = self._entries.popitem(last=False)
+            if evicted in self._dirty:
+                # שינויים שטרם נכתבו עוברים לכתיבת הרקע הבאה
+                self._evicted[evicted] = evicted_entry
+            self._dirty.discard(evicted)
+        return entry
+
+    def _drop(self, user_id: int):
+        self._entries.pop(user_id, None)
+        self._evicted.pop(user_id, None)
+        self._dirty.discard(user_id)
+        if self.persistent:
+            self._deleted.add(user_id)
+
+    def purge_expired(self) -> int:
+        """
+        מסיר מהזיכרון רשומות שפג תוקפן
+
+        Returns:
+            מספר הרשומות שהוסרו
+        """
+        with self._lock:
+            now = time.time()
+            expired = [uid for uid, entry in self._entries.items() if entry.expires_at < now]
+            for uid in expired:
+                self._entries.pop(uid, None)
+                self._dirty.discard(uid)
+            monotonic_now = time.monotonic()
+            for uid in [uid for uid, expires in self._misses.items() if expires < monotonic_now]:
+                del self._misses[uid]
+            return len(expired)
+
+    # -------------------------------------------------------------------------
+    # PostgreSQL
+    # -------------------------------------------------------------------------
+
+    def _load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        טוען מצב בתוקף של משתמש מהמסד
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT state, data FROM conversation_states
+                        WHERE user_id = %s AND expires_at > NOW()
+                    """, (user_id,))
+                    row = cur.fetchone()
+                    if not row:
+                        return None
+                    return {'state': row['state'], 'data': row['data'] or {}}
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת מצב שיחה של משתמש {user_id}: {str(e)}")
+            return None
+
+    @staticmethod
+    def _serialize(user_id: int, entry: _Entry) -> Tuple[int, Any, str, float]:
+        value = entry.value
+        return (
+            user_id,
+            value.get('state'),
+            json.dumps(value.get('data') or {}, ensure_ascii=False, default=str),
+            entry.expires_at,
+        )
+
+    @staticmethod
+    def _flush_ids(rows: List[Tuple[int, Any, str, float]], deleted: Set[int]) -> bool:
+        """
+        כותב רשומות שהשתנו (כבר מסוריאלזות) ומוחק רשומות שהוסרו בטרנזקציה אחת
+        """
+        if not rows and not deleted:
+            return True
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    if rows:
+                        execute_values(cur, """
+                            INSERT INTO conversation_states (user_id, state, data, expires_at)
+                            VALUES %s
+                            ON CONFLICT (user_id) DO UPDATE SET
+                                state = EXCLUDED.state,
+                                data = EXCLUDED.data,
+                                expires_at = EXCLUDED.expires_at,
+                                updated_at = NOW()
+                        """, rows, template="(%s, %s, %s::jsonb, to_timestamp(%s))")
+                    if deleted:
+                        cur.execute("DELETE FROM conversation_states WHERE user_id = ANY(%s)",
+                                    (list(deleted),))
+            return True
+        except Exception as e:
+            logger.error(f"שגיאה בשמירת מצבי שיחה: {str(e)}")
+            return False
+
+    async def flush(self) -> None:
+        """
+        כותב למסד את כל השינויים שממתינים
+
+        הרשומות מסוריאלזות ל-JSON על ה-loop (שם ה-handlers משנים אותן במקום),
+        ורק הכתיבה למסד רצה ב-thread pool.
+        """
+        if not self.persistent:
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            deleted, self._deleted = self._deleted, set()
+            evicted, self._evicted = self._evicted, {}
+            entries = dict(evicted)
+            entries.update({uid: self._entries[uid] for uid in dirty if uid in self._entries})
+            rows = [self._serialize(uid, entry) for uid, entry in entries.items()]
+        if not await AsyncHelper.run_sync_in_async(self._flush_ids, rows, deleted):
+            with self._lock:
+                # ננסה שוב בסבב הבא (אלא אם המשתמש כבר נמחק/נקבע מחדש)
+                self._dirty |= {uid for uid in entries if uid in self._entries}
+                for uid, entry in evicted.items():
+                    if uid not in self._entries and uid not in self._deleted:
+                        self._evicted.setdefault(uid, entry)
+                self._deleted |= {uid for uid in deleted if uid not in self._entries}
+
+    @staticmethod
+    def _delete_expired_rows() -> int:
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM conversation_states WHERE expires_at < NOW()")
+                    return cur.rowcount
+        except Exception as e:
+            logger.error(f"שגיאה במחיקת מצבי שיחה שפגו: {str(e)}")
+            return 0
+
+    # -------------------------------------------------------------------------
+    # עבודת רקע
+    # -------------------------------------------------------------------------
+
+    def start(self):
+        """
+        מפעיל את עבודת הרקע (ניקוי רשומות שפגו וכתיבה למסד) על ה-loop הנוכחי
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        עוצר את עבודת הרקע וכותב את השינויים האחרונים
+        """
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self):
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.purge_expired()
+                await self.flush()
+                if self.persistent and time.monotonic() - last_cleanup > self.ttl:
+                    await AsyncHelper.run_sync_in_async(self._delete_expired_rows)
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                logger.error(f"שגיאה בעבודת הרקע של מצבי שיחה: {str(e)}")
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+# CONVERSATION_STATE_BACKEND=postgres - מצבים משותפים בין מופעי הבוט ונשמרים בין הפעלות
+conversation_states = ConversationStateStore(
+    persistent=os.getenv("CONVERSATION_STATE_BACKEND", "memory").lower() == "postgres"
+)
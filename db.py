@@ -3,12 +3,15 @@
 """
 
 import os
+import time
 import logging
 import psycopg2
 from psycopg2.extras import RealDictCursor, RealDictRow
 from contextlib import contextmanager
 from typing import List, Dict, Any, Optional, Tuple, Union, cast
 
+from bot_metrics import bot_metrics, SPAN_DB
+
 logger = logging.getLogger(__name__)
 
 # מחרוזת חיבור למסד נתונים - מה-.env
@@ -27,6 +30,8 @@ def get_connection():
         חיבור למסד הנתונים
     """
     connection = None
+    # הזמן שהחיבור פתוח נרשם כתת-שלב db של ה-handler הפעיל
+    started = time.perf_counter()
     try:
         connection = psycopg2.connect(
             DATABASE_URL, cursor_factory=RealDictCursor
@@ -41,6 +46,7 @@ def get_connection():
         if connection:
             connection.commit()
             connection.close()
+        bot_metrics.record_span(SPAN_DB, time.perf_counter() - started)
 
 
 def execute_query(
@@ -1,19 +1,26 @@
 """
 סקריפט לטעינת סשנים קיימים למסד הנתונים
+
+הייבוא רץ במקביל (מאגר workers מוגבל), נשמר למסד באצוות בטרנזקציה
+אחת לכל אצווה, וממשיך מהנקודה שבה נעצר לפי קובץ התקדמות.
 """
 
 import os
 import json
+import time
 import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
 from telethon.sessions import StringSession
 from telethon import TelegramClient
 import asyncio
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
 
 from db import get_connection
 from constants import Constants
 from proxy_manager import proxy_manager
 from session_classifier import SessionClassifier
+from utils import AsyncHelper
 
 # טעינת משתני סביבה
 load_dotenv()
@@ -25,141 +32,295 @@ logger = logging.getLogger(__name__)
 # תיקיית סשנים
 SESSIONS_DIR = 'session'
 
+# קובץ התקדמות - מזהי סשנים שכבר נשמרו (להמשך אחרי עצירה)
+PROGRESS_FILE = os.path.join(SESSIONS_DIR, '.import_progress.json')
+
+# מספר חיבורי טלגרם מקביליים וגודל אצוות השמירה למסד
+IMPORT_CONCURRENCY = int(os.getenv("SESSION_IMPORT_CONCURRENCY", "20"))
+IMPORT_BATCH_SIZE = int(os.getenv("SESSION_IMPORT_BATCH_SIZE", "100"))
+
 # API Credentials
 API_ID = int(os.getenv("API_ID", "0"))
 API_HASH = os.getenv("API_HASH", "")
 
-async def load_session_to_db(session_path, session_id, metadata):
+
+def load_progress() -> Set[str]:
+    """
+    טוען את מזהי הסשנים שכבר יובאו בהרצות קודמות
+    """
+    try:
+        with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
+            return set(json.load(f).get('done', []))
+    except FileNotFoundError:
+        return set()
+    except Exception as e:
+        logger.warning(f"לא ניתן לקרוא את קובץ ההתקדמות {PROGRESS_FILE}: {str(e)}")
+        return set()
+
+
+def save_progress(done: Set[str]):
+    """
+    שומר את מזהי הסשנים שיובאו (כתיבה אטומית)
+    """
+    tmp_path = f"{PROGRESS_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'done': sorted(done)}, f)
+    os.replace(tmp_path, PROGRESS_FILE)
+
+
+def _proxy_from_metadata(metadata: Dict[str, Any]) -> Optional[Tuple[str, int, Optional[str], Optional[str]]]:
+    """
+    מחלץ פרטי פרוקסי (host, port, username, password) מהמטה-דאטה
+    """
+    proxy_data = metadata.get('proxy')
+    if not proxy_data:
+        return None
+
+    proxy_host = proxy_data[1] if len(proxy_data) > 1 else None
+    proxy_port = proxy_data[2] if len(proxy_data) > 2 else None
+    if not proxy_host or not proxy_port:
+        return None
+
+    proxy_username = proxy_data[4] if len(proxy_data) > 4 else None
+    proxy_password = proxy_data[5] if len(proxy_data) > 5 else None
+    return proxy_host, int(proxy_port), proxy_username, proxy_password
+
+
+async def export_session(session_path, session_id, metadata) -> Dict[str, Any]:
     """
-    טוען סשן למסד הנתונים
+    ממיר קובץ סשן ל-StringSession (חיבור אחד לטלגרם לכל סשן)
     """
+    client = TelegramClient(session_path, API_ID, API_HASH)
+    await client.connect()
     try:
-        # ניסיון להמיר את הסשן לפורמט StringSession
-        client = TelegramClient(session_path, API_ID, API_HASH)
-        await client.connect()
-        
         session_string = StringSession.save(client.session)
+        dc_id = client.session.dc_id
+
+        # סיווג על אותו חיבור; אם נכשל - הסשן יסווג בסיווג המחזורי
+        session_type, evidence = Constants.SESSION_TYPE_CLEAN, None
+        try:
+            session_type, evidence = await SessionClassifier.classify_client(client)
+        except Exception as e:
+            logger.warning(f"לא ניתן לסווג את סשן {session_id}: {str(e)}")
+    finally:
         await client.disconnect()
-        
-        # הכנת פרטי הפרוקסי אם יש
-        proxy_id = None
-        if 'proxy' in metadata and metadata['proxy']:
-            # בדיקה אם הפרוקסי כבר קיים
-            proxy_data = metadata['proxy']
-            proxy_host = proxy_data[1] if len(proxy_data) > 1 else None
-            proxy_port = proxy_data[2] if len(proxy_data) > 2 else None
-            
-            if proxy_host and proxy_port:
-                with get_connection() as conn:
-                    with conn.cursor() as cur:
-                        cur.execute("""
-                            SELECT id FROM proxies 
-                            WHERE address = %s AND port = %s
-                        """, (proxy_host, proxy_port))
-                        proxy_result = cur.fetchone()
-                        
-                        if proxy_result:
-                            proxy_id = proxy_result['id']
-                        else:
-                            # הוסף פרוקסי חדש
-                            proxy_username = proxy_data[4] if len(proxy_data) > 4 else None
-                            proxy_password = proxy_data[5] if len(proxy_data) > 5 else None
-                            
-                            cur.execute("""
-                                INSERT INTO proxies 
-                                (address, port, username, password, protocol, status)
-                                VALUES (%s, %s, %s, %s, 'socks5', 'active')
-                                RETURNING id
-                            """, (proxy_host, proxy_port, proxy_username, proxy_password))
-                            
-                            proxy_id = cur.fetchone()['id']
-        
-        # קביעת סוג הסשן בהתבסס על שם הקובץ או נתונים אחרים
-        # לצורך הדגמה, נקבע את הסוג בהתאם למספר הסשן
-        session_type = Constants.SESSION_TYPE_CLEAN
-        
-        # בדיקה אם הסשן כבר קיים
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id FROM sessions 
-                    WHERE session_id = %s
-                """, (session_id,))
-                
-                if cur.fetchone():
-                    logger.info(f"סשן {session_id} כבר קיים במסד הנתונים")
-                    return
-                
-                # הוסף את הסשן למסד הנתונים
-                cur.execute("""
-                    INSERT INTO sessions 
+
+    return {
+        'session_id': session_id,
+        'session_string': session_string,
+        'dc_id': dc_id,
+        'proxy': _proxy_from_metadata(metadata),
+        'type': session_type,
+        'evidence': evidence,
+    }
+
+
+def save_sessions_batch(records: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """
+    שומר אצוות סשנים למסד בטרנזקציה אחת (פרוקסים, סשנים ו-session_proxy)
+
+    Returns:
+        (מזהי סשנים שנוספו, מזהי סשנים שכבר היו קיימים)
+    """
+    if not records:
+        return [], []
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            # פרוקסים - איתור קיימים והוספת החסרים בשאילתה אחת
+            proxies = {r['proxy'][:2]: r['proxy'] for r in records if r['proxy']}
+            proxy_ids: Dict[Tuple[str, int], int] = {}
+            if proxies:
+                rows = execute_values(cur, """
+                    SELECT p.id, p.address, p.port
+                    FROM proxies p
+                    JOIN (VALUES %s) AS v(address, port)
+                    ON p.address = v.address AND p.port = v.port::integer
+                """, list(proxies), fetch=True)
+                proxy_ids = {(row['address'], row['port']): row['id'] for row in rows}
+
+                missing = [proxy for key, proxy in proxies.items() if key not in proxy_ids]
+                if missing:
+                    rows = execute_values(cur, """
+                        INSERT INTO proxies
+                        (address, port, username, password, protocol, status)
+                        VALUES %s
+                        RETURNING id, address, port
+                    """, missing, template="(%s, %s, %s, %s, 'socks5', 'active')", fetch=True)
+                    proxy_ids.update({(row['address'], row['port']): row['id'] for row in rows})
+
+            # סשנים - דילוג על קיימים והוספת השאר
+            cur.execute("""
+                SELECT session_id FROM sessions
+                WHERE session_id = ANY(%s)
+            """, ([r['session_id'] for r in records],))
+            existing = {row['session_id'] for row in cur.fetchall()}
+
+            new_records = [r for r in records if r['session_id'] not in existing]
+            if new_records:
+                execute_values(cur, """
+                    INSERT INTO sessions
                     (session_id, session_string, type, status, dc_id, proxy_id)
-                    VALUES (%s, %s, %s, 'active', %s, %s)
-                    RETURNING id
-                """, (
-                    session_id, 
-                    session_string,
-                    session_type,
-                    client.session.dc_id,
-                    proxy_id
-                ))
-                
-                db_session_id = cur.fetchone()['id']
-                
-                # אם יש פרוקסי, הוסף לטבלת session_proxy
-                if proxy_id:
-                    cur.execute("""
+                    VALUES %s
+                """, [
+                    (
+                        r['session_id'], r['session_string'], r['type'], 'active', r['dc_id'],
+                        proxy_ids.get(r['proxy'][:2]) if r['proxy'] else None,
+                    )
+                    for r in new_records
+                ], template="(%s, %s, %s, %s, %s, %s)")
+
+                links = [
+                    (r['session_id'], proxy_ids[r['proxy'][:2]])
+                    for r in new_records if r['proxy'] and r['proxy'][:2] in proxy_ids
+                ]
+                if links:
+                    execute_values(cur, """
                         INSERT INTO session_proxy
                         (session_id, proxy_id)
-                        VALUES (%s, %s)
-                    """, (session_id, proxy_id))
-                
-                logger.info(f"סשן {session_id} נוסף למסד הנתונים בהצלחה עם מזהה {db_session_id}")
-                return db_session_id
-    
-    except Exception as e:
-        logger.error(f"שגיאה בהוספת סשן {session_id}: {str(e)}")
-        return None
+                        VALUES %s
+                    """, links)
 
-async def main():
+                SessionClassifier.upsert_classifications(cur, [
+                    (r['session_id'], r['type'], r['evidence'])
+                    for r in new_records if r['evidence'] is not None
+                ])
+
+    return [r['session_id'] for r in new_records], sorted(existing)
+
+
+def scan_session_files() -> List[Tuple[str, str, Dict[str, Any]]]:
     """
-    פונקציה ראשית
+    סורק את ספריית הסשנים ומחזיר (נתיב, מזהה, מטה-דאטה) לכל סשן עם קובץ json
     """
-    # ודא שמסד הנתונים מוכן
-    try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1")
-    except Exception as e:
-        logger.error(f"שגיאה בחיבור למסד הנתונים: {str(e)}")
-        return
-    
-    # סרוק את ספריית הסשנים
     session_files = []
-    
+
     for filename in os.listdir(SESSIONS_DIR):
         if filename.endswith('.session'):
             session_id = filename[:-8]  # הסר את הסיומת .session
             json_path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
             session_path = os.path.join(SESSIONS_DIR, filename)
-            
+
             if os.path.exists(json_path):
                 try:
                     with open(json_path, 'r', encoding='utf-8') as f:
                         metadata = json.load(f)
-                    
+
                     session_files.append((session_path, session_id, metadata))
                 except Exception as e:
                     logger.error(f"שגיאה בקריאת קובץ מטה-דאטה {json_path}: {str(e)}")
-    
-    # הוסף את הסשנים למסד הנתונים
-    count = 0
-    for session_path, session_id, metadata in session_files:
-        session_db_id = await load_session_to_db(session_path, session_id, metadata)
-        if session_db_id:
-            count += 1
-    
-    logger.info(f"נוספו {count} סשנים למסד הנתונים מתוך {len(session_files)}")
+
+    return session_files
+
+
+async def import_sessions(session_files, concurrency: int = IMPORT_CONCURRENCY,
+                          batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    מייבא סשנים במקביל ושומר אותם באצוות
+
+    Returns:
+        דוח סיכום (found, skipped, imported, existing, failed, errors, duration)
+    """
+    started = time.monotonic()
+    done = load_progress()
+    pending = [item for item in session_files if item[1] not in done]
+
+    report: Dict[str, Any] = {
+        'found': len(session_files),
+        'skipped': len(session_files) - len(pending),
+        'imported': 0,
+        'existing': 0,
+        'failed': 0,
+        'errors': {},
+    }
+
+    semaphore = asyncio.Semaphore(concurrency)
+    batch: List[Dict[str, Any]] = []
+
+    async def flush():
+        # השמירה למסד וכתיבת קובץ ההתקדמות רצות ב-thread pool - בלי לעצור
+        # את ייצוא הסשנים שרץ במקביל על אותו loop
+        if not batch:
+            return
+        records = list(batch)
+        batch.clear()
+        try:
+            added, existing = await AsyncHelper.run_sync_in_async(save_sessions_batch, records)
+        except Exception as e:
+            logger.error(f"שגיאה בשמירת אצוות של {len(records)} סשנים: {str(e)}")
+            report['failed'] += len(records)
+            for record in records:
+                report['errors'][record['session_id']] = f"DB: {str(e)}"
+        else:
+            report['imported'] += len(added)
+            report['existing'] += len(existing)
+            done.update(added)
+            done.update(existing)
+            await AsyncHelper.run_in_pool("file", save_progress, set(done))
+            logger.info(
+                f"אצווה נשמרה: {len(added)} נוספו, {len(existing)} קיימים "
+                f"({len(done)}/{len(session_files)})"
+            )
+
+    async def worker(session_path, session_id, metadata):
+        async with semaphore:
+            try:
+                return session_id, await export_session(session_path, session_id, metadata), None
+            except Exception as e:
+                return session_id, None, e
+
+    tasks = [worker(*item) for item in pending]
+    for future in asyncio.as_completed(tasks):
+        session_id, record, error = await future
+        if error:
+            report['failed'] += 1
+            report['errors'][session_id] = str(error)
+            logger.error(f"שגיאה בהמרת סשן {session_id}: {str(error)}")
+            continue
+
+        batch.append(record)
+        if len(batch) >= batch_size:
+            await flush()
+
+    await flush()
+    report['duration'] = round(time.monotonic() - started, 1)
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    """
+    מדפיס דוח סיכום של הייבוא
+    """
+    logger.info(
+        "סיכום ייבוא סשנים: "
+        f"נמצאו {report['found']}, "
+        f"דולגו (יובאו בעבר) {report['skipped']}, "
+        f"נוספו {report['imported']}, "
+        f"כבר קיימים {report['existing']}, "
+        f"נכשלו {report['failed']}, "
+        f"משך {report['duration']} שניות"
+    )
+    for session_id, error in sorted(report['errors'].items()):
+        logger.info(f"  {session_id}: {error}")
+
+
+async def main():
+    """
+    פונקציה ראשית
+    """
+    # ודא שמסד הנתונים מוכן
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+    except Exception as e:
+        logger.error(f"שגיאה בחיבור למסד הנתונים: {str(e)}")
+        return
+
+    # סרוק את ספריית הסשנים והוסף אותם למסד הנתונים
+    session_files = scan_session_files()
+    report = await import_sessions(session_files)
+    print_report(report)
 
 if __name__ == "__main__":
     asyncio.run(main())
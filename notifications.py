@@ -1,39 +1,335 @@
 # -*- coding: utf-8 -*-
-"""Simple notification management placeholder."""
+"""Notification outbox and delivery worker.
 
+Notifications are written to the ``notification_outbox`` table and delivered
+by an async worker in batches, under global and per-chat rate limits, with
+retry and backoff. Pending alerts of the same type for the same rental are
+coalesced into a single row.
+"""
+
+import asyncio
+import html
 import logging
-from datetime import datetime
-from typing import Any, Dict, List
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from psycopg2.extras import execute_values
+
+from constants import Constants
+from db import get_connection
+from utils import AsyncHelper
 
 logger = logging.getLogger(__name__)
 
-_notifications: List[Dict[str, Any]] = []
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+# longest title kept when a single notification has to be truncated
+MAX_TITLE_LENGTH = 256
+
+
+def _escape_truncated(text: str, limit: int) -> str:
+    """HTML-escape ``text``, cutting it (without splitting an entity) to ``limit`` characters."""
+    escaped = html.escape(text)
+    if len(escaped) <= limit:
+        return escaped
+    parts: List[str] = []
+    length = 0
+    for char in text:
+        part = html.escape(char)
+        if length + len(part) > limit - 1:
+            break
+        parts.append(part)
+        length += len(part)
+    return "".join(parts) + "…"
+
+
+def _dedupe_key(notification_type: str, rental_id: Optional[int]) -> Optional[str]:
+    """Key used to coalesce pending alerts of one type per rental."""
+    return f"{notification_type}:{rental_id}" if rental_id is not None else None
+
+
+def add_notification(user_id: int, notification_type: str, title: str, message: str,
+                     rental_id: Optional[int] = None) -> Optional[int]:
+    """Queue a notification for a user.
+
+    A pending notification with the same type and rental is updated in place
+    instead of queueing another message.
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO notification_outbox
+                    (user_id, rental_id, type, title, message, dedupe_key)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (dedupe_key) WHERE status = 'pending'
+                    DO UPDATE SET title = EXCLUDED.title,
+                                  message = EXCLUDED.message,
+                                  coalesced = notification_outbox.coalesced + 1
+                    RETURNING id
+                """, (user_id, rental_id, notification_type, title, message,
+                      _dedupe_key(notification_type, rental_id)))
+                return cur.fetchone()["id"]
+    except Exception as e:
+        logger.error(f"Failed to queue notification for user {user_id}: {e}")
+        return None
+
+
+def get_user_notifications(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+    """Return the most recent notifications for the specified user."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, rental_id, type, title, message, status, is_read, created_at, sent_at
+                    FROM notification_outbox
+                    WHERE user_id = %s
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                """, (user_id, limit))
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"Failed to load notifications for user {user_id}: {e}")
+        return []
+
+
+def mark_notifications_read(user_id: int) -> int:
+    """Mark all notifications of a user as read."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE notification_outbox
+                    SET is_read = TRUE
+                    WHERE user_id = %s AND is_read = FALSE
+                """, (user_id,))
+                return cur.rowcount
+    except Exception as e:
+        logger.error(f"Failed to mark notifications read for user {user_id}: {e}")
+        return 0
+
+
+class TokenBucket:
+    """Async token bucket limiting a rate of events per second."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and consume it."""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
 
+def _claim_batch(limit: int) -> List[Dict[str, Any]]:
+    """Claim due pending notifications for delivery."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE notification_outbox o
+                SET status = 'sending', attempts = o.attempts + 1
+                WHERE o.id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING o.*
+            """, (limit,))
+            return [dict(row) for row in cur.fetchall()]
 
-def add_notification(user_id: int, notification_type: str, title: str, message: str) -> None:
-    """Store a notification for a user."""
-    _notifications.append({
-        "user_id": user_id,
-        "type": notification_type,
-        "title": title,
-        "message": message,
-        "is_read": False,
-        "created_at": datetime.now(),
-    })
 
+def _record_results(sent_ids: List[int], retries: List[tuple], failed: List[tuple]) -> None:
+    """Persist delivery outcomes in one transaction."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if sent_ids:
+                cur.execute("""
+                    UPDATE notification_outbox
+                    SET status = 'sent', sent_at = NOW(), last_error = NULL
+                    WHERE id = ANY(%s)
+                """, (sent_ids,))
+            if retries:
+                execute_values(cur, """
+                    UPDATE notification_outbox o
+                    SET status = 'pending',
+                        next_attempt_at = NOW() + v.delay * INTERVAL '1 second',
+                        last_error = v.error
+                    FROM (VALUES %s) AS v(id, delay, error)
+                    WHERE o.id = v.id
+                """, retries)
+            if failed:
+                execute_values(cur, """
+                    UPDATE notification_outbox o
+                    SET status = 'failed', last_error = v.error
+                    FROM (VALUES %s) AS v(id, error)
+                    WHERE o.id = v.id
+                """, failed)
 
-def get_user_notifications(user_id: int) -> List[Dict[str, Any]]:
-    """Return notifications for the specified user."""
-    return [n for n in _notifications if n.get("user_id") == user_id]
+
+def _release_stuck() -> int:
+    """Return rows left in 'sending' by a crashed worker to the queue."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE notification_outbox
+                SET status = 'pending'
+                WHERE status = 'sending'
+            """)
+            return cur.rowcount
+
+
+class NotificationDispatcher:
+    """Async worker that delivers the outbox to Telegram."""
+
+    def __init__(self,
+                 batch_size: int = Constants.NOTIFICATION_BATCH_SIZE,
+                 global_rate: float = Constants.NOTIFICATION_GLOBAL_RATE,
+                 per_chat_rate: float = Constants.NOTIFICATION_PER_CHAT_RATE,
+                 max_attempts: int = Constants.NOTIFICATION_MAX_ATTEMPTS,
+                 poll_interval: float = Constants.NOTIFICATION_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._send: Optional[Callable[[int, str], Awaitable[Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, send: Callable[[int, str], Awaitable[Any]]) -> None:
+        """Start the worker on the running loop with the given send coroutine."""
+        self._send = send
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stop the worker."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        released = await AsyncHelper.run_sync_in_async(_release_stuck)
+        if released:
+            logger.info(f"Re-queued {released} notifications left in 'sending'")
+
+        while True:
+            try:
+                delivered = await self.deliver_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification delivery loop error: {e}")
+                delivered = 0
+            if not delivered:
+                await asyncio.sleep(self.poll_interval)
+
+    async def deliver_batch(self) -> int:
+        """Claim and deliver one batch; returns the number of claimed rows."""
+        batch = await AsyncHelper.run_sync_in_async(_claim_batch, self.batch_size)
+        if not batch:
+            return 0
+
+        # one combined message per user per batch
+        by_user: Dict[int, List[Dict[str, Any]]] = {}
+        for notification in batch:
+            by_user.setdefault(notification["user_id"], []).append(notification)
+
+        sent_ids: List[int] = []
+        retries: List[tuple] = []
+        failed: List[tuple] = []
+
+        async def deliver(user_id: int, notifications: List[Dict[str, Any]]):
+            for chunk in self._chunks(notifications):
+                ids = [n["id"] for n in chunk]
+                try:
+                    await self._chat_bucket(user_id).acquire()
+                    await self._global_bucket.acquire()
+                    await self._send(user_id, self._render(chunk))
+                    sent_ids.extend(ids)
+                except Exception as e:
+                    # FloodWaitError and similar expose the required wait in seconds
+                    flood_wait = getattr(e, "seconds", None)
+                    for n in chunk:
+                        if n["attempts"] >= self.max_attempts:
+                            failed.append((n["id"], str(e)))
+                        else:
+                            delay = flood_wait or min(
+                                Constants.NOTIFICATION_RETRY_BASE * 2 ** (n["attempts"] - 1),
+                                Constants.NOTIFICATION_RETRY_MAX,
+                            )
+                            retries.append((n["id"], delay, str(e)))
+                    logger.warning(f"Notification delivery to {user_id} failed: {e}")
+
+        await asyncio.gather(*(deliver(uid, items) for uid, items in by_user.items()))
+        await AsyncHelper.run_sync_in_async(_record_results, sent_ids, retries, failed)
+        return len(batch)
+
+    def _chat_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(user_id)
+        if bucket is None:
+            bucket = self._chat_buckets[user_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+
+    @staticmethod
+    def _render_one(notification: Dict[str, Any]) -> str:
+        # titles and messages may embed user input (e.g. keywords) - sent as HTML
+        title = _escape_truncated(str(notification['title']), MAX_TITLE_LENGTH)
+        # a notification longer than one message is truncated, not retried until it fails
+        budget = MAX_MESSAGE_LENGTH - len(title) - len("<b></b>\n")
+        message = _escape_truncated(str(notification['message']), budget)
+        return f"<b>{title}</b>\n{message}"
+
+    @classmethod
+    def _render(cls, notifications: List[Dict[str, Any]]) -> str:
+        return "\n\n".join(cls._render_one(n) for n in notifications)
+
+    @classmethod
+    def _chunks(cls, notifications: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split a user's notifications into messages under the length limit."""
+        chunks: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        length = 0
+        for n in notifications:
+            size = len(cls._render_one(n)) + 2
+            if current and length + size > MAX_MESSAGE_LENGTH:
+                chunks.append(current)
+                current, length = [], 0
+            current.append(n)
+            length += size
+        if current:
+            chunks.append(current)
+        return chunks
 
 
 class NotificationManager:
-    def add_notification(self, user_id: int, notification_type: str, title: str, message: str) -> None:
-        add_notification(user_id, notification_type, title, message)
+    def add_notification(self, user_id: int, notification_type: str, title: str, message: str,
+                         rental_id: Optional[int] = None) -> Optional[int]:
+        return add_notification(user_id, notification_type, title, message, rental_id)
 
-    def get_user_notifications(self, user_id: int) -> List[Dict[str, Any]]:
-        return get_user_notifications(user_id)
+    def get_user_notifications(self, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        return get_user_notifications(user_id, limit)
 
+    def mark_notifications_read(self, user_id: int) -> int:
+        return mark_notifications_read(user_id)
 
-notification_manager = NotificationManager()
 
+notification_manager = NotificationManager()
+notification_dispatcher = NotificationDispatcher()
@@ -7,6 +7,10 @@ from db import get_connection
 from constants import Constants
 from session_manager import session_manager
 from proxy_manager import proxy_manager
+from assets_manager import assets_manager
+from asset_catalog import asset_catalog
+from rename_journal import rename_journal
+from bot_client_cache import bot_client_cache
 
 from telethon import TelegramClient
 from telethon.sessions import StringSession
@@ -22,13 +26,6 @@ class ProfileEditor:
     עורך פרופילים - שינוי שמות נכסים (בוטים, קבוצות, ערוצים)
     """
     
-    def __init__(self):
-        """
-        יוצר עורך פרופילים חדש
-        """
-        # שמירת שמות מקוריים לזיכרון
-        self.original_names = {}  # {asset_id: original_name}
-    
     async def change_asset_name(self, asset_id: int, new_name: str) -> Tuple[bool, str]:
         """
         משנה את שם הנכס
@@ -41,20 +38,22 @@ class ProfileEditor:
             האם הפעולה הצליחה ותיאור השגיאה אם הייתה
         """
         try:
-            # קבל את פרטי הנכס
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT * FROM assets WHERE id = %s
-                    """, (asset_id,))
-                    asset = cur.fetchone()
+            # קבל את פרטי הנכס (מקטלוג הנכסים - בלי שאילתה כשהנכס במטמון)
+            asset = asset_catalog.get(asset_id)
                     
             if not asset:
                 return False, f"לא נמצא נכס עם מזהה {asset_id}"
             
-            # שמור את השם המקורי אם עוד לא נשמר
-            if asset_id not in self.original_names:
-                self.original_names[asset_id] = asset['name']
+            # שם זמני נרשם ביומן לפני השינוי בטלגרם, כדי שישוחזר גם אחרי קריסה
+            if Constants.SPECIAL_SUFFIX in new_name:
+                original_name = (rename_journal.get_original_name(asset_id)
+                                 or asset.get('original_name') or asset['name'])
+                if not rename_journal.record(asset_id, original_name, new_name):
+                    return False, f"לא ניתן לרשום שם זמני ביומן לנכס {asset_id}"
+            
+            # השם כבר מוגדר - אין צורך בעריכה בטלגרם
+            if asset['name'] == new_name:
+                return True, f"השם כבר מעודכן: {new_name}"
             
             # לפי סוג הנכס, בצע שינוי שם מתאים
             if asset['type'] == Constants.ASSET_TYPE_BOT:
@@ -80,29 +79,57 @@ class ProfileEditor:
         Returns:
             האם הפעולה הצליחה ותיאור השגיאה אם הייתה
         """
-        # בדוק אם יש שם מקורי שמור
-        if asset_id in self.original_names:
-            original_name = self.original_names[asset_id]
-            return await self.change_asset_name(asset_id, original_name)
-        
-        # אם לא, נסה לקבל מהמסד
         try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT original_name FROM assets WHERE id = %s
-                    """, (asset_id,))
-                    result = cur.fetchone()
-                    
-                    if result and result['original_name']:
-                        return await self.change_asset_name(asset_id, result['original_name'])
-                    else:
-                        return False, f"לא נמצא שם מקורי לנכס {asset_id}"
+            # השם מהיומן קודם - השם המקורי שנרשם לפני השינוי הזמני
+            original_name = rename_journal.get_original_name(asset_id)
+            if not original_name:
+                asset = asset_catalog.get(asset_id)
+                original_name = asset.get('original_name') if asset else None
+            
+            if not original_name:
+                return False, f"לא נמצא שם מקורי לנכס {asset_id}"
+            
+            success, message = await self.change_asset_name(asset_id, original_name)
+            if success:
+                rename_journal.clear([asset_id])
+            return success, message
                         
         except Exception as e:
             logger.error(f"שגיאה בשחזור שם נכס {asset_id}: {str(e)}")
             return False, f"שגיאה בשחזור שם: {str(e)}"
     
+    async def recover_stale_renames(self, concurrency: int = 5) -> int:
+        """
+        משחזר נכסים שנשארו בשם זמני (בדיקה שקרסה או נתקעה) לפי יומן השמות
+        
+        Args:
+            concurrency: מספר שחזורים מקבילים מקסימלי מול טלגרם
+            
+        Returns:
+            מספר הנכסים ששוחזרו
+        """
+        stale = rename_journal.get_stale()
+        if not stale:
+            return 0
+        
+        logger.warning(f"נמצאו {len(stale)} נכסים בשם זמני - משחזר")
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def restore(entry: Dict[str, Any]) -> Optional[int]:
+            async with semaphore:
+                success, message = await self.change_asset_name(entry['asset_id'], entry['original_name'])
+                if not success:
+                    logger.error(f"שחזור שם נכס {entry['asset_id']} נכשל: {message}")
+                    return None
+                return entry['asset_id']
+        
+        results = await asyncio.gather(*(restore(entry) for entry in stale))
+        restored = [asset_id for asset_id in results if asset_id is not None]
+        rename_journal.clear(restored)
+        
+        logger.info(f"שוחזרו {len(restored)} מתוך {len(stale)} שמות זמניים")
+        return len(restored)
+    
     async def _change_bot_name(self, asset: Dict[str, Any], new_name: str) -> Tuple[bool, str]:
         """
         משנה שם של בוט
@@ -120,10 +147,8 @@ class ProfileEditor:
             return False, "אין טוקן שמור לבוט זה - לא ניתן לשנות את השם"
             
         try:
-            # התחבר כבוט עם הטוקן שלו
-            from telethon import TelegramClient
-            client = TelegramClient(StringSession(), 6, "eb06d4abfb49dc3eeb1aeb98ae0f581e")
-            await client.start(bot_token=bot_token)
+            # קליינט מזוהה מהמטמון (הזדהות מלאה רק בפעם הראשונה לכל טוקן)
+            client = await bot_client_cache.get(bot_token)
             
             try:
                 # עדכן את פרופיל הבוט
@@ -131,20 +156,25 @@ class ProfileEditor:
                     first_name=new_name
                 ))
                 
-                # עדכן את מסד הנתונים
+                # עדכן את מסד הנתונים (המטמון מתעדכן רק אחרי ה-commit)
+                since = asset_catalog.sequence()
                 with get_connection() as conn:
                     with conn.cursor() as cur:
                         cur.execute("""
                             UPDATE assets
                             SET name = %s, updated_at = NOW()
                             WHERE id = %s
+                            RETURNING *
                         """, (new_name, asset['id']))
+                        updated = cur.fetchone()
+                asset_catalog.put(updated, since)
                 
                 return True, f"שם הבוט עודכן ל: {new_name}"
                 
-            finally:
-                # וודא ניתוק הclint
-                await client.disconnect()
+            except Exception:
+                # הקליינט עלול להיות פגום - הבא ייווצר מחדש מהסשן השמור
+                bot_client_cache.discard(bot_token)
+                raise
                 
         except Exception as e:
             logger.error(f"שגיאה בשינוי שם בוט {asset['id']}: {str(e)}")
@@ -187,14 +217,18 @@ class ProfileEditor:
                     title=new_name
                 ))
                 
-                # עדכן את מסד הנתונים
+                # עדכן את מסד הנתונים (המטמון מתעדכן רק אחרי ה-commit)
+                since = asset_catalog.sequence()
                 with get_connection() as conn:
                     with conn.cursor() as cur:
                         cur.execute("""
                             UPDATE assets
                             SET name = %s, updated_at = NOW()
                             WHERE id = %s
+                            RETURNING *
                         """, (new_name, asset['id']))
+                        updated = cur.fetchone()
+                asset_catalog.put(updated, since)
                 
                 # שחרר את הסשן
                 session_manager.release_session(session['id'])
@@ -231,28 +265,20 @@ class ProfileEditor:
             name_part: חלק מהשם לחיפוש
             
         Returns:
-            רשימת נכסים שנמצאו
+            רשימת נכסים שנמצאו, מהתואם ביותר
         """
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT * FROM assets
-                        WHERE name ILIKE %s OR username ILIKE %s
-                        ORDER BY name
-                    """, (f"%{name_part}%", f"%{name_part}%"))
-                    
-                    assets = cur.fetchall()
-                    result = []
-                    
-                    for asset in assets:
-                        result.append(dict(asset))
-                    
-                    return result
-                    
-        except Exception as e:
-            logger.error(f"שגיאה בחיפוש נכסים לפי שם '{name_part}': {str(e)}")
-            return []
+        # החיפוש עצמו משתמש באינדקסי הטריגרמות של assets_manager;
+        # מדפדפים בעמודים (keyset) כדי להחזיר את כל ההתאמות ולא רק את העמוד הראשון
+        page_size = 200
+        results: List[Dict[str, Any]] = []
+        after = None
+        while True:
+            page = assets_manager.search_assets(name_part, limit=page_size, after=after)
+            results.extend(page)
+            if len(page) < page_size:
+                return results
+            last = page[-1]
+            after = (last['score'], last['id'])
 
 
 # יצירת אינסטנס לשימוש מחוץ למודול
@@ -22,6 +22,17 @@ def load_proxies():
         return []
 
 
+def load_proxy_records():
+    """Raw proxy entries including optional fields such as speed (ms) and dc_id."""
+    ensure_proxy_file()
+    try:
+        with open(PROXY_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[!] Failed to load proxies: {e}")
+        return []
+
+
 def add_proxy(ip, port, user=None, password=None):
     ensure_proxy_file()
     proxy_entry = {"ip": ip, "port": port}
@@ -16,25 +16,27 @@ def load_alerts():
         return json.load(f)
 
 
+def action_for_alert(alert):
+    rank = alert["new_rank"]
+    if rank <= 3:
+        action = ActionType.NOTIFY
+    elif 4 <= rank <= 7:
+        action = ActionType.SUGGEST_REPLACEMENT
+    else:
+        action = ActionType.REFUND_PARTIAL
+
+    return {
+        "asset_name": alert["asset_name"],
+        "target_id": alert.get("target_id"),
+        "keyword": alert["keyword"],
+        "rank": rank,
+        "action": action,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 def generate_actions(alerts):
-    actions = []
-    for alert in alerts:
-        rank = alert["new_rank"]
-        if rank <= 3:
-            action = ActionType.NOTIFY
-        elif 4 <= rank <= 7:
-            action = ActionType.SUGGEST_REPLACEMENT
-        else:
-            action = ActionType.REFUND_PARTIAL
-
-        actions.append({
-            "asset_name": alert["asset_name"],
-            "keyword": alert["keyword"],
-            "rank": rank,
-            "action": action,
-            "timestamp": datetime.now().isoformat()
-        })
-    return actions
+    return [action_for_alert(alert) for alert in alerts]
 
 
 def save_actions(actions):
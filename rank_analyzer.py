@@ -22,34 +22,41 @@ def save_json(path: str, data: Dict):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def analyze_asset(asset: Dict, cache: Dict, now: str) -> List[Dict]:
+    alerts = []
+    asset_name = asset["asset_name"]
+    target_id = asset["target_id"]
+    keywords = asset["keywords"]
+
+    for keyword in keywords:
+        key = f"{asset_name}:{keyword}"
+        new_rank = asset.get("rank", {}).get(keyword, -1)
+        prev_rank = cache.get(key, -1)
+
+        if new_rank == -1:
+            continue
+
+        cache[key] = new_rank
+
+        if new_rank > MAX_ACCEPTED_RANK:
+            alerts.append({
+                "asset_name": asset_name,
+                "keyword": keyword,
+                "prev_rank": prev_rank,
+                "new_rank": new_rank,
+                "target_id": target_id,
+                "timestamp": now
+            })
+
+    return alerts
+
+
 def analyze_rank_changes(schedule: List[Dict], cache: Dict) -> List[Dict]:
     alerts = []
     now = datetime.now().isoformat()
 
     for asset in schedule:
-        asset_name = asset["asset_name"]
-        target_id = asset["target_id"]
-        keywords = asset["keywords"]
-
-        for keyword in keywords:
-            key = f"{asset_name}:{keyword}"
-            new_rank = asset.get("rank", {}).get(keyword, -1)
-            prev_rank = cache.get(key, -1)
-
-            if new_rank == -1:
-                continue
-
-            cache[key] = new_rank
-
-            if new_rank > MAX_ACCEPTED_RANK:
-                alerts.append({
-                    "asset_name": asset_name,
-                    "keyword": keyword,
-                    "prev_rank": prev_rank,
-                    "new_rank": new_rank,
-                    "target_id": target_id,
-                    "timestamp": now
-                })
+        alerts.extend(analyze_asset(asset, cache, now))
 
     return alerts
 
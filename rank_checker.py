@@ -2,12 +2,14 @@ import logging
 import time
 import json
 import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 from db import get_connection
 from constants import Constants
 from session_manager import session_manager
 from proxy_manager import proxy_manager
+from asset_candidate_index import candidate_index
+from asset_catalog import asset_catalog
 
 from telethon import TelegramClient
 from telethon.sessions import StringSession
@@ -50,29 +52,27 @@ class RankChecker:
         
         return None, None, None
     
-    async def check_asset_rank(self, asset_id: int, keyword: str) -> Tuple[int, str, Optional[str]]:
+    async def check_asset_rank(self, asset_id: Union[int, Dict[str, Any]], keyword: str) -> Tuple[int, str, Optional[str]]:
         """
         בודק את הדירוג של נכס עבור מילת מפתח
         
         Args:
-            asset_id: מזהה הנכס
+            asset_id: מזהה הנכס (או מילון נכס עם 'id')
             keyword: מילת המפתח
             
         Returns:
             שלשה של (דירוג, tier, שגיאה אם יש)
         """
+        if isinstance(asset_id, dict):
+            asset_id = asset_id['id']
+        
         # בדוק קודם במטמון
         cached_rank, cached_tier, _ = self.get_cached_rank(asset_id, keyword)
         if cached_rank is not None and cached_tier is not None:
             return cached_rank, cached_tier, None
         
-        # קבל את פרטי הנכס
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT * FROM assets WHERE id = %s
-                """, (asset_id,))
-                asset = cur.fetchone()
+        # קבל את פרטי הנכס (מקטלוג הנכסים)
+        asset = asset_catalog.get(asset_id)
                 
         if not asset:
             return -1, Constants.TIER_UNAVAILABLE, f"לא נמצא נכס עם מזהה {asset_id}"
@@ -214,6 +214,8 @@ class RankChecker:
             rank: הדירוג
             tier: הדירוג המדורג (tier)
         """
+        candidate_index.on_rank_recorded(asset_id, keyword, rank)
+        
         try:
             with get_connection() as conn:
                 with conn.cursor() as cur:
@@ -4,20 +4,30 @@
 
 import logging
 import json
+import os
 import time
 import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Awaitable, Callable, Dict, List, Tuple, Optional, Any
 
 from constants import Constants
 from db import get_connection
+from bot_metrics import bot_metrics, SPAN_RANK
 from rank_checker import rank_checker
 from assets_manager import assets_manager
-from profile_editor import profile_editor
-from session_manager import session_manager
+from asset_candidate_index import candidate_index
+from rename_planner import rename_planner
+from rental_store import LIVE_STATUSES
+from session_manager import LANE_WATCHDOG, session_lane, session_manager
+from utils import AsyncHelper
 
 logger = logging.getLogger(__name__)
 
+# קובץ נקודת ביקורת של מחזור הדירוג - מאפשר המשך אחרי קריסה
+CYCLE_CHECKPOINT_FILE = os.path.join(Constants.DATA_DIR, "rank_cycle.checkpoint.json")
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
 class RankEngine:
     """
     מנוע דירוג - בודק את דירוגי הנכסים בחיפוש טלגרם
@@ -31,6 +41,10 @@ class RankEngine:
         self.rank_cache = {}
         # זמן מטמון (בשעות)
         self.cache_hours = Constants.RANK_CACHE_TTL // 3600  # Convert seconds to hours
+        # מחזור דירוג פעיל (אחד לכל היותר) והתקדמותו
+        self._cycle_task: Optional[asyncio.Task] = None
+        self._cycle_progress: Optional[Dict[str, Any]] = None
+        self._cycle_callbacks: List[ProgressCallback] = []
         # טוען מטמון קיים
         self._load_cache()
     
@@ -75,6 +89,7 @@ class RankEngine:
             'tier': tier,
             'created_at': datetime.now()
         }
+        candidate_index.on_rank_recorded(asset_id, keyword, rank)
         
         try:
             with get_connection() as conn:
@@ -138,35 +153,49 @@ class RankEngine:
         Returns:
             (דירוג, tier, האם ממטמון)
         """
+        rank, tier, from_cache, _ = await self._check_rank(asset_id, keyword, force_fresh)
+        return rank, tier, from_cache
+    
+    async def _check_rank(self, asset_id: int, keyword: str,
+                          force_fresh: bool = False) -> Tuple[int, str, bool, Optional[str]]:
+        """
+        בודק את דירוג הנכס לפי מילת מפתח ומחזיר גם את השגיאה (אם הייתה)
+        
+        Returns:
+            (דירוג, tier, האם ממטמון, שגיאה או None)
+        """
         # נסה לקבל ממטמון אם לא מאולץ
         if not force_fresh:
             cached_result = self._get_from_cache(asset_id, keyword)
             if cached_result:
                 logger.info(f"דירוג נמצא במטמון: נכס {asset_id}, מילה '{keyword}', דירוג {cached_result['rank']}")
-                return cached_result['rank'], cached_result['tier'], True
+                return cached_result['rank'], cached_result['tier'], True, None
         
         # קבל פרטי נכס
         asset = assets_manager.get_asset(asset_id)
         if not asset:
             logger.error(f"נכס לא נמצא: {asset_id}")
-            return -1, Constants.TIER_UNAVAILABLE, False
+            return -1, Constants.TIER_UNAVAILABLE, False, f"נכס לא נמצא: {asset_id}"
         
         # שנה שם זמני עם מילת המפתח + סיומת מיוחדת
         temp_name = f"{keyword}{Constants.SPECIAL_SUFFIX}"
-        success, msg = await profile_editor.change_asset_name(asset_id, temp_name)
-        
-        if not success:
-            logger.error(f"שגיאה בשינוי שם נכס: {msg}")
-            return -1, Constants.TIER_UNAVAILABLE, False
+        # המתכנן נועל את הנכס, מדלג על שינוי אם השם כבר מוגדר ומבטל שחזור נדחה
+        success, msg, renamed = await rename_planner.acquire(asset_id, temp_name)
         
         try:
-            # המתן 30 שניות לאינדקס
-            logger.info(f"ממתין לאינדקס של נכס {asset_id} עם השם '{temp_name}'")
-            await asyncio.sleep(30)
+            if not success:
+                logger.error(f"שגיאה בשינוי שם נכס: {msg}")
+                return -1, Constants.TIER_UNAVAILABLE, False, msg
+            
+            # המתן 30 שניות לאינדקס (רק אם השם באמת השתנה)
+            if renamed:
+                logger.info(f"ממתין לאינדקס של נכס {asset_id} עם השם '{temp_name}'")
+                await asyncio.sleep(30)
             
             # בדוק דירוג
-            rank_result = await rank_checker.check_asset_rank(asset, keyword)
-            rank = rank_result[0]
+            rank, _, error = await rank_checker.check_asset_rank(asset, keyword)
+            if error:
+                return -1, Constants.TIER_UNAVAILABLE, False, error
             
             # קבע tier לפי דירוג
             tier = Constants.get_tier_for_rank(rank)
@@ -176,44 +205,47 @@ class RankEngine:
             
             logger.info(f"דירוג נבדק: נכס {asset_id}, מילה '{keyword}', דירוג {rank}, tier {tier}")
             
-            return rank, tier, False
+            return rank, tier, False, None
             
         except Exception as e:
             logger.error(f"שגיאה בבדיקת דירוג: {str(e)}")
-            return -1, Constants.TIER_UNAVAILABLE, False
+            return -1, Constants.TIER_UNAVAILABLE, False, str(e)
             
         finally:
-            # החזר שם מקורי
-            original_name = assets_manager.get_asset_original_name(asset_id)
-            if original_name:
-                await profile_editor.change_asset_name(asset_id, original_name)
+            # שחזור השם המקורי נדחה - בדיקה נוספת על הנכס תעבור ישירות לשם הזמני הבא
+            # (אם השחזור לא מתבצע - הרשומה נשארת ביומן השמות לשחזור מאוחר)
+            rename_planner.release(asset_id)
     
-    async def find_best_assets_for_keyword(self, keyword: str, limit: int = 5) -> List[Dict[str, Any]]:
+    async def find_best_assets_for_keyword(self, keyword: str, limit: int = 5,
+                                           on_result: Optional[ProgressCallback] = None) -> List[Dict[str, Any]]:
         """
         מחפש את הנכסים הטובים ביותר למילת מפתח
         
         Args:
             keyword: מילת מפתח
             limit: מקסימום נכסים להחזיר
+            on_result: פונקציה אסינכרונית שנקראת אחרי בדיקת כל מועמד (done, total, result)
             
         Returns:
             רשימת נכסים ממויינת לפי דירוג (הטובים ביותר קודם)
         """
-        # קבל נכסים זמינים
-        available_assets = assets_manager.get_available_assets()
+        # קבל רק את הנכסים המבטיחים ביותר מאינדקס המועמדים
+        candidates = candidate_index.candidates(keyword)
         
-        if not available_assets:
+        if not candidates:
             logger.warning(f"אין נכסים זמינים לבדיקה עבור המילה '{keyword}'")
             return []
         
         results = []
         
-        # בדוק דירוג לכל נכס
-        for asset in available_assets:
+        # בדוק דירוג לכל מועמד
+        for index, asset in enumerate(candidates, 1):
             rank, tier, from_cache = await self.check_rank(asset['id'], keyword)
             
             # דלג על נכסים שלא זמינים
             if tier == Constants.TIER_UNAVAILABLE:
+                if on_result:
+                    await on_result({'done': index, 'total': len(candidates), 'result': None})
                 continue
             
             # הוסף מידע רלוונטי
@@ -229,6 +261,8 @@ class RankEngine:
             }
             
             results.append(result)
+            if on_result:
+                await on_result({'done': index, 'total': len(candidates), 'result': result})
         
         # מיין לפי דירוג (הדירוג הטוב ביותר קודם)
         results.sort(key=lambda x: (0 if x['rank'] > 0 else 999, x['rank']))
@@ -236,6 +270,236 @@ class RankEngine:
         # החזר עד limit תוצאות
         return results[:limit]
     
+    def _load_tracked_pairs(self) -> List[Tuple[int, str]]:
+        """
+        מחזיר את כל צמדי (נכס, מילת מפתח) שבמעקב - מילים שנבדקו בעבר והשכרות חיות
+        
+        Returns:
+            רשימת (מזהה נכס, מילת מפתח) ממוינת לפי נכס
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT t.asset_id, t.keyword
+                        FROM (
+                            SELECT asset_id, keyword FROM rank_cache
+                            UNION
+                            SELECT asset_id, keyword FROM rentals
+                            WHERE status = ANY(%s) AND asset_id IS NOT NULL AND keyword IS NOT NULL
+                        ) t
+                        JOIN assets a ON a.id = t.asset_id
+                        ORDER BY t.asset_id, t.keyword
+                    """, (list(LIVE_STATUSES),))
+                    return [(row['asset_id'], row['keyword']) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת מילות מפתח למחזור דירוג: {str(e)}")
+            return []
+    
+    @staticmethod
+    def _load_cycle_checkpoint() -> Optional[Dict[str, Any]]:
+        """
+        טוען נקודת ביקורת של מחזור שלא הסתיים
+        """
+        if not os.path.exists(CYCLE_CHECKPOINT_FILE):
+            return None
+        try:
+            with open(CYCLE_CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת נקודת ביקורת של מחזור דירוג: {str(e)}")
+            return None
+    
+    @staticmethod
+    def _save_cycle_checkpoint(checkpoint: Dict[str, Any]):
+        """
+        שומר נקודת ביקורת באופן אטומי (קובץ זמני + החלפה)
+        
+        לא בטוח לקריאות במקביל (קובץ זמני משותף) - _run_cycle מריץ כותב יחיד
+        """
+        try:
+            os.makedirs(Constants.DATA_DIR, exist_ok=True)
+            tmp_path = f"{CYCLE_CHECKPOINT_FILE}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(checkpoint, f, ensure_ascii=False)
+            os.replace(tmp_path, CYCLE_CHECKPOINT_FILE)
+        except Exception as e:
+            logger.error(f"שגיאה בשמירת נקודת ביקורת של מחזור דירוג: {str(e)}")
+    
+    @staticmethod
+    def _clear_cycle_checkpoint():
+        """
+        מוחק את נקודת הביקורת בסיום מחזור
+        """
+        try:
+            if os.path.exists(CYCLE_CHECKPOINT_FILE):
+                os.remove(CYCLE_CHECKPOINT_FILE)
+        except Exception as e:
+            logger.error(f"שגיאה במחיקת נקודת ביקורת של מחזור דירוג: {str(e)}")
+    
+    def get_cycle_progress(self) -> Optional[Dict[str, Any]]:
+        """
+        מחזיר את התקדמות מחזור הדירוג הפעיל
+        
+        Returns:
+            מילון התקדמות או None אם אין מחזור פעיל
+        """
+        if self._cycle_task and not self._cycle_task.done():
+            return dict(self._cycle_progress or {})
+        return None
+    
+    async def run_cycle(self, progress_callback: Optional[ProgressCallback] = None,
+                        concurrency: int = Constants.RANK_CYCLE_CONCURRENCY) -> Dict[str, Any]:
+        """
+        מריץ מחזור דירוג מלא על כל הנכסים ומילות המפתח שבמעקב
+        
+        נכסים נבדקים במקביל (עד concurrency), מילות המפתח של נכס נבדקות ברצף.
+        ההתקדמות נשמרת לכל היותר כל RANK_CYCLE_PROGRESS_INTERVAL שניות (וגם
+        בעצירה) - מחזור שנקטע ממשיך מנקודת הביקורת האחרונה.
+        אם מחזור כבר רץ, הקריאה מצטרפת אליו (כולל דיווחי ההתקדמות) וממתינה לתוצאה שלו.
+        
+        Args:
+            progress_callback: פונקציה אסינכרונית שמקבלת את מילון ההתקדמות
+            concurrency: מספר נכסים שנבדקים במקביל
+            
+        Returns:
+            מילון עם checked, updated, errors, duration
+        """
+        if self._cycle_task is None or self._cycle_task.done():
+            self._cycle_callbacks = []
+            self._cycle_task = asyncio.ensure_future(self._run_cycle(concurrency))
+        if progress_callback:
+            self._cycle_callbacks.append(progress_callback)
+        with bot_metrics.span(SPAN_RANK):
+            # shield - ביטול של ממתין אחד לא עוצר את המחזור
+            return await asyncio.shield(self._cycle_task)
+    
+    async def run_rank_cycle(self, progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        שם חלופי ל-run_cycle
+        """
+        return await self.run_cycle(progress_callback)
+    
+    async def _run_cycle(self, concurrency: int) -> Dict[str, Any]:
+        """
+        מבצע את מחזור הדירוג (ראה run_cycle)
+        """
+        started = time.monotonic()
+        pairs = await AsyncHelper.run_sync_in_async(self._load_tracked_pairs)
+        
+        checkpoint = self._load_cycle_checkpoint()
+        if checkpoint:
+            logger.info(f"ממשיך מחזור דירוג מנקודת ביקורת: {len(checkpoint['done'])} בדיקות הושלמו")
+        else:
+            checkpoint = {
+                'started_at': datetime.now().isoformat(),
+                'done': [],
+                'checked': 0,
+                'updated': 0,
+                'errors': 0,
+                'elapsed': 0.0,
+            }
+        
+        prior_elapsed = checkpoint['elapsed']
+        done = set(checkpoint['done'])
+        by_asset: Dict[int, List[str]] = {}
+        for asset_id, keyword in pairs:
+            if f"{asset_id}:{keyword}" not in done:
+                by_asset.setdefault(asset_id, []).append(keyword)
+        
+        progress = self._cycle_progress = {
+            'total': len(pairs),
+            'done': len(pairs) - sum(len(k) for k in by_asset.values()),
+            'checked': checkpoint['checked'],
+            'updated': checkpoint['updated'],
+            'errors': checkpoint['errors'],
+            'started_at': checkpoint['started_at'],
+        }
+        
+        last_report = 0.0
+        
+        async def report(force: bool = False):
+            nonlocal last_report
+            now = time.monotonic()
+            if not force and now - last_report < Constants.RANK_CYCLE_PROGRESS_INTERVAL:
+                return
+            last_report = now
+            for callback in list(self._cycle_callbacks):
+                try:
+                    await callback(dict(progress))
+                except Exception as e:
+                    logger.warning(f"שגיאה בדיווח התקדמות מחזור דירוג: {str(e)}")
+        
+        # כותב יחיד לנקודת הביקורת: שמירות לא חופפות, התמונה נלקחת בתוך הנעילה
+        # (כך ששמירה מאוחרת תמיד חדשה יותר), ולכל היותר פעם ב-interval
+        save_lock = asyncio.Lock()
+        last_save = 0.0
+        
+        async def save(force: bool = False):
+            nonlocal last_save
+            if not force and (
+                save_lock.locked()
+                or time.monotonic() - last_save < Constants.RANK_CYCLE_PROGRESS_INTERVAL
+            ):
+                return
+            async with save_lock:
+                last_save = time.monotonic()
+                checkpoint.update(
+                    done=list(done),
+                    checked=progress['checked'],
+                    updated=progress['updated'],
+                    errors=progress['errors'],
+                    elapsed=prior_elapsed + time.monotonic() - started,
+                )
+                await AsyncHelper.run_in_pool("file", self._save_cycle_checkpoint, dict(checkpoint))
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def sweep_asset(asset_id: int, keywords: List[str]):
+            async with semaphore:
+                for keyword in keywords:
+                    cache_key = f"{asset_id}:{keyword}"
+                    previous = self.rank_cache.get(cache_key, {}).get('rank')
+                    rank, _, _, error = await self._check_rank(asset_id, keyword, force_fresh=True)
+                    
+                    progress['checked'] += 1
+                    if error:
+                        progress['errors'] += 1
+                    elif rank != previous:
+                        progress['updated'] += 1
+                    progress['done'] += 1
+                    
+                    done.add(cache_key)
+                    await save()
+                    await report()
+        
+        await report(force=True)
+        # מחזור מלא הוא עבודת רקע - לא יתפוס את הסשנים ששמורים ללקוחות
+        try:
+            with session_lane(LANE_WATCHDOG):
+                await asyncio.gather(*(sweep_asset(a, k) for a, k in by_asset.items()))
+        except BaseException:
+            # מחזור שנעצר (שגיאה או ביטול) - שומרים את כל מה שהושלם עד כה
+            await asyncio.shield(save(force=True))
+            raise
+        
+        # משך כולל, כולל ריצות קודמות שנקטעו
+        duration = round(prior_elapsed + time.monotonic() - started, 1)
+        async with save_lock:
+            # אחרי שמירה שאולי עדיין רצה - כדי שלא תכתוב מחדש את הקובץ שנמחק
+            self._clear_cycle_checkpoint()
+        await report(force=True)
+        
+        result = {
+            'checked': progress['checked'],
+            'updated': progress['updated'],
+            'errors': progress['errors'],
+            'total': progress['total'],
+            'duration': duration,
+        }
+        logger.info(f"מחזור דירוג הסתיים: {result}")
+        return result
+    
     async def get_rank_history(self, asset_id: int, keyword: str, days: int = 7) -> List[Dict[str, Any]]:
         """
         מקבל היסטוריית דירוג של נכס למילת מפתח
@@ -0,0 +1,409 @@
+"""
+מודול rank_jobs - תור עבודות רקע לבדיקות דירוג
+
+בדיקות דירוג ארוכות רצות כעבודות עם מזהה, עדיפות ואיחוד כפילויות:
+בקשה זהה לעבודה שכבר בתור מצטרפת אליה, בקשות משתמשים קודמות לרענוני
+watchdog, ותוצאות שהסתיימו נשמרות במטמון לשימוש חוזר. העבודות נשמרות
+במסד הנתונים כך שעבודות שלא הסתיימו חוזרות לתור אחרי הפעלה מחדש.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from constants import Constants
+from db import get_connection
+from rank_checker import rank_checker
+from rank_engine import rank_engine
+from bot_metrics import bot_metrics, SPAN_RANK
+from session_manager import LANE_CUSTOMER, LANE_WARMING, LANE_WATCHDOG, session_lane
+from utils import AsyncHelper
+
+logger = logging.getLogger(__name__)
+
+# עדיפויות - מספר נמוך יותר רץ קודם
+PRIORITY_INTERACTIVE = 0
+PRIORITY_WATCHDOG = 10
+PRIORITY_BACKGROUND = 20
+
+# סוגי עבודות
+KIND_FIND_BEST = "find_best"
+KIND_CHECK_ASSET = "check_asset"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# נתיב הסשנים לפי עדיפות העבודה
+PRIORITY_LANES = {
+    PRIORITY_INTERACTIVE: LANE_CUSTOMER,
+    PRIORITY_WATCHDOG: LANE_WATCHDOG,
+    PRIORITY_BACKGROUND: LANE_WARMING,
+}
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+async def _run_find_best(params: Dict[str, Any], report: ProgressCallback) -> Any:
+    return await rank_engine.find_best_assets_for_keyword(
+        params["keyword"], params.get("limit", 5), on_result=report
+    )
+
+
+async def _run_check_asset(params: Dict[str, Any], report: ProgressCallback) -> Any:
+    rank, tier, error = await rank_checker.check_asset_rank(params["asset_id"], params["keyword"])
+    if error:
+        # כישלון (למשל אין סשן נקי או FloodWait) - העבודה תיכשל ולא תישמר במטמון
+        raise RuntimeError(error)
+    return [rank, tier, error]
+
+
+# מפעילי עבודות לפי סוג
+RUNNERS: Dict[str, Callable[[Dict[str, Any], ProgressCallback], Awaitable[Any]]] = {
+    KIND_FIND_BEST: _run_find_best,
+    KIND_CHECK_ASSET: _run_check_asset,
+}
+
+
+def _job_key(kind: str, params: Dict[str, Any]) -> str:
+    """
+    מפתח לאיחוד כפילויות - סוג העבודה והפרמטרים שלה
+    """
+    return f"{kind}:{json.dumps(params, sort_keys=True, ensure_ascii=False)}"
+
+
+class RankJob:
+    """
+    עבודת דירוג בודדת
+    """
+
+    def __init__(self, kind: str, params: Dict[str, Any], priority: int, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.key = _job_key(kind, params)
+        self.priority = priority
+        self.status = STATUS_QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.progress: Dict[str, Any] = {}
+        self.listeners: List[ProgressCallback] = []
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # עבודה שאיש לא ממתין לה (למשל עבודה משוחזרת) לא תדפיס אזהרת חריגה
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        מצב העבודה לתצוגה
+        """
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'priority': self.priority,
+            'status': self.status,
+            'progress': dict(self.progress),
+            'error': self.error,
+        }
+
+
+class RankJobQueue:
+    """
+    תור עדיפויות לעבודות דירוג עם איחוד כפילויות, מטמון תוצאות ושמירה במסד
+    """
+
+    def __init__(self, workers: int = Constants.RANK_JOB_WORKERS,
+                 result_ttl: int = Constants.RANK_JOB_RESULT_TTL):
+        """
+        יוצר תור עבודות
+
+        Args:
+            workers: מספר עבודות שרצות במקביל
+            result_ttl: שניות לשמירת תוצאה במטמון
+        """
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        # {job_id: job} - עבודות בתור או בריצה
+        self._jobs: Dict[str, RankJob] = {}
+        # {key: job_id} - עבודה פעילה לכל מפתח
+        self._active: Dict[str, str] = {}
+        # {key: (זמן תפוגה, תוצאה)}
+        self._results: Dict[str, Tuple[float, Any]] = {}
+
+    # -------------------------------------------------------------------------
+    # שמירה במסד הנתונים
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _persist(job: RankJob):
+        """
+        שומר את מצב העבודה (הוספה או עדכון)
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO rank_jobs (id, kind, params, priority, status, result, error)
+                        VALUES (%s, %s, %s::jsonb, %s, %s, %s::jsonb, %s)
+                        ON CONFLICT (id) DO UPDATE SET
+                            priority = EXCLUDED.priority,
+                            status = EXCLUDED.status,
+                            result = EXCLUDED.result,
+                            error = EXCLUDED.error,
+                            finished_at = CASE WHEN EXCLUDED.status IN ('done', 'failed')
+                                               THEN NOW() ELSE rank_jobs.finished_at END
+                    """, (
+                        job.id, job.kind, json.dumps(job.params, ensure_ascii=False), job.priority,
+                        job.status, json.dumps(job.result, ensure_ascii=False, default=str), job.error,
+                    ))
+        except Exception as e:
+            logger.error(f"שגיאה בשמירת עבודת דירוג {job.id}: {str(e)}")
+
+    @staticmethod
+    def _load_unfinished() -> List[Dict[str, Any]]:
+        """
+        טוען עבודות שלא הסתיימו (מהפעלה קודמת)
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT id, kind, params, priority
+                        FROM rank_jobs
+                        WHERE status IN ('queued', 'running')
+                        ORDER BY priority, created_at
+                    """)
+                    return [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת עבודות דירוג: {str(e)}")
+            return []
+
+    @staticmethod
+    def _load_recent_results(ttl: int) -> List[Dict[str, Any]]:
+        """
+        טוען תוצאות של עבודות שהסתיימו בתוך חלון המטמון
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT kind, params, result,
+                               EXTRACT(EPOCH FROM (NOW() - finished_at)) AS age
+                        FROM rank_jobs
+                        WHERE status = 'done' AND finished_at > NOW() - %s * INTERVAL '1 second'
+                        ORDER BY finished_at
+                    """, (ttl,))
+                    return [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת תוצאות עבודות דירוג: {str(e)}")
+            return []
+
+    # -------------------------------------------------------------------------
+    # הפעלה ועצירה
+    # -------------------------------------------------------------------------
+
+    async def start(self):
+        """
+        מפעיל את העובדים על ה-loop הנוכחי ומחזיר לתור עבודות שלא הסתיימו
+        """
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+        now = time.time()
+        for row in await AsyncHelper.run_sync_in_async(self._load_recent_results, self.result_ttl):
+            key = _job_key(row['kind'], row['params'])
+            self._results[key] = (now + self.result_ttl - float(row['age']), row['result'])
+
+        unfinished = await AsyncHelper.run_sync_in_async(self._load_unfinished)
+        for row in unfinished:
+            if row['kind'] not in RUNNERS:
+                continue
+            job = RankJob(row['kind'], row['params'], row['priority'], job_id=row['id'])
+            self._enqueue(job)
+        if unfinished:
+            logger.info(f"הוחזרו לתור {len(unfinished)} עבודות דירוג שלא הסתיימו")
+
+    async def stop(self):
+        """
+        עוצר את העובדים - עבודות שלא הסתיימו יחזרו לתור בהפעלה הבאה
+
+        הממתינים לעבודות שבתור או בריצה מקבלים חריגה במקום להמתין לנצח;
+        העבודות עצמן נשארות במסד ונטענות מחדש ב-start.
+        """
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._queue = None
+
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("תור עבודות הדירוג נעצר"))
+        self._jobs.clear()
+        self._active.clear()
+
+    # -------------------------------------------------------------------------
+    # הגשת עבודות
+    # -------------------------------------------------------------------------
+
+    def _enqueue(self, job: RankJob):
+        self._jobs[job.id] = job
+        self._active[job.key] = job.id
+        self._queue.put_nowait((job.priority, next(self._seq), job.id))
+
+    def _prune_results(self):
+        """
+        מסיר מהמטמון תוצאות שפג תוקפן
+        """
+        now = time.time()
+        for key in [key for key, (expires, _) in self._results.items() if expires < now]:
+            del self._results[key]
+
+    def _cached_result(self, key: str) -> Tuple[bool, Any]:
+        entry = self._results.get(key)
+        if not entry:
+            return False, None
+        expires, result = entry
+        if expires < time.time():
+            del self._results[key]
+            return False, None
+        return True, result
+
+    async def submit(self, kind: str, params: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                     progress_callback: Optional[ProgressCallback] = None,
+                     use_cache: bool = True) -> RankJob:
+        """
+        מגיש עבודה לתור
+
+        עבודה זהה שכבר בתור או בריצה מוחזרת במקומה (ועדיפותה עולה אם צריך);
+        תוצאה שמורה מחזירה עבודה שכבר הסתיימה.
+
+        Args:
+            kind: סוג העבודה (KIND_*)
+            params: פרמטרים לעבודה
+            priority: עדיפות (PRIORITY_*)
+            progress_callback: פונקציה אסינכרונית לדיווחי התקדמות
+            use_cache: האם להחזיר תוצאה שמורה אם קיימת
+
+        Returns:
+            העבודה
+        """
+        if kind not in RUNNERS:
+            raise ValueError(f"סוג עבודה לא מוכר: {kind}")
+        await self.start()
+
+        key = _job_key(kind, params)
+
+        active_id = self._active.get(key)
+        if active_id:
+            job = self._jobs[active_id]
+            if progress_callback:
+                job.listeners.append(progress_callback)
+            if priority < job.priority and job.status == STATUS_QUEUED:
+                # הכנסה מחדש בעדיפות הגבוהה - הרשומה הישנה תדולג
+                job.priority = priority
+                self._queue.put_nowait((priority, next(self._seq), job.id))
+            return job
+
+        job = RankJob(kind, params, priority)
+        if progress_callback:
+            job.listeners.append(progress_callback)
+
+        if use_cache:
+            found, result = self._cached_result(key)
+            if found:
+                job.status = STATUS_DONE
+                job.result = result
+                job.future.set_result(result)
+                return job
+
+        self._enqueue(job)
+        await AsyncHelper.run_sync_in_async(self._persist, job)
+        return job
+
+    async def run(self, kind: str, params: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                  progress_callback: Optional[ProgressCallback] = None,
+                  use_cache: bool = True) -> Any:
+        """
+        מגיש עבודה וממתין לתוצאה שלה
+        """
+        with bot_metrics.span(SPAN_RANK):
+            job = await self.submit(kind, params, priority, progress_callback, use_cache)
+            # shield - ביטול הממתין לא מבטל את העבודה עבור ממתינים אחרים
+            return await asyncio.shield(job.future)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        מחזיר את מצב העבודה (רק עבודות בתור או בריצה)
+        """
+        job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    # -------------------------------------------------------------------------
+    # ביצוע
+    # -------------------------------------------------------------------------
+
+    async def _worker(self):
+        while True:
+            priority, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            # רשומה ישנה של עבודה שעדיפותה עלתה או שכבר בוצעה
+            if not job or job.status != STATUS_QUEUED or priority != job.priority:
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job: RankJob):
+        job.status = STATUS_RUNNING
+        await AsyncHelper.run_sync_in_async(self._persist, job)
+
+        async def report(progress: Dict[str, Any]):
+            job.progress = progress
+            for listener in list(job.listeners):
+                try:
+                    await listener(dict(progress))
+                except Exception as e:
+                    logger.warning(f"שגיאה בדיווח התקדמות עבודה {job.id}: {str(e)}")
+
+        try:
+            with session_lane(PRIORITY_LANES.get(job.priority, LANE_WARMING)):
+                job.result = await RUNNERS[job.kind](job.params, report)
+            job.status = STATUS_DONE
+            self._prune_results()
+            self._results[job.key] = (time.time() + self.result_ttl, job.result)
+        except asyncio.CancelledError:
+            # עצירה - העבודה נשארת 'running' במסד ותחזור לתור בהפעלה הבאה
+            raise
+        except Exception as e:
+            logger.error(f"עבודת דירוג {job.id} נכשלה: {str(e)}")
+            job.status = STATUS_FAILED
+            job.error = str(e)
+        finally:
+            if job.status in (STATUS_DONE, STATUS_FAILED):
+                self._jobs.pop(job.id, None)
+                if self._active.get(job.key) == job.id:
+                    del self._active[job.key]
+
+        await AsyncHelper.run_sync_in_async(self._persist, job)
+
+        if job.status == STATUS_DONE:
+            job.future.set_result(job.result)
+        else:
+            job.future.set_exception(RuntimeError(job.error))
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+rank_jobs = RankJobQueue()
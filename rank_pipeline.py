@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from rank_analyzer import CACHE_FILE, analyze_asset, load_json, save_json
+from rank_actions import action_for_alert
+
+INPUT_FILE = "rank_input.jsonl"
+ALERTS_FILE = "rank_alerts.jsonl"
+ACTIONS_FILE = "rank_actions.jsonl"
+RESULTS_FILE = "action_results.jsonl"
+CHECKPOINT_FILE = "rank_pipeline.checkpoint.json"
+SESSIONS_FILE = "session_status.json"
+
+DISPATCH_CHUNK_SIZE = 50   # actions handed to the dispatcher at once
+
+# fields that do not affect the analysis and must not mark a record as changed
+VOLATILE_FIELDS = ("session", "proxy", "dc", "slot_start", "slot_end", "timestamp")
+
+
+def record_key(record):
+    return str(record.get("asset_name") or record.get("target_id"))
+
+
+def fingerprint(record):
+    stable = {k: v for k, v in record.items() if k not in VOLATILE_FIELDS}
+    payload = json.dumps(stable, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def save_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    save_json(tmp_path, data)
+    os.replace(tmp_path, path)
+
+
+async def read_records(path):
+    """Yield one record per non-empty line; malformed lines are reported and skipped."""
+    if not os.path.exists(path):
+        print(f"[!] Input file {path} not found")
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[!] Skipping malformed line {line_number} in {path}: {e}")
+
+
+async def changed_only(records, checkpoint, seen):
+    """Pass through records whose fingerprint differs from the checkpoint.
+
+    New fingerprints are collected in ``seen`` and only written to the
+    checkpoint by the caller once the whole run has completed.
+    """
+    async for record in records:
+        key = record_key(record)
+        digest = fingerprint(record)
+        if checkpoint.get(key) == digest:
+            continue
+        seen[key] = digest
+        yield record
+
+
+async def analyze(records, cache, now):
+    async for record in records:
+        for alert in analyze_asset(record, cache, now):
+            yield alert
+
+
+async def to_actions(alerts):
+    async for alert in alerts:
+        yield action_for_alert(alert)
+
+
+async def tee(records, path):
+    """Write every record that passes through to a JSONL file."""
+    with open(path, "w", encoding="utf-8") as f:
+        async for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            yield record
+
+
+async def dispatch(actions, sessions, chunk_size=DISPATCH_CHUNK_SIZE):
+    """Send actions in chunks so delivery starts before the input is exhausted."""
+    from action_dispatcher import dispatch_actions
+
+    chunk = []
+    async for action in actions:
+        chunk.append(action)
+        if len(chunk) >= chunk_size:
+            for result in await dispatch_actions(chunk, sessions):
+                yield result
+            chunk = []
+
+    if chunk:
+        for result in await dispatch_actions(chunk, sessions):
+            yield result
+
+
+async def run_pipeline(input_path=INPUT_FILE, send=False, full=False):
+    """Run the rank pipeline over the records changed since the last run.
+
+    The rank cache and the checkpoint are saved only after every stage has
+    consumed its input, so an interrupted run is repeated in full next time.
+    """
+    started = time.monotonic()
+    now = datetime.now().isoformat()
+
+    cache = load_json(CACHE_FILE)
+    checkpoint = {} if full else load_json(CHECKPOINT_FILE)
+    seen = {}
+
+    stream = changed_only(read_records(input_path), checkpoint, seen)
+    stream = tee(analyze(stream, cache, now), ALERTS_FILE)
+    stream = tee(to_actions(stream), ACTIONS_FILE)
+    if send:
+        stream = tee(dispatch(stream, load_json(SESSIONS_FILE)), RESULTS_FILE)
+
+    counts = {}
+    async for item in stream:
+        status = item.get("status") or item.get("action")
+        counts[status] = counts.get(status, 0) + 1
+
+    save_json_atomic(CACHE_FILE, cache)
+    checkpoint.update(seen)
+    save_json_atomic(CHECKPOINT_FILE, checkpoint)
+
+    print(f"[✔] {len(seen)} changed records processed in {time.monotonic() - started:.1f}s: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental rank analysis pipeline")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--send", action="store_true", help="dispatch the generated actions")
+    parser.add_argument("--full", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+
+    asyncio.run(run_pipeline(args.input, send=args.send, full=args.full))
+
+
+if __name__ == "__main__":
+    main()
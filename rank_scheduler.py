@@ -1,12 +1,22 @@
 import json
-import random
 import os
+import time
+from datetime import datetime, timedelta
+
+from telethon.sessions import StringSession
+
+from constants import Constants
+from proxy_pool import load_proxy_records
 from session_classifier import SessionClassifier
 
-RANK_INPUT_FILE = "rank_input.json"
+RANK_INPUT_FILE = "rank_input.jsonl"
+SESSION_INDEX_FILE = "session_index.json"
 SESSIONS_DIR = "sessions"
 ASSETS_DIR = "assets"
 
+# requests per keyword check that pay the proxy round trip (rename, search, restore)
+REQUESTS_PER_CHECK = 3
+
 
 def load_assets():
     assets = []
@@ -20,38 +30,206 @@ def load_assets():
     return assets
 
 
-def get_clean_sessions():
-    clean_sessions = []
+def load_session_index():
+    if not os.path.exists(SESSION_INDEX_FILE):
+        return {}
+    try:
+        with open(SESSION_INDEX_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[!] Failed to load session index, rebuilding: {e}")
+        return {}
+
+
+def save_session_index(index):
+    tmp_path = f"{SESSION_INDEX_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, SESSION_INDEX_FILE)
+
+
+def session_dc(session_string):
+    try:
+        return StringSession(session_string).dc_id
+    except Exception:
+        return None
+
+
+def refresh_session_index(index, now):
+    """Bring the index in line with the sessions directory.
+
+    Files are only re-read when their mtime changed, and cleanliness is only
+    re-checked once the cached result is older than SESSION_CLASSIFICATION_TTL.
+    """
+    present = set()
     for file in os.listdir(SESSIONS_DIR):
-        if file.endswith(".session"):
-            path = os.path.join(SESSIONS_DIR, file)
+        if not file.endswith(".session"):
+            continue
+        present.add(file)
+        path = os.path.join(SESSIONS_DIR, file)
+        mtime = os.path.getmtime(path)
+        entry = index.get(file)
+
+        if entry is None or entry.get("mtime") != mtime:
             with open(path, "r", encoding="utf-8") as f:
-                session_string = f.read()
-            if SessionClassifier.is_clean(session_string):
-                clean_sessions.append(session_string)
-    return clean_sessions
+                session_string = f.read().strip()
+            entry = index[file] = {
+                **(entry or {}),
+                "mtime": mtime,
+                "string": session_string,
+                "dc": session_dc(session_string),
+                "checked_at": 0,
+            }
+
+        if now - entry.get("checked_at", 0) > Constants.SESSION_CLASSIFICATION_TTL:
+            entry["clean"] = SessionClassifier.is_clean(entry["string"])
+            entry["checked_at"] = now
+
+    for file in set(index) - present:
+        del index[file]
+
+    return index
+
+
+def proxy_key(proxy):
+    return f"{proxy['ip']}:{proxy['port']}"
+
+
+def assign_proxies(index, proxies):
+    """Pin every session to a proxy, filling the least used proxies first."""
+    by_key = {proxy_key(p): p for p in proxies}
+    load = {key: 0 for key in by_key}
+
+    for entry in index.values():
+        if entry.get("proxy") in by_key:
+            load[entry["proxy"]] += 1
+        else:
+            entry["proxy"] = None
+
+    for entry in index.values():
+        if entry["proxy"] is None and load:
+            # prefer a proxy on the session's DC, then the least loaded, then the fastest
+            key = min(load, key=lambda k: (
+                by_key[k].get("dc_id") not in (None, entry.get("dc")),
+                load[k],
+                by_key[k].get("speed") or 0,
+            ))
+            entry["proxy"] = key
+            load[key] += 1
+
+    return by_key
+
+
+class SessionSlot:
+    """Planning state of one session: when it is free and how long it has worked without rest."""
+
+    def __init__(self, name, entry, proxy, available_at):
+        self.name = name
+        self.entry = entry
+        self.proxy = proxy
+        self.available_at = available_at
+        self.busy = 0
+        self.tasks = 0
+
+    def latency(self):
+        speed = (self.proxy or {}).get("speed") or 0
+        return speed / 1000
+
+    def cost(self, asset):
+        return len(asset["keywords"]) * (Constants.RANK_KEYWORD_CHECK_COST + REQUESTS_PER_CHECK * self.latency())
+
+    def place(self, asset):
+        """Return (start, end) for the asset, inserting a rest window once the work budget is used up."""
+        cost = self.cost(asset)
+        start = self.available_at
+        if self.busy and self.busy + cost > Constants.SESSION_MAX_BUSY:
+            start += Constants.SESSION_COOLDOWN
+        return start, start + cost
+
+    def commit(self, start, end):
+        if start > self.available_at:
+            self.busy = 0
+        self.busy += end - start
+        self.available_at = end
+        self.tasks += 1
+
+
+def plan_schedule(assets, slots):
+    """Longest-processing-time-first bin packing of assets onto session slots.
+
+    Each asset goes to the session on which it finishes earliest; ties are
+    broken by the load already placed on the session's proxy and DC.
+    """
+    proxy_load = {}
+    dc_load = {}
+    plan = []
+
+    for asset in sorted(assets, key=lambda a: len(a["keywords"]), reverse=True):
+        if not asset["keywords"]:
+            continue
+
+        best = None
+        for slot in slots:
+            start, end = slot.place(asset)
+            rank = (end, proxy_load.get(slot.entry.get("proxy"), 0), dc_load.get(slot.entry.get("dc"), 0), slot.tasks)
+            if best is None or rank < best[0]:
+                best = (rank, slot, start, end)
+
+        _, slot, start, end = best
+        slot.commit(start, end)
+        proxy_load[slot.entry.get("proxy")] = proxy_load.get(slot.entry.get("proxy"), 0) + 1
+        dc_load[slot.entry.get("dc")] = dc_load.get(slot.entry.get("dc"), 0) + 1
+        plan.append((start, end, slot, asset))
+
+    plan.sort(key=lambda item: item[0])
+    return plan
 
 
 def generate_schedule():
+    now = time.time()
     assets = load_assets()
-    clean_sessions = get_clean_sessions()
 
-    if not clean_sessions:
+    index = refresh_session_index(load_session_index(), now)
+    proxies = assign_proxies(index, load_proxy_records())
+
+    slots = []
+    for name, entry in index.items():
+        if not entry.get("clean") or not entry.get("string"):
+            continue
+        # a session planned by a previous run rests before it is used again
+        planned_until = entry.get("planned_until", 0)
+        available_at = max(now, planned_until + Constants.SESSION_COOLDOWN) if planned_until else now
+        slots.append(SessionSlot(name, entry, proxies.get(entry.get("proxy")), available_at))
+
+    if not slots:
+        save_session_index(index)
         raise ValueError("No clean sessions available for scheduling.")
 
-    schedule = []
-    for i, asset in enumerate(assets):
-        session = clean_sessions[i % len(clean_sessions)]
-        schedule.append({
-            "session": session,
-            "keywords": asset["keywords"],
-            "target_id": asset["target_id"]
-        })
+    plan = plan_schedule(assets, slots)
 
+    # one record per line so rank_pipeline can stream it
     with open(RANK_INPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(schedule[0], f, ensure_ascii=False, indent=2)
+        for start, end, slot, asset in plan:
+            f.write(json.dumps({
+                "asset_name": asset.get("asset_name") or asset.get("name"),
+                "session": slot.entry["string"],
+                "keywords": asset["keywords"],
+                "target_id": asset["target_id"],
+                "proxy": slot.entry.get("proxy"),
+                "dc": slot.entry.get("dc"),
+                "slot_start": datetime.fromtimestamp(start).isoformat(),
+                "slot_end": datetime.fromtimestamp(end).isoformat(),
+            }, ensure_ascii=False) + "\n")
+
+    for slot in slots:
+        if slot.tasks:
+            slot.entry["planned_until"] = slot.available_at
+    save_session_index(index)
 
-    print("[✔] rank_input.json generated with clean session assigned.")
+    finish = max((end for _, end, _, _ in plan), default=now)
+    used = sum(1 for slot in slots if slot.tasks)
+    print(f"[✔] {RANK_INPUT_FILE} generated: {len(plan)} assets on {used}/{len(slots)} sessions, "
+          f"cycle ends in {timedelta(seconds=int(finish - now))}.")
 
 
 if __name__ == "__main__":
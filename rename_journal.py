@@ -0,0 +1,130 @@
+"""
+מודול rename_journal - יומן עמיד לשמות זמניים של נכסים (שם@@@@@@ בזמן בדיקת דירוג)
+
+כל שינוי שם זמני נרשם במסד לפני שהוא מבוצע בטלגרם ונמחק רק אחרי
+שהשם המקורי שוחזר, כך שקריסה באמצע בדיקה לא משאירה נכס עם שם זמני.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import get_connection
+from constants import Constants
+
+logger = logging.getLogger(__name__)
+
+
+class RenameJournal:
+    """
+    יומן שינויי שם זמניים על טבלת asset_rename_journal
+    """
+
+    def record(self, asset_id: int, original_name: str, temp_name: str,
+               timeout: int = Constants.RENAME_JOURNAL_TIMEOUT) -> bool:
+        """
+        רושם שינוי שם זמני לפני ביצועו
+
+        אם כבר קיימת רשומה לנכס, השם המקורי שבה נשמר (הנכס כבר בשם זמני)
+        ורק השם הזמני והמועד מתעדכנים.
+
+        Args:
+            asset_id: מזהה הנכס
+            original_name: השם המקורי לשחזור
+            temp_name: השם הזמני
+            timeout: שניות עד שהרשומה נחשבת תקועה
+
+        Returns:
+            האם הרישום הצליח
+        """
+        deadline = datetime.now() + timedelta(seconds=timeout)
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO asset_rename_journal
+                        (asset_id, original_name, temp_name, deadline, created_at)
+                        VALUES (%s, %s, %s, %s, NOW())
+                        ON CONFLICT (asset_id) DO UPDATE
+                        SET temp_name = EXCLUDED.temp_name,
+                            deadline = EXCLUDED.deadline
+                    """, (asset_id, original_name, temp_name, deadline))
+            return True
+        except Exception as e:
+            logger.error(f"שגיאה ברישום שם זמני לנכס {asset_id}: {str(e)}")
+            return False
+
+    def get_original_name(self, asset_id: int) -> Optional[str]:
+        """
+        מחזיר את השם המקורי של נכס שנמצא בשם זמני
+
+        Args:
+            asset_id: מזהה הנכס
+
+        Returns:
+            השם המקורי או None אם אין שינוי שם פתוח
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT original_name FROM asset_rename_journal
+                        WHERE asset_id = %s
+                    """, (asset_id,))
+                    row = cur.fetchone()
+                    return row['original_name'] if row else None
+        except Exception as e:
+            logger.error(f"שגיאה בקריאת יומן שמות לנכס {asset_id}: {str(e)}")
+            return None
+
+    def clear(self, asset_ids: List[int]) -> int:
+        """
+        מוחק רשומות אחרי שחזור השם המקורי
+
+        Args:
+            asset_ids: מזהי הנכסים ששוחזרו
+
+        Returns:
+            מספר הרשומות שנמחקו
+        """
+        if not asset_ids:
+            return 0
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM asset_rename_journal
+                        WHERE asset_id = ANY(%s)
+                    """, (list(asset_ids),))
+                    return cur.rowcount
+        except Exception as e:
+            logger.error(f"שגיאה בניקוי יומן שמות: {str(e)}")
+            return 0
+
+    def get_stale(self, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        מחזיר רשומות שעבר המועד שלהן (בדיקה שקרסה או נתקעה)
+
+        Args:
+            now: זמן הייחוס (ברירת מחדל: עכשיו)
+
+        Returns:
+            רשימת רשומות (asset_id, original_name, temp_name, deadline)
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT asset_id, original_name, temp_name, deadline
+                        FROM asset_rename_journal
+                        WHERE deadline < %s
+                        ORDER BY deadline ASC
+                    """, (now or datetime.now(),))
+                    return [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בקבלת שמות זמניים תקועים: {str(e)}")
+            return []
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+rename_journal = RenameJournal()
@@ -0,0 +1,144 @@
+"""
+מודול rename_planner - איחוד שינויי שם זמניים של נכסים בין בדיקות דירוג
+
+בדיקות רצופות על אותו נכס עוברות ישירות משם זמני אחד לשני, והשחזור
+לשם המקורי נדחה ומתבצע פעם אחת בסוף. שינוי לשם שכבר מוגדר מדולג.
+"""
+
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+from constants import Constants
+from asset_catalog import asset_catalog
+from profile_editor import profile_editor
+
+logger = logging.getLogger(__name__)
+
+
+class RenamePlanner:
+    """
+    מתכנן שינויי שם - נעילה לכל נכס, דילוג על שינויים ריקים ושחזור נדחה
+    """
+
+    def __init__(self, restore_delay: int = Constants.RENAME_RESTORE_DELAY):
+        """
+        יוצר מתכנן שינויי שם
+
+        Args:
+            restore_delay: שניות להמתנה לפני שחזור השם המקורי אחרי שחרור נכס
+        """
+        self.restore_delay = restore_delay
+        # {asset_id: asyncio.Lock} - בדיקה אחת בכל רגע על כל נכס
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # {asset_id: asyncio.Task} - שחזורים נדחים שעוד לא בוצעו
+        self._pending_restores: Dict[int, asyncio.Task] = {}
+
+    def _lock(self, asset_id: int) -> asyncio.Lock:
+        lock = self._locks.get(asset_id)
+        if lock is None:
+            lock = self._locks[asset_id] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def current_title(asset_id: int) -> str:
+        """
+        מחזיר את השם הנוכחי של הנכס (מקטלוג הנכסים)
+
+        Args:
+            asset_id: מזהה הנכס
+
+        Returns:
+            השם הנוכחי או מחרוזת ריקה אם הנכס לא נמצא
+        """
+        asset = asset_catalog.get(asset_id)
+        return asset['name'] if asset else ""
+
+    async def set_title(self, asset_id: int, title: str) -> Tuple[bool, str, bool]:
+        """
+        משנה שם נכס רק אם הוא שונה מהשם הנוכחי
+
+        Args:
+            asset_id: מזהה הנכס
+            title: השם הרצוי
+
+        Returns:
+            (הצלחה, הודעה, האם בוצע שינוי בטלגרם)
+        """
+        if self.current_title(asset_id) == title:
+            return True, "השם כבר מעודכן", False
+
+        success, message = await profile_editor.change_asset_name(asset_id, title)
+        return success, message, success
+
+    async def acquire(self, asset_id: int, temp_name: str) -> Tuple[bool, str, bool]:
+        """
+        נועל נכס לבדיקה ומעביר אותו לשם זמני (מבטל שחזור נדחה אם יש)
+
+        חובה לקרוא ל-release בסיום, גם אם הפעולה נכשלה.
+
+        Args:
+            asset_id: מזהה הנכס
+            temp_name: השם הזמני
+
+        Returns:
+            (הצלחה, הודעה, האם בוצע שינוי בטלגרם)
+        """
+        await self._lock(asset_id).acquire()
+
+        pending = self._pending_restores.pop(asset_id, None)
+        if pending and not pending.done():
+            pending.cancel()
+            logger.debug(f"שחזור נדחה של נכס {asset_id} בוטל - מעבר ישיר לשם '{temp_name}'")
+
+        return await self.set_title(asset_id, temp_name)
+
+    def release(self, asset_id: int):
+        """
+        משחרר נכס אחרי בדיקה ומתזמן שחזור נדחה לשם המקורי
+
+        Args:
+            asset_id: מזהה הנכס
+        """
+        self._pending_restores[asset_id] = asyncio.ensure_future(self._restore_later(asset_id))
+        lock = self._locks.get(asset_id)
+        if lock and lock.locked():
+            lock.release()
+
+    async def _restore_later(self, asset_id: int):
+        """
+        משחזר את השם המקורי אחרי restore_delay, אלא אם הנכס נתפס שוב
+
+        ביטול (למשל בסגירת הלולאה) משאיר את הרשומה ביומן השמות, והשחזור
+        יתבצע על ידי recover_stale_renames.
+
+        Args:
+            asset_id: מזהה הנכס
+        """
+        await asyncio.sleep(self.restore_delay)
+        async with self._lock(asset_id):
+            if self._pending_restores.get(asset_id) is asyncio.current_task():
+                del self._pending_restores[asset_id]
+            await self._restore(asset_id)
+
+    @staticmethod
+    async def _restore(asset_id: int):
+        success, message = await profile_editor.restore_asset_name(asset_id)
+        if not success:
+            logger.error(f"שחזור שם נכס {asset_id} נכשל: {message}")
+
+    async def flush(self):
+        """
+        משחזר מיד את כל הנכסים שממתינים לשחזור נדחה (למשל בסגירת הבוט)
+        """
+        pending = list(self._pending_restores.items())
+        self._pending_restores.clear()
+
+        for asset_id, task in pending:
+            task.cancel()
+            async with self._lock(asset_id):
+                await self._restore(asset_id)
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+rename_planner = RenamePlanner()
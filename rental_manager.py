@@ -1,21 +1,19 @@
 # -*- coding: utf-8 -*-
-"""Simplified rental management placeholder."""
+"""Rental management on top of the DB-backed rental store."""
 
 import logging
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 from constants import Constants
+from rental_state_machine import rental_state_machine
+from rental_store import rental_store
 
 logger = logging.getLogger(__name__)
 
-# In-memory storage for rentals
-_rentals: Dict[int, Dict[str, Any]] = {}
-_next_id = 1
-
 
 def get_all_rentals() -> List[Dict[str, Any]]:
-    return list(_rentals.values())
+    return rental_store.get_all()
 
 
 def get_rental_price(rank: int, tier: str) -> float:
@@ -25,110 +23,121 @@ def get_rental_price(rank: int, tier: str) -> float:
 
 def create_rental_request(user_id: int, keyword: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     """Create a new rental entry in pending state."""
-    global _next_id
-    rental = {
-        "id": _next_id,
-        "user_id": user_id,
+    rental = rental_store.insert({
+        "user_telegram_id": user_id,
         "keyword": keyword,
         "asset_id": None,
-        "asset_name": None,
-        "asset_type": None,
         "rank": -1,
         "tier": Constants.TIER_UNAVAILABLE,
         "price": 0,
         "status": Constants.RENTAL_STATUS_PENDING,
-    }
-    _rentals[_next_id] = rental
-    _next_id += 1
+    })
+    if not rental:
+        return None, "failed to create rental"
     return rental, None
 
 
 def create_rental(data: Dict[str, Any]) -> int:
-    """Add a rental to the store and return its id."""
-    global _next_id
-    data = dict(data)
-    data.setdefault("id", _next_id)
-    _rentals[_next_id] = data
-    _next_id += 1
-    return data["id"]
+    """Add a rental to the store and return its id (0 on failure)."""
+    rental = rental_store.insert(data)
+    return rental["id"] if rental else 0
 
 
 def get_rental(rental_id: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-    rental = _rentals.get(rental_id)
+    rental = rental_store.get(rental_id)
     if not rental:
         return None, "rental not found"
     return rental, None
 
 
 def activate_rental(rental_id: int, payment_id: str, duration_hours: int) -> Tuple[bool, str]:
-    rental = _rentals.get(rental_id)
-    if not rental:
-        return False, "rental not found"
-    rental["status"] = Constants.RENTAL_STATUS_ACTIVE
-    rental["payment_id"] = payment_id
-    rental["start_time"] = datetime.now()
-    rental["end_time"] = datetime.now() + timedelta(hours=duration_hours)
+    now = datetime.now()
+    rows = rental_state_machine.transition(
+        [rental_id],
+        Constants.RENTAL_STATUS_ACTIVE,
+        reason="payment",
+        payment_id=payment_id,
+        start_time=now,
+        end_time=now + timedelta(hours=duration_hours),
+        duration_hours=duration_hours,
+    )
+    if not rows:
+        return _transition_error(rental_id, Constants.RENTAL_STATUS_ACTIVE)
     return True, ""
 
 
 def cancel_rental(rental_id: int) -> Tuple[bool, str]:
-    rental = _rentals.get(rental_id)
-    if not rental:
-        return False, "rental not found"
-    rental["status"] = Constants.RENTAL_STATUS_CANCELED
-    return True, ""
+    return update_rental_status(rental_id, Constants.RENTAL_STATUS_CANCELED)
 
 
 def extend_rental(rental_id: int, payment_id: str, duration_hours: int) -> Tuple[bool, str]:
-    rental = _rentals.get(rental_id)
+    rental = rental_store.get(rental_id)
     if not rental:
         return False, "rental not found"
-    rental["end_time"] = rental.get("end_time", datetime.now()) + timedelta(hours=duration_hours)
-    rental["payment_id"] = payment_id
+    end_time = rental.get("end_time") or datetime.now()
+    fields = {
+        "end_time": end_time + timedelta(hours=duration_hours),
+        "duration_hours": (rental.get("duration_hours") or 0) + duration_hours,
+        "payment_id": payment_id,
+    }
+    if rental.get("status") == Constants.RENTAL_STATUS_EXPIRING:
+        # an extended rental is no longer about to expire
+        updated = rental_state_machine.transition(
+            [rental_id], Constants.RENTAL_STATUS_ACTIVE, reason="extended", **fields
+        )
+    else:
+        updated = rental_store.update(rental_id, **fields)
+    if not updated:
+        return False, "failed to extend rental"
     return True, ""
 
 
 def update_rental_status(rental_id: int, new_status: str) -> Tuple[bool, str]:
-    rental = _rentals.get(rental_id)
+    if rental_state_machine.transition([rental_id], new_status):
+        return True, ""
+    return _transition_error(rental_id, new_status)
+
+
+def update_rentals_status(rental_ids: List[int], new_status: str, reason: str = "") -> List[Dict[str, Any]]:
+    """Move many rentals to a new status in one transaction; returns the moved rows."""
+    return rental_state_machine.transition(rental_ids, new_status, reason=reason)
+
+
+def _transition_error(rental_id: int, new_status: str) -> Tuple[bool, str]:
+    rental = rental_store.get(rental_id)
     if not rental:
         return False, "rental not found"
-    rental["status"] = new_status
-    return True, ""
+    if rental.get("status") == new_status:
+        return True, ""
+    return False, f"invalid transition {rental.get('status')} -> {new_status}"
 
 
 def get_rentals_by_status(status: str) -> List[Dict[str, Any]]:
-    return [r for r in _rentals.values() if r.get("status") == status]
+    return rental_store.get_by_status(status)
 
 
 def get_rentals_expiring_soon(hours: int) -> List[Dict[str, Any]]:
-    upcoming = []
     threshold = datetime.now() + timedelta(hours=hours)
-    for r in _rentals.values():
-        end_time = r.get("end_time")
-        if end_time and end_time <= threshold and r.get("status") in [
-            Constants.RENTAL_STATUS_ACTIVE,
-            Constants.RENTAL_STATUS_MONITORING,
-            Constants.RENTAL_STATUS_EXPIRING,
-        ]:
-            upcoming.append(r)
-    return upcoming
+    return rental_store.get_ending_before(threshold, [
+        Constants.RENTAL_STATUS_ACTIVE,
+        Constants.RENTAL_STATUS_MONITORING,
+        Constants.RENTAL_STATUS_EXPIRING,
+    ])
 
 
 async def expire_rental(rental_id: int) -> Tuple[bool, str]:
-    rental = _rentals.get(rental_id)
-    if not rental:
-        return False, "rental not found"
-    rental["status"] = Constants.RENTAL_STATUS_EXPIRED
-    return True, ""
+    return update_rental_status(rental_id, Constants.RENTAL_STATUS_EXPIRED)
+
+
+def expire_due_rentals() -> List[Dict[str, Any]]:
+    """Expire every running rental past its end_time in a single statement."""
+    return rental_state_machine.expire_due()
 
 
 async def replace_rental_asset(rental_id: int, new_asset_id: int, rank: int, tier: str) -> Tuple[bool, str]:
-    rental = _rentals.get(rental_id)
+    rental = rental_store.update(rental_id, asset_id=new_asset_id, rank=rank, tier=tier)
     if not rental:
         return False, "rental not found"
-    rental["asset_id"] = new_asset_id
-    rental["rank"] = rank
-    rental["tier"] = tier
     return True, ""
 
 
@@ -138,14 +147,7 @@ async def get_suitable_asset_for_keyword(keyword: str) -> Tuple[Optional[Dict[st
 
 
 def archive_expired_rentals(days_threshold: int = 0) -> int:
-    count = 0
-    now = datetime.now() - timedelta(days=days_threshold)
-    for r in list(_rentals.values()):
-        end = r.get("end_time")
-        if end and end < now and r.get("status") in [Constants.RENTAL_STATUS_EXPIRED, Constants.RENTAL_STATUS_CANCELED]:
-            r["status"] = Constants.RENTAL_STATUS_ARCHIVED
-            count += 1
-    return count
+    return rental_state_machine.archive_ended(datetime.now() - timedelta(days=days_threshold))
 
 
 class RentalManager:
@@ -179,12 +181,18 @@ class RentalManager:
     def update_rental_status(self, rental_id: int, new_status: str) -> Tuple[bool, str]:
         return update_rental_status(rental_id, new_status)
 
+    def update_rentals_status(self, rental_ids: List[int], new_status: str, reason: str = "") -> List[Dict[str, Any]]:
+        return update_rentals_status(rental_ids, new_status, reason)
+
     def get_rentals_expiring_soon(self, hours: int) -> List[Dict[str, Any]]:
         return get_rentals_expiring_soon(hours)
 
     async def expire_rental(self, rental_id: int) -> Tuple[bool, str]:
         return await expire_rental(rental_id)
 
+    def expire_due_rentals(self) -> List[Dict[str, Any]]:
+        return expire_due_rentals()
+
     async def replace_rental_asset(self, rental_id: int, new_asset_id: int, rank: int, tier: str) -> Tuple[bool, str]:
         return await replace_rental_asset(rental_id, new_asset_id, rank, tier)
 
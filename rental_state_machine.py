@@ -0,0 +1,215 @@
+"""
+מודול rental_state_machine - מכונת מצבים להשכרות עם מעברים מרוכזים בטרנזקציה אחת
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from db import get_connection
+from constants import Constants
+from rental_store import RENTAL_COLUMNS, rental_store
+
+logger = logging.getLogger(__name__)
+
+# מעברי סטטוס מותרים: {סטטוס נוכחי: {סטטוסים אפשריים}}
+ALLOWED_TRANSITIONS = {
+    Constants.RENTAL_STATUS_PENDING: {
+        Constants.RENTAL_STATUS_ACTIVE,
+        Constants.RENTAL_STATUS_CANCELED,
+        Constants.RENTAL_STATUS_EXPIRED,
+    },
+    Constants.RENTAL_STATUS_ACTIVE: {
+        Constants.RENTAL_STATUS_MONITORING,
+        Constants.RENTAL_STATUS_EXPIRING,
+        Constants.RENTAL_STATUS_EXPIRED,
+        Constants.RENTAL_STATUS_CANCELED,
+    },
+    Constants.RENTAL_STATUS_MONITORING: {
+        Constants.RENTAL_STATUS_ACTIVE,
+        Constants.RENTAL_STATUS_EXPIRING,
+        Constants.RENTAL_STATUS_EXPIRED,
+        Constants.RENTAL_STATUS_CANCELED,
+    },
+    Constants.RENTAL_STATUS_EXPIRING: {
+        Constants.RENTAL_STATUS_ACTIVE,  # הארכה
+        Constants.RENTAL_STATUS_EXPIRED,
+        Constants.RENTAL_STATUS_CANCELED,
+    },
+    Constants.RENTAL_STATUS_EXPIRED: {Constants.RENTAL_STATUS_ARCHIVED},
+    Constants.RENTAL_STATUS_CANCELED: {Constants.RENTAL_STATUS_ARCHIVED},
+    Constants.RENTAL_STATUS_ARCHIVED: set(),
+}
+
+# סטטוסים שבהם השכרה רצה ויכולה לפוג
+RUNNING_STATUSES = (
+    Constants.RENTAL_STATUS_ACTIVE,
+    Constants.RENTAL_STATUS_MONITORING,
+    Constants.RENTAL_STATUS_EXPIRING,
+)
+
+# מעבר סטטוס + רישום היסטוריה בשאילתה אחת. {source} היא שאילתת
+# SELECT id, status ... FOR UPDATE שבוחרת את ההשכרות למעבר
+_TRANSITION_QUERY = """
+    WITH prev AS (
+        {source}
+    ), upd AS (
+        UPDATE rentals r
+        SET status = %s{extra_set}, updated_at = NOW()
+        FROM prev
+        WHERE r.id = prev.id
+        RETURNING r.*, prev.status AS previous_status
+    ), hist AS (
+        INSERT INTO rental_history (rental_id, action, old_status, new_status, notes, created_at)
+        SELECT id, 'status_change', previous_status, status, %s, NOW()
+        FROM upd
+    )
+    SELECT * FROM upd
+"""
+
+
+class RentalStateMachine:
+    """
+    מכונת מצבים להשכרות - כל שינוי סטטוס עובר כאן, מאומת מול
+    ALLOWED_TRANSITIONS ונרשם ל-rental_history באותה טרנזקציה
+    """
+
+    @staticmethod
+    def can_transition(from_status: str, to_status: str) -> bool:
+        """
+        בודק אם מעבר סטטוס מותר
+
+        Args:
+            from_status: סטטוס נוכחי
+            to_status: סטטוס יעד
+
+        Returns:
+            האם המעבר מותר
+        """
+        return to_status in ALLOWED_TRANSITIONS.get(from_status, set())
+
+    @staticmethod
+    def sources_for(to_status: str) -> List[str]:
+        """
+        מחזיר את הסטטוסים שמהם מותר לעבור לסטטוס היעד
+
+        Args:
+            to_status: סטטוס יעד
+
+        Returns:
+            רשימת סטטוסי מקור
+        """
+        return [status for status, targets in ALLOWED_TRANSITIONS.items() if to_status in targets]
+
+    def _run(self, source: str, source_params: tuple, to_status: str,
+             reason: str, fields: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        מריץ מעבר סטטוס מרוכז ומעדכן את אינדקס ההשכרות
+
+        Args:
+            source: שאילתת בחירת ההשכרות (id, status) עם FOR UPDATE
+            source_params: פרמטרים לשאילתת הבחירה
+            to_status: סטטוס יעד
+            reason: סיבת המעבר לתיעוד בהיסטוריה
+            fields: עמודות נוספות לעדכון באותו מעבר
+
+        Returns:
+            רשימת ההשכרות שעברו (כולל previous_status)
+        """
+        extra = {k: v for k, v in fields.items() if k in RENTAL_COLUMNS and k != "status"}
+        extra_set = "".join(f", {key} = %s" for key in extra)
+        query = _TRANSITION_QUERY.format(source=source, extra_set=extra_set)
+        params = source_params + (to_status,) + tuple(extra.values()) + (reason,)
+
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    rows = [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה במעבר השכרות לסטטוס {to_status}: {str(e)}")
+            return []
+
+        rental_store.apply_rows(rows)
+        if rows:
+            logger.info(f"{len(rows)} השכרות עברו לסטטוס {to_status} ({reason})")
+        return rows
+
+    def transition(self, rental_ids: Iterable[int], to_status: str,
+                   reason: str = "", **fields) -> List[Dict[str, Any]]:
+        """
+        מעביר קבוצת השכרות לסטטוס חדש בטרנזקציה אחת
+
+        השכרות שהמעבר עבורן אינו חוקי מדולגות בשקט.
+
+        Args:
+            rental_ids: מזהי ההשכרות
+            to_status: סטטוס יעד
+            reason: סיבת המעבר
+            **fields: עמודות נוספות לעדכון (למשל end_time בהפעלה)
+
+        Returns:
+            רשימת ההשכרות שעברו בפועל
+        """
+        ids = list(rental_ids)
+        sources = self.sources_for(to_status)
+        if not ids or not sources:
+            return []
+
+        source = """
+            SELECT id, status FROM rentals
+            WHERE id = ANY(%s) AND status = ANY(%s)
+            FOR UPDATE
+        """
+        return self._run(source, (ids, sources), to_status, reason, fields)
+
+    def expire_due(self, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        מסיים את כל ההשכרות הרצות שזמן הסיום שלהן עבר - UPDATE יחיד
+
+        Args:
+            now: זמן הייחוס (ברירת מחדל - עכשיו)
+
+        Returns:
+            רשימת ההשכרות שפג תוקפן
+        """
+        source = """
+            SELECT id, status FROM rentals
+            WHERE status = ANY(%s) AND end_time < %s
+            FOR UPDATE SKIP LOCKED
+        """
+        return self._run(
+            source,
+            (list(RUNNING_STATUSES), now or datetime.now()),
+            Constants.RENTAL_STATUS_EXPIRED,
+            "end_time_passed",
+            {},
+        )
+
+    def archive_ended(self, before: datetime) -> int:
+        """
+        מעביר לארכיון השכרות שהסתיימו או בוטלו לפני זמן מסוים
+
+        Args:
+            before: זמן סיום מקסימלי לארכוב
+
+        Returns:
+            מספר ההשכרות שהועברו לארכיון
+        """
+        source = """
+            SELECT id, status FROM rentals
+            WHERE status = ANY(%s) AND end_time < %s
+            FOR UPDATE SKIP LOCKED
+        """
+        rows = self._run(
+            source,
+            ([Constants.RENTAL_STATUS_EXPIRED, Constants.RENTAL_STATUS_CANCELED], before),
+            Constants.RENTAL_STATUS_ARCHIVED,
+            "archive",
+            {},
+        )
+        return len(rows)
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+rental_state_machine = RentalStateMachine()
@@ -0,0 +1,378 @@
+"""
+מודול rental_store - מאגר השכרות מבוסס מסד נתונים עם אינדקס בזיכרון
+"""
+
+import bisect
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from db import get_connection
+from constants import Constants
+
+logger = logging.getLogger(__name__)
+
+# סטטוסים "חיים" - רק הם נשמרים באינדקס שבזיכרון
+LIVE_STATUSES = (
+    Constants.RENTAL_STATUS_PENDING,
+    Constants.RENTAL_STATUS_ACTIVE,
+    Constants.RENTAL_STATUS_MONITORING,
+    Constants.RENTAL_STATUS_EXPIRING,
+)
+
+# עמודות שמותר לכתוב לטבלת rentals
+RENTAL_COLUMNS = (
+    "user_telegram_id",
+    "keyword",
+    "asset_id",
+    "rank",
+    "tier",
+    "price",
+    "status",
+    "payment_id",
+    "start_time",
+    "end_time",
+    "duration_hours",
+)
+
+# שאילתת בסיס לקריאת השכרות יחד עם פרטי הנכס
+_SELECT_RENTALS = """
+    SELECT r.*, a.name AS asset_name, a.type AS asset_type
+    FROM rentals r
+    LEFT JOIN assets a ON a.id = r.asset_id
+"""
+
+
+class RentalStore:
+    """
+    מאגר השכרות על טבלת rentals עם אינדקס write-through בזיכרון
+
+    האינדקס מחזיק רק השכרות בסטטוס חי, ממוינות לפי סטטוס וזמן סיום,
+    כך ששאילתות סטטוס ותפוגה אינן סורקות את כל ההשכרות שנוצרו אי פעם.
+    """
+
+    def __init__(self):
+        """
+        יוצר מאגר השכרות חדש (האינדקס נטען בעצלות בשימוש הראשון)
+        """
+        self._lock = threading.RLock()
+        self._loaded = False
+        # {rental_id: rental}
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        # {status: {rental_id, ...}}
+        self._by_status: Dict[str, Set[int]] = {status: set() for status in LIVE_STATUSES}
+        # רשימה ממוינת של (end_time, rental_id)
+        self._by_end: List[Tuple[datetime, int]] = []
+
+    @staticmethod
+    def _normalize(row: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        ממיר שורת DB למילון השכרה
+
+        Args:
+            row: שורה מטבלת rentals
+
+        Returns:
+            מילון השכרה (user_id הוא מזהה הטלגרם של הלקוח)
+        """
+        rental = dict(row)
+        rental["user_id"] = rental.get("user_telegram_id")
+        return rental
+
+    def _ensure_loaded(self):
+        """
+        טוען את ההשכרות החיות מהמסד לאינדקס (פעם אחת)
+        """
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with get_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            _SELECT_RENTALS + " WHERE r.status = ANY(%s)",
+                            (list(LIVE_STATUSES),),
+                        )
+                        for row in cur.fetchall():
+                            self._index(self._normalize(row))
+                self._loaded = True
+                logger.info(f"אינדקס השכרות נטען: {len(self._by_id)} השכרות חיות")
+            except Exception as e:
+                logger.error(f"שגיאה בטעינת אינדקס השכרות: {str(e)}")
+
+    def _index(self, rental: Dict[str, Any]):
+        """
+        מעדכן את האינדקס עבור השכרה (מוסיף, מעדכן או מסיר)
+
+        Args:
+            rental: פרטי ההשכרה העדכניים
+        """
+        with self._lock:
+            rental_id = rental["id"]
+            previous = self._by_id.get(rental_id)
+            if previous:
+                self._unindex(previous)
+
+            if rental.get("status") not in LIVE_STATUSES:
+                return
+
+            if previous:
+                # שמור שדות שאינם עמודות (למשל asset_name) מהגרסה הקודמת
+                merged = dict(previous)
+                if previous.get("asset_id") != rental.get("asset_id"):
+                    # הנכס הוחלף - שדות התצוגה של הנכס הקודם כבר לא נכונים
+                    merged.pop("asset_name", None)
+                    merged.pop("asset_type", None)
+                merged.update(rental)
+                rental = merged
+
+            self._by_id[rental_id] = rental
+            self._by_status[rental["status"]].add(rental_id)
+            if rental.get("end_time"):
+                bisect.insort(self._by_end, (rental["end_time"], rental_id))
+
+    def _unindex(self, rental: Dict[str, Any]):
+        """
+        מסיר השכרה מהאינדקס
+
+        Args:
+            rental: פרטי ההשכרה כפי שנשמרו באינדקס
+        """
+        rental_id = rental["id"]
+        self._by_id.pop(rental_id, None)
+        self._by_status.get(rental.get("status"), set()).discard(rental_id)
+
+        end_time = rental.get("end_time")
+        if end_time:
+            pos = bisect.bisect_left(self._by_end, (end_time, rental_id))
+            if pos < len(self._by_end) and self._by_end[pos] == (end_time, rental_id):
+                del self._by_end[pos]
+
+    def apply_rows(self, rows: Iterable[Dict[str, Any]]):
+        """
+        מעדכן את האינדקס לפי שורות שנכתבו למסד בקוד אחר
+
+        Args:
+            rows: שורות rentals עדכניות (למשל מ-UPDATE ... RETURNING)
+        """
+        for row in rows:
+            self._index(self._normalize(row))
+
+    def insert(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        יוצר השכרה חדשה במסד ובאינדקס
+
+        Args:
+            data: שדות ההשכרה
+
+        Returns:
+            ההשכרה שנוצרה או None אם נכשל
+        """
+        self._ensure_loaded()
+
+        fields = {k: data[k] for k in RENTAL_COLUMNS if k in data}
+        if "user_telegram_id" not in fields and data.get("user_id") is not None:
+            fields["user_telegram_id"] = data["user_id"]
+        fields.setdefault("status", Constants.RENTAL_STATUS_PENDING)
+
+        columns = ", ".join(fields)
+        placeholders = ", ".join(["%s"] * len(fields))
+
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        INSERT INTO rentals ({columns}, created_at)
+                        VALUES ({placeholders}, NOW())
+                        RETURNING *
+                    """, tuple(fields.values()))
+                    row = cur.fetchone()
+        except Exception as e:
+            logger.error(f"שגיאה ביצירת השכרה: {str(e)}")
+            return None
+
+        rental = self._normalize(row)
+        # שדות תצוגה שאינם עמודות נשמרים רק באינדקס
+        for key in ("asset_name", "asset_type"):
+            if key in data:
+                rental[key] = data[key]
+        self._index(rental)
+        return rental
+
+    def get(self, rental_id: int) -> Optional[Dict[str, Any]]:
+        """
+        מקבל השכרה לפי מזהה (מהאינדקס ואם לא נמצאה - מהמסד)
+
+        Args:
+            rental_id: מזהה ההשכרה
+
+        Returns:
+            פרטי ההשכרה או None אם לא נמצאה
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            rental = self._by_id.get(rental_id)
+            if rental:
+                return dict(rental)
+
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(_SELECT_RENTALS + " WHERE r.id = %s", (rental_id,))
+                    row = cur.fetchone()
+                    return self._normalize(row) if row else None
+        except Exception as e:
+            logger.error(f"שגיאה בקבלת השכרה {rental_id}: {str(e)}")
+            return None
+
+    def update(self, rental_id: int, **fields) -> Optional[Dict[str, Any]]:
+        """
+        מעדכן שדות של השכרה במסד ובאינדקס
+
+        Args:
+            rental_id: מזהה ההשכרה
+            **fields: שדות לעדכון (רק עמודות מ-RENTAL_COLUMNS)
+
+        Returns:
+            ההשכרה המעודכנת או None אם לא נמצאה או שהעדכון נכשל
+        """
+        self._ensure_loaded()
+
+        updates = {k: v for k, v in fields.items() if k in RENTAL_COLUMNS}
+        if not updates:
+            return self.get(rental_id)
+
+        set_clause = ", ".join(f"{key} = %s" for key in updates)
+
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    # מחזירים גם את פרטי הנכס - asset_id עשוי להשתנות (החלפת נכס)
+                    cur.execute(f"""
+                        WITH updated AS (
+                            UPDATE rentals
+                            SET {set_clause}, updated_at = NOW()
+                            WHERE id = %s
+                            RETURNING *
+                        )
+                        SELECT u.*, a.name AS asset_name, a.type AS asset_type
+                        FROM updated u
+                        LEFT JOIN assets a ON a.id = u.asset_id
+                    """, tuple(updates.values()) + (rental_id,))
+                    row = cur.fetchone()
+        except Exception as e:
+            logger.error(f"שגיאה בעדכון השכרה {rental_id}: {str(e)}")
+            return None
+
+        if not row:
+            return None
+
+        rental = self._normalize(row)
+        self._index(rental)
+        return self.get(rental_id) if rental["status"] in LIVE_STATUSES else rental
+
+    def get_by_status(self, status: str) -> List[Dict[str, Any]]:
+        """
+        מקבל השכרות לפי סטטוס
+
+        Args:
+            status: סטטוס ההשכרה
+
+        Returns:
+            רשימת השכרות ממוינת לפי זמן סיום
+        """
+        if status in LIVE_STATUSES:
+            self._ensure_loaded()
+            with self._lock:
+                rentals = [dict(self._by_id[rid]) for rid in self._by_status[status]]
+            rentals.sort(key=lambda r: (r.get("end_time") is None, r.get("end_time") or datetime.min))
+            return rentals
+
+        # סטטוסים סופיים אינם באינדקס - סריקת טווח על (status, end_time)
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        _SELECT_RENTALS + " WHERE r.status = %s ORDER BY r.end_time ASC",
+                        (status,),
+                    )
+                    return [self._normalize(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בקבלת השכרות בסטטוס {status}: {str(e)}")
+            return []
+
+    def get_ending_before(self, threshold: datetime,
+                          statuses: Iterable[str] = LIVE_STATUSES) -> List[Dict[str, Any]]:
+        """
+        מקבל השכרות חיות שזמן הסיום שלהן עד סף מסוים
+
+        Args:
+            threshold: זמן הסף
+            statuses: סטטוסים לסינון (מתוך הסטטוסים החיים)
+
+        Returns:
+            רשימת השכרות ממוינת לפי זמן סיום
+        """
+        self._ensure_loaded()
+        wanted = set(statuses)
+
+        with self._lock:
+            end = bisect.bisect_right(self._by_end, (threshold, float("inf")))
+            return [
+                dict(self._by_id[rid])
+                for _, rid in self._by_end[:end]
+                if self._by_id[rid].get("status") in wanted
+            ]
+
+    def get_by_user(self, user_telegram_id: int,
+                    statuses: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        מקבל השכרות של משתמש (סריקת טווח על (user_telegram_id, status))
+
+        Args:
+            user_telegram_id: מזהה טלגרם של המשתמש
+            statuses: סטטוסים לסינון (אופציונלי)
+
+        Returns:
+            רשימת השכרות מהחדשה לישנה
+        """
+        query = _SELECT_RENTALS + " WHERE r.user_telegram_id = %s"
+        params: List[Any] = [user_telegram_id]
+        if statuses:
+            query += " AND r.status = ANY(%s)"
+            params.append(list(statuses))
+        query += " ORDER BY r.created_at DESC"
+
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, tuple(params))
+                    return [self._normalize(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בקבלת השכרות למשתמש {user_telegram_id}: {str(e)}")
+            return []
+
+    def get_all(self) -> List[Dict[str, Any]]:
+        """
+        מקבל את כל ההשכרות מהמסד
+
+        Returns:
+            רשימת כל ההשכרות
+        """
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(_SELECT_RENTALS + " ORDER BY r.created_at DESC")
+                    return [self._normalize(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"שגיאה בקבלת כל ההשכרות: {str(e)}")
+            return []
+
+
+# יצירת אינסטנס לשימוש מחוץ למודול
+rental_store = RentalStore()
@@ -1,20 +1,63 @@
 # -*- coding: utf-8 -*-
-"""Session classification helpers."""
+"""Session classification helpers.
+
+A session is classified from its Telegram account: dialogs, owned or
+administered channels and contacts. The result and its evidence are cached
+in ``session_classifications`` with a TTL, so periodic reclassification only
+re-probes stale sessions.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+from telethon import TelegramClient, functions
+from telethon.sessions import StringSession
 
 from constants import Constants
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+API_ID = int(os.getenv("API_ID", "0"))
+API_HASH = os.getenv("API_HASH", "")
+
+# number of dialogs inspected per session
+DIALOGS_LIMIT = 200
+
+# Telegram service accounts (service notifications, legacy notifications)
+SERVICE_USER_IDS = {777000, 42777}
+
+
+def is_service_user(entity: Any) -> bool:
+    """Return True for Telegram service/support accounts.
+
+    Almost every account has a dialog with the service notifications user, so
+    these never count as interactions.
+    """
+    return (
+        getattr(entity, "id", None) in SERVICE_USER_IDS
+        or getattr(entity, "support", False)
+        or getattr(entity, "verified", False)
+    )
 
 
 class SessionClassifier:
-    """Very light session classifier used for placeholder operations."""
+    """Classify sessions as clean / dirty / manager from their Telegram account."""
 
     @staticmethod
     def is_clean(session_string: str) -> bool:
         """Determine if the given session can be considered clean.
 
-        The placeholder implementation simply checks for a keyword in the
-        session string. Real implementations would inspect the Telegram
-        account's history via Telethon.
+        Uses the cached classification when the session is known; otherwise
+        falls back to the legacy keyword check.
         """
+        cached = SessionClassifier.get_cached_by_string(session_string)
+        if cached:
+            return cached["session_type"] == Constants.SESSION_TYPE_CLEAN
         return "clean" in session_string.lower()
 
     @staticmethod
@@ -24,3 +67,192 @@ class SessionClassifier:
             return Constants.SESSION_TYPE_CLEAN
         return Constants.SESSION_TYPE_DIRTY
 
+    @staticmethod
+    def role_for(evidence: Dict[str, Any]) -> str:
+        """Map probe evidence to a session type.
+
+        Owning or administering an asset makes a session MANAGER regardless of
+        its interactions; otherwise interactions decide between CLEAN and DIRTY.
+        """
+        if evidence.get("owned") or evidence.get("admin_of"):
+            return Constants.SESSION_TYPE_MANAGER
+        has_interactions = evidence.get("user_dialogs", 0) > 0 or evidence.get("contacts", 0) > 0
+        if not has_interactions:
+            return Constants.SESSION_TYPE_CLEAN
+        return Constants.SESSION_TYPE_DIRTY
+
+    @staticmethod
+    async def classify_client(client: TelegramClient) -> Tuple[str, Dict[str, Any]]:
+        """Probe an already connected client and return (session_type, evidence).
+
+        Dialogs, admined public channels and contacts are fetched concurrently.
+        Bots, the account itself and Telegram service accounts are not counted
+        as interactions.
+        """
+        dialogs, admined, contacts = await asyncio.gather(
+            client.get_dialogs(limit=DIALOGS_LIMIT),
+            client(functions.channels.GetAdminedPublicChannelsRequest()),
+            client(functions.contacts.GetContactsRequest(hash=0)),
+        )
+
+        owned = set()
+        admin_of = set()
+        user_dialogs = 0
+        for dialog in dialogs:
+            entity = dialog.entity
+            if (dialog.is_user and not getattr(entity, "bot", False)
+                    and not getattr(entity, "is_self", False) and not is_service_user(entity)):
+                user_dialogs += 1
+            if getattr(entity, "creator", False):
+                owned.add(entity.id)
+            elif getattr(entity, "admin_rights", None):
+                admin_of.add(entity.id)
+
+        for chat in getattr(admined, "chats", []):
+            if getattr(chat, "creator", False):
+                owned.add(chat.id)
+            else:
+                admin_of.add(chat.id)
+
+        evidence = {
+            "dialogs": len(dialogs),
+            "user_dialogs": user_dialogs,
+            "contacts": sum(1 for user in getattr(contacts, "users", []) or []
+                            if not is_service_user(user)),
+            "owned": sorted(owned),
+            "admin_of": sorted(admin_of - owned),
+        }
+        return SessionClassifier.role_for(evidence), evidence
+
+    @staticmethod
+    async def classify_session(session: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Connect once with a stored session row and classify it."""
+        proxy = None
+        if session.get("id"):
+            from proxy_manager import proxy_manager
+            proxy = proxy_manager.get_proxy_for_session(session["id"])
+
+        client = TelegramClient(
+            StringSession(session["session_string"]),
+            api_id=session.get("api_id") or API_ID,
+            api_hash=session.get("api_hash") or API_HASH,
+            proxy=proxy,
+        )
+        await client.connect()
+        try:
+            return await SessionClassifier.classify_client(client)
+        finally:
+            await client.disconnect()
+
+    @staticmethod
+    async def classify_many(sessions: Iterable[Dict[str, Any]],
+                            concurrency: int = 10) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """Classify sessions concurrently and store the results.
+
+        Returns a list of (session_id, session_type, evidence) for the
+        sessions that were probed successfully.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(session):
+            async with semaphore:
+                try:
+                    session_type, evidence = await SessionClassifier.classify_session(session)
+                    return session["session_id"], session_type, evidence
+                except Exception as e:
+                    logger.error(f"Failed to classify session {session.get('session_id')}: {e}")
+                    return None
+
+        results = [r for r in await asyncio.gather(*(probe(s) for s in sessions)) if r]
+        SessionClassifier.save_classifications(results)
+        return results
+
+    @staticmethod
+    async def reclassify_stale(concurrency: int = 10) -> int:
+        """Re-probe only sessions whose classification is missing or expired."""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT s.*
+                        FROM sessions s
+                        LEFT JOIN session_classifications c ON c.session_id = s.session_id
+                        WHERE c.session_id IS NULL OR c.expires_at < NOW()
+                    """)
+                    stale = [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to load stale sessions: {e}")
+            return 0
+
+        if not stale:
+            return 0
+
+        results = await SessionClassifier.classify_many(stale, concurrency)
+        logger.info(f"Reclassified {len(results)} of {len(stale)} stale sessions")
+        return len(results)
+
+    @staticmethod
+    def upsert_classifications(cur, results: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        """Write classifications and session types using an open cursor."""
+        if not results:
+            return
+        execute_values(cur, """
+            INSERT INTO session_classifications
+            (session_id, session_type, evidence, classified_at, expires_at)
+            VALUES %s
+            ON CONFLICT (session_id) DO UPDATE
+            SET session_type = EXCLUDED.session_type,
+                evidence = EXCLUDED.evidence,
+                classified_at = EXCLUDED.classified_at,
+                expires_at = EXCLUDED.expires_at
+        """, [
+            (session_id, session_type, json.dumps(evidence))
+            for session_id, session_type, evidence in results
+        ], template=(
+            "(%s, %s, %s::jsonb, NOW(), "
+            f"NOW() + INTERVAL '{int(Constants.SESSION_CLASSIFICATION_TTL)} seconds')"
+        ))
+        execute_values(cur, """
+            UPDATE sessions s
+            SET type = v.session_type
+            FROM (VALUES %s) AS v(session_id, session_type)
+            WHERE s.session_id = v.session_id
+        """, [(session_id, session_type) for session_id, session_type, _ in results])
+
+    @staticmethod
+    def save_classifications(results: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        """Store classifications in a single transaction."""
+        if not results:
+            return
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    SessionClassifier.upsert_classifications(cur, results)
+        except Exception as e:
+            logger.error(f"Failed to store session classifications: {e}")
+
+    @staticmethod
+    def get_cached_by_string(session_string: str) -> Optional[Dict[str, Any]]:
+        """Return a non-expired cached classification for a session string."""
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT c.session_type, c.evidence, c.classified_at
+                        FROM session_classifications c
+                        JOIN sessions s ON s.session_id = c.session_id
+                        WHERE s.session_string = %s AND c.expires_at > NOW()
+                    """, (session_string,))
+                    row = cur.fetchone()
+                    return dict(row) if row else None
+        except Exception:
+            return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler("reclassify_sessions.log"), logging.StreamHandler()],
+    )
+    asyncio.run(SessionClassifier.reclassify_stale())
@@ -1,9 +1,22 @@
 # -*- coding: utf-8 -*-
-"""Simple session management placeholder."""
+"""Simple session management placeholder.
 
+Sessions are handed out through priority lanes (customer > watchdog >
+warming). Each lane may only use the part of the pool that is not reserved
+for the lanes above it, and when a session is released the waiting lanes are
+served by smooth weighted round-robin using ``Constants.SESSION_LANE_WEIGHTS``.
+The caller's lane is taken from the ``session_lane`` context.
+"""
+
+import asyncio
 import logging
+import math
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
 from constants import Constants
 
@@ -13,6 +26,105 @@ logger = logging.getLogger(__name__)
 _sessions: List[Dict[str, any]] = []
 _next_id = 1
 
+LANE_CUSTOMER = "customer"
+LANE_WATCHDOG = "watchdog"
+LANE_WARMING = "warming"
+# highest priority first
+LANES = (LANE_CUSTOMER, LANE_WATCHDOG, LANE_WARMING)
+
+_current_lane: ContextVar[str] = ContextVar("session_lane", default=LANE_CUSTOMER)
+
+# {session_type: {lane: deque of (loop, future)}}
+_waiters: Dict[str, Dict[str, Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]]] = {}
+# smooth weighted round-robin state per lane
+_lane_credit: Dict[str, int] = {lane: 0 for lane in LANES}
+_lock = threading.RLock()
+
+
+@contextmanager
+def session_lane(lane: str) -> Iterator[None]:
+    """Request sessions in the given lane for the enclosed code."""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    """Return the lane of the current context."""
+    return _current_lane.get()
+
+
+def _lane_limit(total: int, lane: str) -> int:
+    """Sessions usable by a lane and the lanes below it together."""
+    reserved = sum(Constants.SESSION_LANE_RESERVED.get(higher, 0) for higher in LANES[:LANES.index(lane)])
+    # every lane can make progress, even on a pool too small to reserve from
+    return max(1, total - math.ceil(total * reserved))
+
+
+def _can_use(session_type: str, lane: str) -> bool:
+    below = LANES[LANES.index(lane):]
+    typed = [s for s in _sessions if s.get("type") == session_type]
+    in_use = sum(1 for s in typed if s.get("is_active") and s.get("lane", LANE_CUSTOMER) in below)
+    return in_use < _lane_limit(len(typed), lane)
+
+
+def _take_free(session_type: str, lane: str) -> Optional[Dict[str, any]]:
+    """Mark the least recently used free session as taken by the lane."""
+    free = [s for s in _sessions if s.get("type") == session_type and not s.get("is_active")]
+    if not free or not _can_use(session_type, lane):
+        return None
+    sess = min(free, key=lambda s: s.get("last_used", 0))
+    sess["is_active"] = True
+    sess["last_used"] = time.time()
+    sess["lane"] = lane
+    return sess
+
+
+def _next_lane(session_type: str) -> Optional[str]:
+    """Pick the next waiting lane by smooth weighted round-robin."""
+    if not any(s.get("type") == session_type and not s.get("is_active") for s in _sessions):
+        return None
+    lanes = _waiters.get(session_type, {})
+    eligible = [lane for lane in LANES if lanes.get(lane) and _can_use(session_type, lane)]
+    if not eligible:
+        return None
+    total_weight = 0
+    for lane in eligible:
+        weight = Constants.SESSION_LANE_WEIGHTS.get(lane, 1)
+        _lane_credit[lane] += weight
+        total_weight += weight
+    chosen = max(eligible, key=lambda lane: _lane_credit[lane])
+    _lane_credit[chosen] -= total_weight
+    return chosen
+
+
+def _deliver(future: asyncio.Future, sess: Dict[str, any]) -> None:
+    if future.done():
+        # the waiter timed out or was cancelled meanwhile
+        release_session(sess["id"])
+    else:
+        future.set_result(sess)
+
+
+def _dispatch(session_type: str) -> None:
+    """Hand released sessions to waiters."""
+    with _lock:
+        while True:
+            lane = _next_lane(session_type)
+            if lane is None:
+                return
+            queue = _waiters[session_type][lane]
+            loop, future = queue.popleft()
+            if future.done():
+                continue
+            sess = _take_free(session_type, lane)
+            if sess is None:
+                queue.appendleft((loop, future))
+                return
+            loop.call_soon_threadsafe(_deliver, future, sess)
+
 
 class Session:
     """Represents a Telegram session entry."""
@@ -35,22 +147,58 @@ def get_all_sessions() -> List[Dict[str, any]]:
     return list(_sessions)
 
 
-async def get_session(session_type: str) -> Optional[Dict[str, any]]:
-    """Retrieve an available session of the requested type."""
-    for sess in _sessions:
-        if sess.get("type") == session_type and not sess.get("is_active"):
-            sess["is_active"] = True
-            sess["last_used"] = time.time()
+async def get_session(session_type: str, lane: Optional[str] = None,
+                      timeout: float = Constants.SESSION_WAIT_TIMEOUT) -> Optional[Dict[str, any]]:
+    """Retrieve an available session of the requested type.
+
+    Waits up to ``timeout`` seconds for a session to be released when the
+    lane has no free capacity. Returns None if none becomes available.
+    """
+    lane = lane or _current_lane.get()
+    with _lock:
+        if not any(s.get("type") == session_type for s in _sessions):
+            return None
+        sess = _take_free(session_type, lane)
+        if sess:
             return sess
-    return None
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        _waiters.setdefault(session_type, {}).setdefault(lane, deque()).append((loop, future))
+
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"No {session_type} session available for lane {lane} after {timeout}s")
+        return None
 
 
 def release_session(session_id: int) -> None:
-    """Mark a session as no longer active."""
-    for sess in _sessions:
-        if sess.get("id") == session_id:
-            sess["is_active"] = False
-            break
+    """Mark a session as no longer active and hand it to the next waiter."""
+    session_type = None
+    with _lock:
+        for sess in _sessions:
+            if sess.get("id") == session_id:
+                sess["is_active"] = False
+                sess.pop("lane", None)
+                session_type = sess.get("type")
+                break
+    if session_type is not None:
+        _dispatch(session_type)
+
+
+def get_lane_stats() -> Dict[str, Dict[str, int]]:
+    """Return sessions in use and waiters per lane."""
+    with _lock:
+        return {
+            lane: {
+                "in_use": sum(1 for s in _sessions if s.get("is_active") and s.get("lane") == lane),
+                "waiting": sum(
+                    sum(1 for _, f in lanes.get(lane, ()) if not f.done())
+                    for lanes in _waiters.values()
+                ),
+            }
+            for lane in LANES
+        }
 
 
 def delete_session(session_id: int) -> Tuple[bool, str]:
@@ -81,6 +229,7 @@ def close_all_sessions() -> None:
     """Mark all sessions as inactive."""
     for sess in _sessions:
         sess["is_active"] = False
+        sess.pop("lane", None)
 
 
 # simple API to add sessions for placeholder/demo usage
@@ -95,6 +244,7 @@ def _add_session(session_string: str, session_type: str = Constants.SESSION_TYPE
     }
     _next_id += 1
     _sessions.append(sess)
+    _dispatch(session_type)
     return sess["id"]
 
 
@@ -103,8 +253,9 @@ class SessionManager:
     def __init__(self) -> None:
         pass
 
-    async def get_session(self, session_type: str) -> Optional[Dict[str, any]]:
-        return await get_session(session_type)
+    async def get_session(self, session_type: str, lane: Optional[str] = None,
+                          timeout: float = Constants.SESSION_WAIT_TIMEOUT) -> Optional[Dict[str, any]]:
+        return await get_session(session_type, lane, timeout)
 
     def release_session(self, session_id: int) -> None:
         release_session(session_id)
@@ -112,6 +263,9 @@ class SessionManager:
     def get_all_sessions(self) -> List[Dict[str, any]]:
         return get_all_sessions()
 
+    def get_lane_stats(self) -> Dict[str, Dict[str, int]]:
+        return get_lane_stats()
+
     def delete_session(self, session_id: int) -> Tuple[bool, str]:
         return delete_session(session_id)
 
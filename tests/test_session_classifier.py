@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Tests for SessionClassifier.role_for and classify_client."""
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from constants import Constants
+from session_classifier import SessionClassifier
+
+
+def evidence(user_dialogs=0, contacts=0, owned=(), admin_of=()):
+    return {
+        "dialogs": user_dialogs,
+        "user_dialogs": user_dialogs,
+        "contacts": contacts,
+        "owned": list(owned),
+        "admin_of": list(admin_of),
+    }
+
+
+class RoleForTest(unittest.TestCase):
+
+    def test_no_interactions_and_no_assets_is_clean(self):
+        self.assertEqual(SessionClassifier.role_for(evidence()), Constants.SESSION_TYPE_CLEAN)
+
+    def test_interactions_without_assets_is_dirty(self):
+        self.assertEqual(
+            SessionClassifier.role_for(evidence(user_dialogs=3)), Constants.SESSION_TYPE_DIRTY
+        )
+        self.assertEqual(
+            SessionClassifier.role_for(evidence(contacts=1)), Constants.SESSION_TYPE_DIRTY
+        )
+
+    def test_owner_without_dms_or_contacts_is_manager(self):
+        self.assertEqual(
+            SessionClassifier.role_for(evidence(owned=[1001])), Constants.SESSION_TYPE_MANAGER
+        )
+
+    def test_admin_without_dms_or_contacts_is_manager(self):
+        self.assertEqual(
+            SessionClassifier.role_for(evidence(admin_of=[2002])), Constants.SESSION_TYPE_MANAGER
+        )
+
+    def test_owner_with_interactions_is_manager(self):
+        self.assertEqual(
+            SessionClassifier.role_for(evidence(user_dialogs=5, contacts=2, owned=[1001])),
+            Constants.SESSION_TYPE_MANAGER,
+        )
+
+
+def user(user_id, **flags):
+    return SimpleNamespace(id=user_id, **flags)
+
+
+def dialog(entity, is_user=True):
+    return SimpleNamespace(entity=entity, is_user=is_user)
+
+
+class FakeClient:
+    """Answers the three requests issued by classify_client."""
+
+    def __init__(self, dialogs, contacts=(), admined=()):
+        self.dialogs = list(dialogs)
+        self.contacts = list(contacts)
+        self.admined = list(admined)
+
+    async def get_dialogs(self, limit=None):
+        return self.dialogs
+
+    async def __call__(self, request):
+        if type(request).__name__ == "GetContactsRequest":
+            return SimpleNamespace(users=self.contacts)
+        return SimpleNamespace(chats=self.admined)
+
+
+def classify(client):
+    return asyncio.run(SessionClassifier.classify_client(client))
+
+
+class ClassifyClientTest(unittest.TestCase):
+
+    def test_service_dialogs_and_contacts_are_not_interactions(self):
+        client = FakeClient(
+            dialogs=[
+                dialog(user(777000)),
+                dialog(user(42777)),
+                dialog(user(555, support=True)),
+                dialog(user(556, verified=True)),
+                dialog(user(1, is_self=True)),
+                dialog(user(2, bot=True)),
+            ],
+            contacts=[user(777000)],
+        )
+        session_type, found = classify(client)
+        self.assertEqual(session_type, Constants.SESSION_TYPE_CLEAN)
+        self.assertEqual(found["user_dialogs"], 0)
+        self.assertEqual(found["contacts"], 0)
+
+    def test_private_chat_with_a_user_is_dirty(self):
+        session_type, found = classify(FakeClient(dialogs=[dialog(user(777000)), dialog(user(123))]))
+        self.assertEqual(session_type, Constants.SESSION_TYPE_DIRTY)
+        self.assertEqual(found["user_dialogs"], 1)
+
+    def test_contact_is_dirty(self):
+        session_type, _ = classify(FakeClient(dialogs=[], contacts=[user(123)]))
+        self.assertEqual(session_type, Constants.SESSION_TYPE_DIRTY)
+
+    def test_owned_channel_is_manager(self):
+        channel = SimpleNamespace(id=1001, creator=True)
+        client = FakeClient(dialogs=[dialog(channel, is_user=False), dialog(user(123))],
+                            admined=[SimpleNamespace(id=2002, creator=False)])
+        session_type, found = classify(client)
+        self.assertEqual(session_type, Constants.SESSION_TYPE_MANAGER)
+        self.assertEqual(found["owned"], [1001])
+        self.assertEqual(found["admin_of"], [2002])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,7 +11,7 @@ from constants import Constants
 from command_router import command_router
 from db import execute_query
 from user_manager import user_manager
-from rank_engine import rank_engine
+from rank_jobs import rank_jobs, KIND_FIND_BEST, PRIORITY_INTERACTIVE
 from assets_manager import assets_manager
 from notifications import notification_manager
 from rental_manager import rental_manager
@@ -85,8 +85,25 @@ async def process_check_keyword(message: types.Message, keyword: str):
     # שליחת הודעת המתנה
     wait_message = await message.reply("מחפש את הדירוג הטוב ביותר עבור המילה...", parse_mode="HTML")
     
-    # חיפוש נכסים מתאימים וקבלת דירוג
-    results = await rank_engine.find_best_assets_for_keyword(keyword)
+    found = []
+    
+    async def show_progress(progress):
+        # עדכון הודעת ההמתנה עם כל דירוג שמתקבל
+        if progress.get("result"):
+            found.append(progress["result"])
+        lines = [f"מחפש את הדירוג הטוב ביותר עבור המילה <b>{keyword}</b>... ({progress['done']}/{progress['total']})"]
+        for result in sorted(found, key=lambda r: r["rank"]):
+            lines.append(f"• {result['name']} - דירוג {result['rank']}")
+        await wait_message.edit_text("\n".join(lines), parse_mode="HTML")
+    
+    # חיפוש נכסים מתאימים וקבלת דירוג - כעבודת רקע (בקשה זהה שכבר רצה מצטרפת אליה)
+    try:
+        results = await rank_jobs.run(
+            KIND_FIND_BEST, {"keyword": keyword}, PRIORITY_INTERACTIVE, progress_callback=show_progress
+        )
+    except Exception as e:
+        logger.error(f"שגיאה בבדיקת מילת מפתח '{keyword}' עבור {user_id}: {str(e)}")
+        results = []
     
     if not results or len(results) == 0:
         await wait_message.edit_text(
@@ -104,7 +121,7 @@ async def process_check_keyword(message: types.Message, keyword: str):
     regular_assets = []
     
     for result in results:
-        asset_data = result.get("asset", {})
+        asset_data = result.get("asset") or result
         rank = result.get("rank", -1)
         tier = result.get("tier", Constants.TIER_REGULAR)
         
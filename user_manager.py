@@ -3,7 +3,10 @@
 """
 
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime
 
 from constants import Constants
@@ -13,6 +16,71 @@ logger = logging.getLogger(__name__)
 # זיכרון זמני למשתמשים כשאין DB
 temp_users = {}
 
+# מטמון פרופילי משתמשים {telegram_id: (תוקף, משתמש)} - LRU עם TTL
+_user_cache: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+# מנהלים מטבלת users (בנוסף ל-Constants.ADMIN_IDS); None - טרם נטען
+_admin_ids: Optional[Set[int]] = None
+_admin_ids_loaded_at = 0.0
+
+def _cache_get(telegram_id: int) -> Optional[Dict[str, Any]]:
+    with _user_cache_lock:
+        cached = _user_cache.get(telegram_id)
+        if cached is None:
+            return None
+        expires_at, user = cached
+        if expires_at < time.monotonic():
+            del _user_cache[telegram_id]
+            return None
+        _user_cache.move_to_end(telegram_id)
+        # עותק - כדי ששינוי אצל הקורא לא ישנה את המטמון
+        return dict(user)
+
+def _cache_put(telegram_id: int, user: Dict[str, Any]) -> None:
+    with _user_cache_lock:
+        _user_cache[telegram_id] = (time.monotonic() + Constants.USER_CACHE_TTL, dict(user))
+        _user_cache.move_to_end(telegram_id)
+        while len(_user_cache) > Constants.USER_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
+
+def invalidate_user(telegram_id: int) -> None:
+    """
+    מסיר משתמש ממטמון הפרופילים (אחרי כל שינוי בשורה שלו)
+    
+    Args:
+        telegram_id: מזהה טלגרם של המשתמש
+    """
+    with _user_cache_lock:
+        _user_cache.pop(telegram_id, None)
+
+def load_admin_ids(force: bool = False) -> Optional[Set[int]]:
+    """
+    טוען את קבוצת המנהלים מטבלת users (נשמרת בזיכרון ל-ADMIN_CACHE_TTL)
+    
+    Args:
+        force: האם לטעון מחדש גם אם הקבוצה בתוקף
+        
+    Returns:
+        קבוצת מזהי הטלגרם של המנהלים, או None אם לא ניתן לטעון
+    """
+    global _admin_ids, _admin_ids_loaded_at
+    
+    if not force and _admin_ids is not None and \
+            time.monotonic() - _admin_ids_loaded_at < Constants.ADMIN_CACHE_TTL:
+        return _admin_ids
+    
+    try:
+        from db import execute_query
+        result = execute_query("SELECT telegram_id FROM users WHERE is_admin = TRUE")
+        if result is not None:
+            _admin_ids = {row['telegram_id'] for row in result}
+            _admin_ids_loaded_at = time.monotonic()
+    except Exception as e:
+        logger.warning(f"DB לא זמין, לא ניתן לטעון רשימת מנהלים: {e}")
+    
+    return _admin_ids
+
 def get_user_by_telegram_id(telegram_id: int) -> Dict[str, Any]:
     """
     קבלת משתמש לפי מזהה טלגרם
@@ -23,6 +91,10 @@ def get_user_by_telegram_id(telegram_id: int) -> Dict[str, Any]:
     Returns:
         פרטי המשתמש או None אם לא נמצא
     """
+    cached = _cache_get(telegram_id)
+    if cached is not None:
+        return cached
+    
     try:
         from db import execute_query
         query = """
@@ -32,6 +104,7 @@ def get_user_by_telegram_id(telegram_id: int) -> Dict[str, Any]:
         result = execute_query(query, (telegram_id,))
         
         if result and len(result) > 0:
+            _cache_put(telegram_id, result[0])
             return result[0]
     except Exception as e:
         logger.warning(f"DB לא זמין, משתמש בזיכרון זמני: {e}")
@@ -55,26 +128,42 @@ def create_user(telegram_id: int, username: str, first_name: str,
     Returns:
         פרטי המשתמש החדש
     """
-    # בדיקה אם המשתמש כבר קיים
-    existing_user = get_user_by_telegram_id(telegram_id)
+    # משתמש מוכר מהמטמון - אין צורך לגשת למסד
+    existing_user = _cache_get(telegram_id)
     if existing_user:
         return existing_user
     
     try:
-        from db import execute_query
-        # יצירת משתמש חדש בDB
+        from db import get_connection
+        # יצירת המשתמש או החזרת הקיים בפקודה אחת (דורש add_users_telegram_id_unique.sql)
         query = """
-        INSERT INTO users (telegram_id, username, first_name, last_name, language_code)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING *
+        WITH inserted AS (
+            INSERT INTO users (telegram_id, username, first_name, last_name, language_code)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (telegram_id) DO NOTHING
+            RETURNING *, TRUE AS created
+        )
+        SELECT * FROM inserted
+        UNION ALL
+        SELECT *, FALSE AS created FROM users WHERE telegram_id = %s
+        LIMIT 1
         """
         
-        params = (telegram_id, username or "", first_name or "", last_name or "", language_code or "en")
-        result = execute_query(query, params)
+        params = (telegram_id, username or "", first_name or "", last_name or "", language_code or "en", telegram_id)
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                row = cur.fetchone()
         
-        if result and len(result) > 0:
+        if row is None:
+            # המשתמש נוצר במקביל בטרנזקציה אחרת אחרי תחילת הפקודה
+            return get_user_by_telegram_id(telegram_id)
+        
+        user = dict(row)
+        if user.pop('created'):
             logger.info(f"נוצר משתמש חדש בDB: {telegram_id} - {first_name} {last_name}")
-            return result[0]
+        _cache_put(telegram_id, user)
+        return user
     except Exception as e:
         logger.warning(f"DB לא זמין, יוצר משתמש בזיכרון זמני: {e}")
         # fallback לזיכרון זמני
@@ -134,6 +223,13 @@ def update_user(telegram_id: int, **kwargs) -> bool:
         params.append(telegram_id)
         result = execute_query(query, tuple(params))
         
+        invalidate_user(telegram_id)
+        if 'is_admin' in kwargs and _admin_ids is not None:
+            if kwargs['is_admin']:
+                _admin_ids.add(telegram_id)
+            else:
+                _admin_ids.discard(telegram_id)
+        
         return result is not None
     except Exception as e:
         logger.warning(f"DB לא זמין, מעדכן בזיכרון זמני: {e}")
@@ -168,6 +264,9 @@ def update_user_balance(telegram_id: int, amount: float, transaction_type: str =
     """
     עדכון יתרת משתמש ותיעוד עסקה
     
+    העדכון והעסקה נכתבים בפקודה אחת: היתרה מחושבת במסד (balance + amount)
+    תחת נעילת השורה, כך שתשלומים והחזרים במקביל לא דורסים זה את זה.
+    
     Args:
         telegram_id: מזהה טלגרם של המשתמש
         amount: סכום לעדכון (חיובי להפקדה, שלילי למשיכה)
@@ -178,55 +277,132 @@ def update_user_balance(telegram_id: int, amount: float, transaction_type: str =
     Returns:
         האם העדכון הצליח ויתרה חדשה
     """
-    # קבלת פרטי המשתמש
-    user = get_user_by_telegram_id(telegram_id)
-    if not user:
-        logger.error(f"ניסיון לעדכן יתרה של משתמש לא קיים: {telegram_id}")
-        return False, 0.0
-    
-    # חישוב יתרה חדשה
-    current_balance = float(user['balance']) if user['balance'] is not None else 0.0
-    new_balance = current_balance + amount
-    
     try:
-        from db import execute_transaction
-        # עדכון יתרה ותיעוד העסקה
-        queries = [
-            {
-                'query': """
-                UPDATE users SET balance = %s, updated_at = NOW()
-                WHERE telegram_id = %s
-                """,
-                'params': (new_balance, telegram_id)
-            },
-            {
-                'query': """
-                INSERT INTO transactions 
-                (user_id, user_telegram_id, amount, transaction_type, rental_id, notes)
-                VALUES 
-                ((SELECT id FROM users WHERE telegram_id = %s), %s, %s, %s, %s, %s)
-                """,
-                'params': (telegram_id, telegram_id, amount, transaction_type, rental_id, notes)
-            }
-        ]
-        
-        success = execute_transaction(queries)
-        
-        if success:
-            logger.info(f"עודכנה יתרת משתמש {telegram_id}: {current_balance} -> {new_balance}, סכום: {amount}")
-            return True, new_balance
+        from db import get_connection
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    WITH updated AS (
+                        UPDATE users SET balance = COALESCE(balance, 0) + %s, updated_at = NOW()
+                        WHERE telegram_id = %s
+                        RETURNING id, telegram_id, balance
+                    ), recorded AS (
+                        INSERT INTO transactions
+                        (user_id, user_telegram_id, amount, transaction_type, rental_id, notes)
+                        SELECT id, telegram_id, %s, %s, %s, %s FROM updated
+                    )
+                    SELECT balance FROM updated
+                """, (amount, telegram_id, amount, transaction_type, rental_id, notes))
+                row = cur.fetchone()
+        
+        if not row:
+            logger.error(f"ניסיון לעדכן יתרה של משתמש לא קיים: {telegram_id}")
+            return False, 0.0
+        
+        new_balance = float(row['balance'])
+        invalidate_user(telegram_id)
+        logger.info(f"עודכנה יתרת משתמש {telegram_id}: {new_balance - amount} -> {new_balance}, סכום: {amount}")
+        return True, new_balance
     except Exception as e:
         logger.warning(f"DB לא זמין, מעדכן יתרה בזיכרון זמני: {e}")
         # fallback לזיכרון זמני
         if telegram_id in temp_users:
-            temp_users[telegram_id]['balance'] = new_balance
-            from datetime import datetime
-            temp_users[telegram_id]['updated_at'] = datetime.now()
+            user = temp_users[telegram_id]
+            current_balance = float(user.get('balance') or 0.0)
+            new_balance = current_balance + amount
+            user['balance'] = new_balance
+            user['updated_at'] = datetime.now()
             logger.info(f"עודכנה יתרת משתמש בזיכרון {telegram_id}: {current_balance} -> {new_balance}, סכום: {amount}")
             return True, new_balance
     
     logger.error(f"שגיאה בעדכון יתרת משתמש {telegram_id}")
-    return False, current_balance
+    return False, 0.0
+
+def settle_balances(entries: List[Dict[str, Any]]) -> Dict[int, float]:
+    """
+    עדכון יתרות של אצווה שלמה (למשל החזרים יחסיים של ה-watchdog) בפקודה אחת
+    
+    כל רשומה מתועדת כעסקה נפרדת; היתרה של כל משתמש מתעדכנת פעם אחת בסכום
+    הרשומות שלו. משתמשים לא קיימים מדולגים.
+    
+    Args:
+        entries: רשימת מילונים עם telegram_id, amount ואופציונלית
+                 transaction_type, rental_id, notes
+        
+    Returns:
+        מילון של מזהה טלגרם -> יתרה חדשה (רק למשתמשים שעודכנו)
+    """
+    if not entries:
+        return {}
+    
+    rows = [
+        (
+            entry['telegram_id'],
+            entry['amount'],
+            entry.get('transaction_type', 'manual_adjustment'),
+            entry.get('rental_id'),
+            entry.get('notes', ""),
+            position
+        )
+        for position, entry in enumerate(entries)
+    ]
+    
+    try:
+        from db import get_connection
+        from psycopg2.extras import execute_values
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # נעילת המשתמשים בסדר קבוע - אצוות במקביל לא ייתקעו זו על זו
+                cur.execute("""
+                    SELECT telegram_id FROM users
+                    WHERE telegram_id = ANY(%s)
+                    ORDER BY telegram_id
+                    FOR UPDATE
+                """, (sorted({row[0] for row in rows}),))
+                
+                # כל האצווה בעמוד אחד - הסיכום לכל משתמש חייב לראות את כל הרשומות שלו
+                result = execute_values(cur, """
+                    WITH entries (telegram_id, amount, transaction_type, rental_id, notes, position) AS (
+                        VALUES %s
+                    ), totals AS (
+                        SELECT telegram_id, SUM(amount) AS amount FROM entries GROUP BY telegram_id
+                    ), updated AS (
+                        UPDATE users u SET balance = COALESCE(u.balance, 0) + t.amount, updated_at = NOW()
+                        FROM totals t
+                        WHERE u.telegram_id = t.telegram_id
+                        RETURNING u.id, u.telegram_id, u.balance
+                    ), recorded AS (
+                        INSERT INTO transactions
+                        (user_id, user_telegram_id, amount, transaction_type, rental_id, notes)
+                        SELECT u.id, e.telegram_id, e.amount, e.transaction_type, e.rental_id, e.notes
+                        FROM entries e
+                        JOIN updated u ON u.telegram_id = e.telegram_id
+                        ORDER BY e.position
+                    )
+                    SELECT telegram_id, balance FROM updated
+                """, rows,
+                    template="(%s::bigint, %s::numeric, %s::varchar, %s::integer, %s::text, %s::integer)",
+                    page_size=len(rows), fetch=True)
+        
+        balances = {row['telegram_id']: float(row['balance']) for row in result}
+        for telegram_id in balances:
+            invalidate_user(telegram_id)
+        missing = {row[0] for row in rows} - set(balances)
+        if missing:
+            logger.warning(f"דולגו משתמשים לא קיימים בעדכון יתרות: {sorted(missing)}")
+        logger.info(f"עודכנו יתרות של {len(balances)} משתמשים ב-{len(rows)} עסקאות")
+        return balances
+    except Exception as e:
+        logger.warning(f"DB לא זמין, מעדכן יתרות בזיכרון זמני: {e}")
+        # fallback לזיכרון זמני
+        balances = {}
+        for telegram_id, amount, *_ in rows:
+            if telegram_id in temp_users:
+                user = temp_users[telegram_id]
+                user['balance'] = float(user.get('balance') or 0.0) + amount
+                user['updated_at'] = datetime.now()
+                balances[telegram_id] = user['balance']
+        return balances
 
 def get_user_transactions(telegram_id: int, limit: int = 10) -> List[Dict[str, Any]]:
     """
@@ -377,25 +553,14 @@ def is_admin(telegram_id: int) -> bool:
     if telegram_id in Constants.ADMIN_IDS:
         return True
     
-    try:
-        from db import execute_query
-        # בדיקה בדטאבייס
-        query = """
-        SELECT is_admin FROM users WHERE telegram_id = %s
-        """
-        
-        result = execute_query(query, (telegram_id,))
-        
-        if result and result[0]['is_admin']:
-            return True
-    except Exception as e:
-        logger.warning(f"DB לא זמין, בודק מזיכרון זמני: {e}")
-        # fallback לזיכרון זמני
-        user = temp_users.get(telegram_id)
-        if user and user.get('is_admin', False):
-            return True
+    # מנהלים מהדטאבייס - נטענים לזיכרון ומתרעננים כל ADMIN_CACHE_TTL
+    admin_ids = load_admin_ids()
+    if admin_ids is not None:
+        return telegram_id in admin_ids
     
-    return False
+    # fallback לזיכרון זמני
+    user = temp_users.get(telegram_id)
+    return bool(user and user.get('is_admin', False))
 
 def get_all_users() -> List[Dict[str, Any]]:
     """
@@ -455,14 +620,11 @@ def get_user_spending_statistics(telegram_id: int) -> Dict[str, Any]:
     """
     try:
         from db import execute_query
+        # מונים שמתעדכנים בטריגר על transactions (add_analytics_rollups.sql)
         query = """
-        SELECT 
-            SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END) as total_spent,
-            COUNT(DISTINCT r.id) as total_rentals,
-            COUNT(DISTINCT r.keyword) as unique_keywords
-        FROM transactions t
-        LEFT JOIN rentals r ON t.rental_id = r.id
-        WHERE t.user_telegram_id = %s
+        SELECT total_spent, total_rentals, unique_keywords
+        FROM user_spending
+        WHERE user_telegram_id = %s
         """
         
         result = execute_query(query, (telegram_id,))
@@ -492,9 +654,9 @@ def get_total_system_revenue() -> float:
     """
     try:
         from db import execute_query
+        # סיכום על טבלת ההכנסות היומיות - שורה לכל יום במקום לכל עסקה
         query = """
-        SELECT SUM(amount) as total FROM transactions 
-        WHERE transaction_type = 'payment'
+        SELECT SUM(revenue) as total FROM daily_revenue
         """
         
         result = execute_query(query)
@@ -516,14 +678,9 @@ def get_daily_revenue() -> Dict[str, float]:
     try:
         from db import execute_query
         query = """
-        SELECT 
-            DATE(created_at) as day,
-            SUM(amount) as revenue
-        FROM transactions
-        WHERE 
-            transaction_type = 'payment' 
-            AND created_at >= NOW() - INTERVAL '7 days'
-        GROUP BY day
+        SELECT day, revenue
+        FROM daily_revenue
+        WHERE day >= (NOW() - INTERVAL '7 days')::date
         ORDER BY day
         """
         
@@ -566,6 +723,7 @@ def update_user_preferences(telegram_id: int, preferences: Dict[str, Any]) -> bo
         
         result = execute_query(query, (prefs_json, telegram_id))
         
+        invalidate_user(telegram_id)
         return result is not None
     except Exception as e:
         logger.warning(f"DB לא זמין, לא ניתן לעדכן העדפות: {e}")
@@ -591,6 +749,9 @@ class UserManager:
     def update_user_balance(self, telegram_id, amount, **kwargs):
         return update_user_balance(telegram_id, amount, **kwargs)
     
+    def settle_balances(self, entries):
+        return settle_balances(entries)
+    
     def get_user_rentals(self, telegram_id, **kwargs):
         return get_user_rentals(telegram_id, **kwargs)
     
@@ -600,6 +761,12 @@ class UserManager:
     def is_admin(self, telegram_id):
         return is_admin(telegram_id)
     
+    def invalidate_user(self, telegram_id):
+        return invalidate_user(telegram_id)
+    
+    def load_admin_ids(self, force=False):
+        return load_admin_ids(force)
+    
     def get_admin_users(self):
         try:
             from db import execute_query
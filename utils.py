@@ -1,8 +1,11 @@
 import os
 import json
+import time
 import asyncio
-from typing import Any, Callable, Coroutine, TypeVar, Optional
-from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+from typing import Any, Callable, Coroutine, Dict, TypeVar, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 def ensure_dir(path: str):
@@ -31,56 +34,267 @@ def print_banner(msg: str):
 # TypeVar for generic return type
 T = TypeVar('T')
 
+# גודל ברירת המחדל של מאגרי ה-threads לפי שם
+POOL_SIZES = {
+    "db": 8,                        # I/O מול מסד הנתונים
+    "file": 4,                      # I/O מול קבצים
+    "cpu": os.cpu_count() or 2,     # עבודת חישוב
+}
+
+
+class InstrumentedExecutor:
+    """
+    מאגר threads עם שם, גודל קבוע ומדידת עומק תור וזמני המתנה/ריצה
+    """
+    
+    def __init__(self, name: str, max_workers: int):
+        """
+        Args:
+            name: שם המאגר
+            max_workers: מספר threads מקסימלי
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"pool-{name}")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_wait = 0.0
+    
+    def submit(self, func: Callable[..., T], *args, **kwargs) -> "Future[T]":
+        """
+        מגיש פונקציה למאגר
+        
+        Args:
+            func: הפונקציה להרצה
+            *args, **kwargs: פרמטרים לפונקציה
+            
+        Returns:
+            Future של התוצאה
+        """
+        submitted = time.monotonic()
+        with self._lock:
+            self._queued += 1
+        # ה-context של הקורא (למשל ה-handler הפעיל למדדים) עובר ל-thread
+        context = contextvars.copy_context()
+        
+        def run():
+            started = time.monotonic()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                wait = started - submitted
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            failed = False
+            try:
+                return context.run(func, *args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._failed += failed
+                    self._total_run += time.monotonic() - started
+        
+        return self._executor.submit(run)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        מחזיר סטטיסטיקות של המאגר
+        
+        Returns:
+            מילון עם עומק תור, משימות רצות, ממוצעי המתנה וריצה (במילישניות)
+        """
+        with self._lock:
+            done = self._completed or 1
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._total_wait / done * 1000, 2),
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+                "avg_run_ms": round(self._total_run / done * 1000, 2),
+            }
+    
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+class ExecutorRegistry:
+    """
+    רישום מאגרי threads משותפים לכל התהליך (db / file / cpu)
+    """
+    
+    def __init__(self, sizes: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            sizes: גודל לכל מאגר לפי שם (ברירת מחדל: POOL_SIZES)
+        """
+        self._sizes = dict(sizes or POOL_SIZES)
+        self._pools: Dict[str, InstrumentedExecutor] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, name: str) -> InstrumentedExecutor:
+        """
+        מחזיר מאגר לפי שם (נוצר בשימוש הראשון)
+        
+        Args:
+            name: שם המאגר
+            
+        Returns:
+            המאגר
+        """
+        pool = self._pools.get(name)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(name)
+                if pool is None:
+                    if name not in self._sizes:
+                        raise KeyError(f"Unknown executor pool: {name}")
+                    pool = self._pools[name] = InstrumentedExecutor(name, self._sizes[name])
+        return pool
+    
+    def register(self, name: str, max_workers: int) -> InstrumentedExecutor:
+        """
+        מגדיר מאגר חדש (או את הגודל של מאגר שעוד לא נוצר)
+        """
+        with self._lock:
+            if name in self._pools:
+                return self._pools[name]
+            self._sizes[name] = max_workers
+        return self.get(name)
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        מחזיר סטטיסטיקות לכל המאגרים שנוצרו
+        """
+        return {name: pool.stats() for name, pool in list(self._pools.items())}
+    
+    def shutdown(self, wait: bool = True):
+        """
+        סוגר את כל המאגרים
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+
+# מאגרי threads משותפים לכל התהליך
+executors = ExecutorRegistry()
+
+
 class AsyncHelper:
     """
     עוזר להריץ פונקציות אסינכרוניות מהקשר סינכרוני
     ולהפך - לנהל תקשורת בין קוד סינכרוני ואסינכרוני
     """
     
-    @staticmethod
-    def run_async(coro: Coroutine) -> Any:
+    # ה-loop הראשי של הבוט (אם נרשם) - קורוטינות מ-threads אחרים רצות עליו
+    _main_loop: Optional[asyncio.AbstractEventLoop] = None
+    # loop גישור ברקע - כשאין loop ראשי רץ
+    _bridge_loop: Optional[asyncio.AbstractEventLoop] = None
+    _bridge_lock = threading.Lock()
+    
+    @classmethod
+    def set_main_loop(cls, loop: asyncio.AbstractEventLoop):
+        """
+        רושם את ה-loop הראשי (של הבוט) כיעד להרצת קורוטינות מ-threads אחרים
+        
+        Args:
+            loop: ה-event loop הראשי
+        """
+        cls._main_loop = loop
+    
+    @classmethod
+    def _get_bridge_loop(cls) -> asyncio.AbstractEventLoop:
+        """
+        מחזיר loop גישור שרץ ב-thread ייעודי (נוצר בשימוש הראשון)
+        """
+        if cls._bridge_loop is None:
+            with cls._bridge_lock:
+                if cls._bridge_loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name="async-bridge", daemon=True)
+                    thread.start()
+                    cls._bridge_loop = loop
+        return cls._bridge_loop
+    
+    @classmethod
+    def run_async(cls, coro: Coroutine, timeout: Optional[float] = None) -> Any:
         """
         מריץ coroutine מהקשר סינכרוני
         
+        הקורוטינה רצה על ה-loop הראשי אם נרשם ורץ, אחרת על loop גישור
+        קבוע - כך שמשימות רקע ונעילות אסינכרוניות שורדות בין קריאות.
+        
         Args:
             coro: הקורוטינה להרצה
+            timeout: זמן המתנה מקסימלי לתוצאה (שניות)
             
         Returns:
             התוצאה מהקורוטינה
+        
+        Raises:
+            RuntimeError: אם נקרא מתוך loop רץ (חסימה שלו הייתה גורמת ל-deadlock)
         """
         try:
-            # נסה לקבל event loop קיים
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # אם יש כבר loop רץ, נשתמש ב-Future
-                return asyncio.run_coroutine_threadsafe(coro, loop).result()
-            else:
-                # אם הלופ לא רץ, נריץ את הקורוטינה עד שתסתיים
-                return loop.run_until_complete(coro)
+            asyncio.get_running_loop()
         except RuntimeError:
-            # אם אין event loop, ניצור אחד חדש
-            return asyncio.run(coro)
+            pass
+        else:
+            coro.close()
+            raise RuntimeError("run_async called from a running event loop - use 'await' instead")
+        
+        loop = cls._main_loop
+        if loop is None or not loop.is_running():
+            loop = cls._get_bridge_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
     
     @staticmethod
     def run_in_thread(func: Callable, *args, **kwargs) -> Any:
         """
-        מריץ פונקציה בלוקינג בthread נפרד
+        מריץ פונקציה בלוקינג בthread נפרד (ממאגר ה-db המשותף)
+        
+        Args:
+            func: הפונקציה להרצה
+            *args, **kwargs: פרמטרים לפונקציה
+            
+        Returns:
+            התוצאה מהפונקציה
+        """
+        return executors.get("db").submit(func, *args, **kwargs).result()
+    
+    @staticmethod
+    async def run_in_pool(pool: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        מריץ פונקציה בלוקינג מתוך קוד אסינכרוני במאגר עם שם
         
         Args:
+            pool: שם המאגר (db / file / cpu)
             func: הפונקציה להרצה
             *args, **kwargs: פרמטרים לפונקציה
             
         Returns:
             התוצאה מהפונקציה
         """
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(func, *args, **kwargs)
-            return future.result()
+        return await asyncio.wrap_future(executors.get(pool).submit(func, *args, **kwargs))
     
     @staticmethod
     async def run_sync_in_async(func: Callable, *args, **kwargs) -> Any:
         """
-        מריץ פונקציה בלוקינג מתוך קוד אסינכרוני
+        מריץ פונקציה בלוקינג מתוך קוד אסינכרוני (במאגר ה-db המשותף)
         
         Args:
             func: הפונקציה להרצה
@@ -89,8 +303,7 @@ class AsyncHelper:
         Returns:
             התוצאה מהפונקציה
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+        return await AsyncHelper.run_in_pool("db", func, *args, **kwargs)
     
     @staticmethod
     def create_task(coro: Coroutine) -> Optional[asyncio.Task]:
@@ -5,11 +5,12 @@ import datetime
 import asyncio
 from typing import List, Dict, Any, Optional, Union
 
-from db import get_connection
 from constants import Constants
-from rank_checker import rank_checker
+from rank_jobs import rank_jobs, KIND_CHECK_ASSET, PRIORITY_WATCHDOG
 from rental_manager import rental_manager
 from notifications import notification_manager
+from profile_editor import profile_editor
+from session_classifier import SessionClassifier
 from utils import AsyncHelper
 
 logger = logging.getLogger(__name__)
@@ -29,6 +30,9 @@ class Watchdog:
         # קצב בדיקות (בשניות)
         self.check_interval = Constants.WATCHDOG_INTERVAL
         
+        # זמן הסיווג מחדש האחרון של סשנים
+        self.last_reclassify_time = 0.0
+        
         # מצב ריצה
         self.is_running = False
         
@@ -109,15 +113,16 @@ class Watchdog:
         """
         try:
             # קבל את ההשכרה
-            rental = rental_manager.get_rental(rental_id)
+            rental, _ = rental_manager.get_rental(rental_id)
             if not rental:
                 logger.warning(f"לא נמצאה השכרה עם מזהה {rental_id}")
                 return
             
-            # בדוק את הדירוג הנוכחי של הנכס
-            rank, tier, error = await rank_checker.check_asset_rank(
-                asset_id=rental['asset_id'],
-                keyword=rental['keyword']
+            # בדוק את הדירוג הנוכחי של הנכס (בעדיפות נמוכה מבדיקות של משתמשים)
+            rank, tier, error = await rank_jobs.run(
+                KIND_CHECK_ASSET,
+                {"asset_id": rental['asset_id'], "keyword": rental['keyword']},
+                PRIORITY_WATCHDOG,
             )
             
             if error:
@@ -160,6 +165,7 @@ class Watchdog:
             # הוסף התראה למשתמש
             notification_manager.add_notification(
                 user_id=rental['user_id'],
+                rental_id=rental['id'],
                 notification_type="rank_dropped",
                 title="ירידה בדירוג השכרה",
                 message=(
@@ -199,6 +205,7 @@ class Watchdog:
                         # נודיע למשתמש על הבעיה
                         notification_manager.add_notification(
                             user_id=rental['user_id'],
+                            rental_id=rental['id'],
                             notification_type="replacement_failed",
                             title="שגיאה בהחלפת נכס",
                             message=(
@@ -211,6 +218,7 @@ class Watchdog:
                     # אין נכס חלופי, צריך להציע זיכוי או ביטול
                     notification_manager.add_notification(
                         user_id=rental['user_id'],
+                        rental_id=rental['id'],
                         notification_type="refund_offer",
                         title="הצעת זיכוי להשכרה",
                         message=(
@@ -254,32 +262,32 @@ class Watchdog:
             # בדוק השכרות שנגמרות תוך 3 שעות
             expiring_rentals = rental_manager.get_rentals_expiring_soon(Constants.EXPIRY_REMINDER_HOURS)
             
-            for rental in expiring_rentals:
-                # אם ההשכרה לא במצב EXPIRING, עדכן את הסטטוס
-                if rental['status'] != Constants.RENTAL_STATUS_EXPIRING:
-                    # עדכן את סטטוס ההשכרה
-                    try:
-                        # update_rental_status אינה פונקציה אסינכרונית - נקרא לה ישירות
-                        success, _ = rental_manager.update_rental_status(
-                            rental_id=rental['id'],
-                            new_status=Constants.RENTAL_STATUS_EXPIRING
-                        )
-                    except Exception as e:
-                        logger.error(f"שגיאה בעדכון סטטוס השכרה {rental['id']}: {str(e)}")
-                        success = False
-                    
-                    if not success:
-                        logger.warning(f"לא הצלחנו לעדכן את סטטוס ההשכרה {rental['id']} ל-EXPIRING")
+            # העבר את כל ההשכרות שעדיין לא במצב EXPIRING במעבר אחד
+            to_mark = [r for r in expiring_rentals if r['status'] != Constants.RENTAL_STATUS_EXPIRING]
+            if to_mark:
+                moved = rental_manager.update_rentals_status(
+                    [r['id'] for r in to_mark],
+                    Constants.RENTAL_STATUS_EXPIRING,
+                    reason="expiry_reminder"
+                )
+                moved_ids = {r['id'] for r in moved}
+                if len(moved_ids) < len(to_mark):
+                    logger.warning(f"{len(to_mark) - len(moved_ids)} השכרות לא עברו ל-EXPIRING")
+                
+                now = datetime.datetime.now()
+                for rental in to_mark:
+                    if rental['id'] not in moved_ids:
+                        continue
                     
                     # חשב כמה שעות נותרו
                     end_time = rental.get('end_time')
                     if end_time:
-                        now = datetime.datetime.now()
                         hours_left = (end_time - now).total_seconds() / 3600
                         
                         # שלח התראה למשתמש
                         notification_manager.add_notification(
                             user_id=rental['user_id'],
+                            rental_id=rental['id'],
                             notification_type="rental_expiring",
                             title="השכרה עומדת להסתיים",
                             message=(
@@ -303,6 +311,7 @@ class Watchdog:
                         # שלח התראה למשתמש
                         notification_manager.add_notification(
                             user_id=rental['user_id'],
+                            rental_id=rental['id'],
                             notification_type="final_reminder",
                             title="תזכורת אחרונה להשכרה",
                             message=(
@@ -318,48 +327,46 @@ class Watchdog:
         בודק השכרות שפג תוקפן ומסיים אותן
         """
         try:
-            now = datetime.datetime.now()
-            
-            # שאילתה ישירה לבסיס הנתונים לקבלת השכרות שפג תוקפן
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT r.*, a.name as asset_name 
-                        FROM rentals r
-                        JOIN assets a ON r.asset_id = a.id
-                        WHERE r.status IN (%s, %s, %s)
-                        AND r.end_time < %s
-                        ORDER BY r.end_time ASC
-                    """, (
-                        Constants.RENTAL_STATUS_ACTIVE,
-                        Constants.RENTAL_STATUS_MONITORING,
-                        Constants.RENTAL_STATUS_EXPIRING,
-                        now
-                    ))
-                    
-                    expired_rentals = [dict(row) for row in cur.fetchall()]
+            # מעבר מרוכז: UPDATE ... RETURNING יחיד לכל ההשכרות שפג תוקפן,
+            # כולל רישום ההיסטוריה באותה טרנזקציה
+            expired_rentals = rental_manager.expire_due_rentals()
             
-            # עבור על כל ההשכרות שפג תוקפן
-            for rental in expired_rentals:
-                # סיים את ההשכרה
-                rental_id = rental['id']
-                # הרץ את הפונקציה האסינכרונית באמצעות AsyncHelper
-                try:
-                    # יוצר קורוטינה ומעביר אותה ל-AsyncHelper
-                    coro = rental_manager.expire_rental(rental_id)
-                    success, error = AsyncHelper.run_async(coro)
-                except Exception as e:
-                    logger.error(f"שגיאה בהפעלת expire_rental: {str(e)}")
-                    success, error = False, str(e)
-                
-                if not success:
-                    logger.error(f"שגיאה בסיום השכרה {rental_id}: {error}")
-                else:
-                    logger.info(f"השכרה {rental_id} הסתיימה בהצלחה")
+            if expired_rentals:
+                expired_ids = [rental['id'] for rental in expired_rentals]
+                logger.info(f"{len(expired_ids)} השכרות הסתיימו בהצלחה: {expired_ids}")
         
         except Exception as e:
             logger.error(f"שגיאה בבדיקת השכרות שפג תוקפן: {str(e)}")
     
+    def recover_stale_renames(self):
+        """
+        משחזר נכסים שנתקעו בשם זמני (לפי יומן השמות)
+        """
+        try:
+            restored = AsyncHelper.run_async(profile_editor.recover_stale_renames())
+            if restored:
+                logger.info(f"{restored} נכסים שוחזרו משם זמני")
+        
+        except Exception as e:
+            logger.error(f"שגיאה בשחזור שמות זמניים: {str(e)}")
+    
+    def reclassify_stale_sessions(self):
+        """
+        מסווג מחדש סשנים שהסיווג שלהם פג (פעם ב-SESSION_RECLASSIFY_INTERVAL)
+        """
+        now = time.time()
+        if now - self.last_reclassify_time < Constants.SESSION_RECLASSIFY_INTERVAL:
+            return
+        self.last_reclassify_time = now
+        
+        try:
+            reclassified = AsyncHelper.run_async(SessionClassifier.reclassify_stale())
+            if reclassified:
+                logger.info(f"{reclassified} סשנים סווגו מחדש")
+        
+        except Exception as e:
+            logger.error(f"שגיאה בסיווג מחדש של סשנים: {str(e)}")
+    
     def archive_old_rentals(self, days_old: Optional[int] = None):
         """
         מעביר השכרות ישנות לארכיון
@@ -428,6 +435,12 @@ class Watchdog:
                 # בדוק השכרות שפג תוקפן
                 self.check_expired_rentals()
                 
+                # שחזר נכסים שנשארו בשם זמני
+                self.recover_stale_renames()
+                
+                # סווג מחדש סשנים שהסיווג שלהם פג
+                self.reclassify_stale_sessions()
+                
                 # בדוק ארכוב פעם ב-24 שעות (כל 12 מחזורים של שעתיים)
                 if datetime.datetime.now().hour == 3:  # רץ בשעה 3 בלילה
                     self.archive_old_rentals()